@@ -0,0 +1,153 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tkinter import PhotoImage, TclError
+import instruments
+
+# Album art cache.
+# Pulling the picture out of the ID3 tag, decoding and resizing it is slow, so
+# resized images are kept in a small LRU keyed by a hash of the image data
+# (every song of an album shares one entry) and tracks remember which hash they
+# point to. Art for the songs around the current one can be prepared on a
+# background thread, so going forward/backward finds it ready.
+#
+# PIL images are made on any thread, PhotoImages only on the Tk thread. PIL
+# and eyed3 are only imported once the first song's art is looked up; the
+# default art is kept ready-sized on disk so startup doesn't need either.
+
+ART_SIZE = (350, 250)
+DEFAULT_ART_SIZE = (100, 100)
+
+
+def read_embedded_art(file_path):
+    # Raw bytes of the first picture in the ID3 tag, or None
+    import eyed3
+    try:
+        audio_file = eyed3.load(file_path)
+    except Exception:
+        return None
+    if audio_file and audio_file.tag and audio_file.tag.images:
+        return audio_file.tag.images[0].image_data
+    return None
+
+
+# File name for a resized copy of the picture at source, which changes when
+# the picture does. Not going by mtimes: a one-file PyInstaller build unpacks
+# its pictures afresh, with new mtimes, every time it starts.
+def cached_name(source, suffix):
+    with open(source, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+    return f"{os.path.splitext(os.path.basename(source))[0]}_{suffix}_{digest}.png"
+
+
+class AlbumArtCache:
+    def __init__(self, default_path, cache_dir=None, max_images=32, max_tracks=1024):
+        self.default_path = default_path
+        self.cache_dir = cache_dir
+        self.max_images = max_images
+        self.max_tracks = max_tracks
+        self.lock = threading.Lock()
+        self.tracks = OrderedDict()  # path -> (mtime, image hash or None for no art)
+        self.images = OrderedDict()  # image hash -> resized PIL image
+        self.photos = OrderedDict()  # image hash -> PhotoImage
+        self.default_photo = None
+        self.prefetcher = ThreadPoolExecutor(max_workers=1)
+
+    # Decoded once and reused for every song without art
+    def get_default_photo(self):
+        if self.default_photo is None:
+            self.default_photo = self.load_cached_default() or self.make_default_photo()
+        return self.default_photo
+
+    def default_cache_path(self):
+        width, height = DEFAULT_ART_SIZE
+        return os.path.join(self.cache_dir, cached_name(self.default_path, f"{width}x{height}"))
+
+    def load_cached_default(self):
+        if self.cache_dir is None:
+            return None
+        try:
+            return PhotoImage(file=self.default_cache_path())
+        except (OSError, TclError):
+            return None
+
+    def make_default_photo(self):
+        from PIL import Image, ImageTk
+        img = Image.open(self.default_path)
+        img = img.resize(DEFAULT_ART_SIZE)
+        if self.cache_dir is not None:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                img.save(self.default_cache_path())
+            except OSError:
+                pass
+        return ImageTk.PhotoImage(img)
+
+    def remember(self, cache, key, value, limit):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > limit:
+            cache.popitem(last=False)
+
+    # Find (or make) the resized image for a track, returns its hash
+    def load(self, file_path):
+        try:
+            mtime = os.stat(file_path).st_mtime_ns
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.tracks.get(file_path)
+            if entry is not None and entry[0] == mtime:
+                self.tracks.move_to_end(file_path)
+                if entry[1] is None or entry[1] in self.images:
+                    return entry[1]
+        image_data = read_embedded_art(file_path)
+        image_hash = None
+        if image_data:
+            image_hash = hashlib.sha1(image_data).hexdigest()
+            with self.lock:
+                cached = image_hash in self.images
+            if not cached:
+                from PIL import Image
+                try:
+                    with instruments.timed("album_art.decode"):
+                        img = Image.open(BytesIO(image_data))
+                        img = img.resize(ART_SIZE)
+                        img.load()
+                except Exception as e:
+                    instruments.error("album_art", e)
+                    image_hash = None
+                else:
+                    with self.lock:
+                        self.remember(self.images, image_hash, img, self.max_images)
+        with self.lock:
+            self.remember(self.tracks, file_path, (mtime, image_hash), self.max_tracks)
+        return image_hash
+
+    # PhotoImage for a track, call from the Tk thread
+    def get_photo(self, file_path):
+        image_hash = self.load(file_path)
+        if image_hash is None:
+            return self.get_default_photo()
+        photo = self.photos.get(image_hash)
+        if photo is None:
+            with self.lock:
+                img = self.images.get(image_hash)
+            if img is None:
+                return self.get_default_photo()
+            from PIL import ImageTk
+            with instruments.timed("album_art.photo"):
+                photo = ImageTk.PhotoImage(img)
+        self.remember(self.photos, image_hash, photo, self.max_images)
+        return photo
+
+    # Get art for these tracks ready in the background
+    def prefetch(self, file_paths):
+        for file_path in file_paths:
+            self.prefetcher.submit(self.load, file_path)
+
+    def close(self):
+        self.prefetcher.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,96 @@
+# Time-to-first-audio and peak RSS for starting a track, comparing the old
+# pygame.mixer.Sound(path).get_length() lookup with the header based one.
+#
+#   python benchmarks/duration.py [track ...]
+#
+# Without arguments a 10 minute WAV and a 10 minute CBR mp3 are generated in a
+# temp folder. Each measurement runs in a fresh interpreter so peak RSS isn't
+# shared between runs. Needs pygame; the audio driver is set to dummy.
+import os
+import sys
+import json
+import time
+import wave
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEN_MINUTES = 600
+
+
+def make_wav(path, seconds=TEN_MINUTES):
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        silence = b"\0" * 44100 * 4
+        for _ in range(seconds):
+            wav.writeframes(silence)
+
+
+def make_mp3(path, seconds=TEN_MINUTES):
+    # MPEG 1 layer III, 128 kbps, 44.1 kHz, silent frames
+    frame = b"\xff\xfb\x90\x00" + b"\0" * 413
+    count = int(seconds * 44100 / 1152)
+    with open(path, "wb") as f:
+        f.write(frame * count)
+
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def run_once(mode, path):
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import pygame
+    import metadata
+    pygame.mixer.init()
+    baseline = peak_rss_kb()
+    start = time.perf_counter()
+    pygame.mixer.music.load(path)
+    if mode == "sound":
+        length = pygame.mixer.Sound(path).get_length()
+    else:
+        length = metadata.MetadataCache().duration(path)
+    pygame.mixer.music.play()
+    elapsed = time.perf_counter() - start
+    pygame.mixer.music.stop()
+    print(json.dumps({"length": length, "seconds": elapsed,
+                      "baseline_kb": baseline, "peak_kb": peak_rss_kb()}))
+
+
+def measure(mode, path):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run", mode, path],
+        check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(paths):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if not paths:
+            paths = [os.path.join(temp_dir, "ten_minutes.wav"),
+                     os.path.join(temp_dir, "ten_minutes.mp3")]
+            make_wav(paths[0])
+            make_mp3(paths[1])
+        print(f"{'track':<24}{'lookup':<10}{'length s':>10}{'first audio ms':>16}{'peak RSS MB':>13}")
+        for path in paths:
+            for mode in ("sound", "headers"):
+                result = measure(mode, path)
+                peak = result["peak_kb"]
+                peak = f"{peak / 1024:.1f}" if peak is not None else "n/a"
+                print(f"{os.path.basename(path):<24}{mode:<10}{result['length']:>10.1f}"
+                      f"{result['seconds'] * 1000:>16.1f}{peak:>13}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--run":
+        run_once(sys.argv[2], sys.argv[3])
+    else:
+        main(sys.argv[1:])
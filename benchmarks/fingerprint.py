@@ -0,0 +1,123 @@
+# Duplicate finding: how fast fingerprints are made (with the loudness
+# analysis, on the process pool), whether copies of a song are found, and how
+# long the LSH index takes to find them among many songs, against comparing
+# with every fingerprint.
+#
+#   python benchmarks/fingerprint.py [songs] [library]      (default 16 100000)
+#
+# Songs are WAVs of random tones made in a temp folder, each with a copy that
+# is low-passed, quieter, noisier and starts later, like a re-encode. The
+# library is those fingerprints among random ones. Needs NumPy.
+import os
+import sys
+import time
+import wave
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import loudness  # noqa: E402
+import library_db  # noqa: E402
+import fingerprint  # noqa: E402
+from metadata import TrackInfo  # noqa: E402
+
+RATE = 44100
+
+
+def make_song(seed, seconds):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    t = np.arange(seconds * RATE) / RATE
+    samples = np.zeros(len(t))
+    for _ in range(24):
+        envelope = np.interp(t, np.linspace(0, seconds, seconds // 2), rng.uniform(0, 1, seconds // 2) ** 2)
+        samples += np.sin(2 * np.pi * rng.uniform(60, 8000) * t) * envelope
+    return samples / np.abs(samples).max() * 0.8
+
+
+def make_copy(samples, seed):
+    import numpy as np
+    spectrum = np.fft.rfft(samples)
+    spectrum[np.fft.rfftfreq(len(samples), 1 / RATE) > 16000] = 0
+    copy = np.fft.irfft(spectrum, len(samples)) * 0.7
+    copy += np.random.default_rng(seed).normal(0, copy.std() * 0.01, len(copy))
+    return np.concatenate((np.zeros(int(0.03 * RATE)), copy))
+
+
+def write_wav(path, samples):
+    import numpy as np
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(RATE)
+        pcm = np.clip(samples * 32767, -32767, 32767).astype("<i2")
+        wav.writeframes(np.repeat(pcm[:, None], 2, axis=1).tobytes())
+
+
+def best_of(function, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(songs, library):
+    import numpy as np
+    with tempfile.TemporaryDirectory() as folder:
+        tracks = []
+        for i in range(songs):
+            samples = make_song(i, 120 + 10 * i)
+            for name, audio in ((f"{i:03}.wav", samples), (f"{i:03} copy.wav", make_copy(samples, i))):
+                path = os.path.join(folder, name)
+                write_wav(path, audio)
+                tracks.append(TrackInfo(path, size=os.path.getsize(path), duration=len(audio) / RATE,
+                                        date_added=0))
+
+        index = library_db.LibraryIndex(os.path.join(folder, "library.db"))
+        index.save(tracks)
+        analyzer = loudness.LoudnessAnalyzer(index)
+        start = time.perf_counter()
+        analyzer.start(index.unanalysed())
+        analyzer.thread.join()
+        seconds = time.perf_counter() - start
+        print(f"{analyzer.progress.tracks} songs analysed on {analyzer.workers} processes: "
+              f"{analyzer.progress.tracks / seconds:.1f} songs/s, "
+              f"{analyzer.progress.audio_seconds / seconds:.0f} audio s/s (with loudness)")
+
+        rows = index.fingerprints()
+        index.close()
+        groups = fingerprint.find_duplicates(rows)
+        found = sum(1 for group in groups if len(group) == 2
+                    and {os.path.basename(row[0])[:3] for row in group} == {os.path.basename(group[0][0])[:3]})
+        print(f"copies found: {found} of {songs}, groups: {len(groups)}")
+        by_path = {row[0]: row[3] for row in rows}
+        distances = [fingerprint.FingerprintIndex(
+            [by_path[os.path.join(folder, f"{i:03}.wav")], by_path[os.path.join(folder, f"{i:03} copy.wav")]],
+            [0, 0]).distances([0], [1])[0] for i in range(songs)]
+        print(f"bits differing between copies: max {max(distances)}, mean {np.mean(distances):.0f} "
+              f"of {fingerprint.FINGERPRINT_BITS} (same song up to {fingerprint.MAX_DISTANCE})")
+
+        # The real fingerprints among random ones
+        rng = np.random.default_rng(0)
+        fingerprints = [row[3] for row in rows]
+        fingerprints += [bytes(row) for row in rng.integers(
+            0, 256, (library - len(rows), fingerprint.FINGERPRINT_BYTES), dtype=np.uint8)]
+        durations = [row[2] for row in rows] + list(rng.uniform(120, 400, library - len(rows)))
+        start = time.perf_counter()
+        lsh = fingerprint.FingerprintIndex(fingerprints, durations)
+        build = time.perf_counter() - start
+        queries = range(len(rows))
+        query = best_of(lambda: [lsh.query(row) for row in queries]) / len(rows)
+        everything = np.arange(len(lsh))
+        scan = best_of(lambda: [lsh.distances(np.full(len(lsh), row), everything) for row in queries]) / len(rows)
+        pairs = best_of(lsh.groups, 1)
+        print(f"{library} songs: index built in {build * 1000:.0f} ms, "
+              f"query {query * 1e6:.0f} us (comparing with all: {scan * 1e6:.0f} us), "
+              f"all duplicates in {pairs * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [16, 100000][len(args):]))
@@ -0,0 +1,44 @@
+# Cost of the instrumentation calls left in the code, off (the default) and
+# on, per call. Off has to stay cheap enough not to matter in the progress
+# tick or a search.
+#
+#   python benchmarks/instruments.py [calls]      (default 1000000)
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import instruments  # noqa: E402
+
+
+def per_call(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls
+
+
+def timed_block():
+    with instruments.timed("bench.timed"):
+        pass
+
+
+def main(calls):
+    baseline = per_call(lambda: None, calls)
+    print(f"{'':<10}{'timed ns':>10}{'record ns':>11}{'count ns':>10}")
+    for enabled in (False, True):
+        if enabled:
+            instruments.enable()
+        costs = [per_call(function, calls) - baseline for function in (
+            timed_block,
+            lambda: instruments.record("bench.record", 1.5),
+            lambda: instruments.count("bench.count"))]
+        print(f"{'on' if enabled else 'off':<10}{costs[0] * 1e9:>10.0f}{costs[1] * 1e9:>11.0f}"
+              f"{costs[2] * 1e9:>10.0f}")
+    print()
+    print(instruments.report())
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,71 @@
+# Loudness analysis throughput (seconds of audio analysed per wall second) for
+# different numbers of worker processes, plus a check of the meter against
+# the BS.1770 reference: a full scale 997 Hz stereo sine reads 0.0 LUFS.
+#
+#   python benchmarks/loudness.py [tracks] [seconds]      (default 16 tracks of 180 s)
+#
+# Tracks are WAVs of noise at different levels made in a temp folder. Needs
+# NumPy.
+import os
+import sys
+import time
+import wave
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import loudness  # noqa: E402
+import library_db  # noqa: E402
+from metadata import TrackInfo  # noqa: E402
+
+
+def make_wav(path, seconds, level, rate=44100, tone=None):
+    import numpy as np
+    rng = np.random.default_rng(len(path))
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        for start in range(0, seconds, 10):
+            t = np.arange(start * rate, (start + 10) * rate) / rate
+            if tone:
+                samples = np.sin(2 * np.pi * tone * t)
+            else:
+                samples = rng.uniform(-1, 1, len(t))
+            samples = np.repeat((samples * level * 32767)[:, None], 2, axis=1)
+            wav.writeframes(samples.astype("<i2").tobytes())
+
+
+def run(folder, paths, workers):
+    index = library_db.LibraryIndex(os.path.join(folder, f"library-{workers}.db"))
+    index.save([TrackInfo(path, date_added=0) for path in paths])
+    analyzer = loudness.LoudnessAnalyzer(index, workers=workers)
+    start = time.perf_counter()
+    analyzer.start(index.unanalysed())
+    analyzer.thread.join()
+    seconds = time.perf_counter() - start
+    index.close()
+    return seconds, analyzer.progress
+
+
+def main(tracks, seconds):
+    with tempfile.TemporaryDirectory() as folder:
+        reference = os.path.join(folder, "reference.wav")
+        make_wav(reference, 10, 1.0, rate=48000, tone=997)
+        print(f"reference sine: {loudness.analyse(reference)[1]:.2f} LUFS (expected 0.00)")
+
+        paths = []
+        for i in range(tracks):
+            path = os.path.join(folder, f"{i:03}.wav")
+            make_wav(path, seconds, 0.9 ** i)
+            paths.append(path)
+        print(f"{'workers':>8}{'tracks':>8}{'audio s':>10}{'wall s':>9}{'audio s/s':>11}")
+        for workers in sorted({1, 2, os.cpu_count() or 1}):
+            wall, progress = run(folder, paths, workers)
+            print(f"{workers:>8}{progress.tracks:>8}{progress.audio_seconds:>10.0f}{wall:>9.2f}"
+                  f"{progress.audio_seconds / wall:>11.0f}")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [16, 180][len(args):]))
@@ -0,0 +1,72 @@
+# Memory used to hold the library, comparing the old layout (the library, the
+# play queue and the search results as lists of full path strings plus a
+# (path, datetime) list for sorting) with track_table.TrackTable and arrays of
+# track ids. Each layout is built in its own subprocess so peak RSS is its own.
+#
+#   python benchmarks/memory.py [size ...]      (default 100000 1000000)
+import os
+import sys
+import datetime
+import subprocess
+import tracemalloc
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from suite import make_tracks  # noqa: E402
+from track_table import TrackTable  # noqa: E402
+
+
+def paths_layout(tracks):
+    songs = [track.path for track in tracks]
+    details = [(track.path, datetime.datetime.fromtimestamp(track.date_added)) for track in tracks]
+    queue = list(songs)
+    paths = set(songs)
+    durations = {track.path: track.duration for track in tracks}
+    return songs, details, queue, paths, durations
+
+
+def table_layout(tracks):
+    table = TrackTable()
+    songs = array("I", (table.add_track(track) for track in tracks))
+    queue = array("I", songs)
+    members = bytearray(b"\1") * len(songs)
+    return table, songs, queue, members
+
+
+LAYOUTS = {"paths": paths_layout, "table": table_layout}
+
+
+def peak_rss_kb():
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+def measure(layout, size):
+    # What the layout keeps once the TrackInfo objects from the index are gone
+    tracemalloc.start()
+    tracks = make_tracks(size)
+    held = LAYOUTS[layout](tracks)  # noqa: F841, kept alive while measuring
+    del tracks
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(current, peak_rss_kb())
+
+
+def main(sizes):
+    print(f"{'tracks':>9} {'layout':<8}{'held MB':>10}{'per track':>11}{'peak RSS MB':>13}")
+    for size in sizes:
+        for layout in LAYOUTS:
+            output = subprocess.run([sys.executable, __file__, "--measure", layout, str(size)],
+                                    capture_output=True, text=True, check=True).stdout.split()
+            held, rss = int(output[0]), int(output[1])
+            print(f"{size:>9} {layout:<8}{held / 2 ** 20:>10.1f}{held / size:>9.0f} B"
+                  f"{rss / 1024:>13.1f}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], int(sys.argv[3]))
+    else:
+        main([int(size) for size in sys.argv[1:]] or [100000, 1000000])
@@ -0,0 +1,62 @@
+# Playlist files and saved sessions at library sizes: writing and streaming
+# back M3U8 and PLS files, filling the queue from one, and saving and restoring
+# a session whose queue is a playlist (the slow case, a plain library queue
+# only saves a few numbers).
+#
+#   python benchmarks/playlists.py [sizes ...]      (default 10000 100000)
+#
+# Songs are made up (see suite.py) and never touched on disk.
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core  # noqa: E402
+import session  # noqa: E402
+import playlists  # noqa: E402
+from suite import make_tracks  # noqa: E402
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def main(sizes):
+    print(f"{'songs':>8}{'format':>7}{'write ms':>10}{'read ms':>9}{'queue ms':>10}"
+          f"{'save ms':>9}{'restore ms':>12}")
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            tracks = make_tracks(size)
+            player = core.Player()
+            player.load_library(tracks)
+            player.sort("title")
+            for extension in (".m3u8", ".pls"):
+                path = os.path.join(folder, f"{size}{extension}")
+                write, _ = timed(lambda: playlists.write_playlist(path, player.playlist_entries()))
+                read, entries = timed(lambda: list(playlists.read_playlist(path)))
+
+                # Into a fresh player that knows none of the songs
+                fresh = core.Player()
+                queue, _ = timed(lambda: fresh.queue_entries(entries, replace=True))
+
+                # A session with that playlist as the queue, restored on top
+                # of the library as at startup
+                fresh.play_index(size // 2)
+                fresh.seek(30)
+                store = session.SessionStore(folder)
+                save, _ = timed(lambda: store.save(fresh))
+                restored = core.Player()
+                restored.load_library(tracks)
+                restore, _ = timed(lambda: restored.restore(*session.SessionStore(folder).load()))
+                assert restored.queue.index == size // 2
+                assert restored.path(restored.queue.current()) == fresh.path(fresh.queue.current())
+                print(f"{size:>8}{extension:>7}{write * 1000:>10.1f}{read * 1000:>9.1f}"
+                      f"{queue * 1000:>10.1f}{save * 1000:>9.1f}{restore * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10000, 100000])
@@ -0,0 +1,70 @@
+# Search latency against library size, comparing the old linear scan over
+# os.path.basename(song).lower() with search.SearchIndex.
+#
+#   python benchmarks/search.py [size ...]
+#
+# Libraries are made of synthetic file names, nothing is read from disk.
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search  # noqa: E402
+from track_table import TrackTable  # noqa: E402
+
+WORDS = ("love", "night", "summer", "dance", "heart", "fire", "dream", "rain",
+         "city", "blue", "moon", "road", "home", "light", "river", "gold")
+QUERIES = ("l", "lo", "lov", "love", "love n", "river", "zzz", "summer dr")
+
+
+def make_library(size, seed=1):
+    rng = random.Random(seed)
+    return [os.path.join("music", f"artist {rng.randrange(size // 10 + 1)}",
+                         f"{rng.randrange(99):02} {' '.join(rng.sample(WORDS, 3))} {i}.mp3")
+            for i in range(size)]
+
+
+def linear_search(library, term):
+    return [song for song in library if term.lower() in os.path.basename(song).lower()]
+
+
+def best_of(function, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(sizes):
+    print(f"{'tracks':>8}{'build ms':>10}{'query':>12}{'linear ms':>11}{'fresh ms':>10}{'typed ms':>10}")
+    for size in sizes:
+        library = make_library(size)
+        table = TrackTable()
+        index = search.SearchIndex(table.dates)
+        start = time.perf_counter()
+        for date, path in enumerate(library):
+            index.add(table.add(path, date), search.search_text(path))
+        build = time.perf_counter() - start
+        for query in QUERIES:
+            linear = best_of(lambda: linear_search(library, query))
+
+            def fresh():
+                index.last_query = None
+                index.search(query)
+
+            def typed():
+                # Typing the query one letter at a time, like the search box does
+                index.last_query = None
+                for end in range(1, len(query) + 1):
+                    index.search(query[:end])
+
+            print(f"{size:>8}{build * 1000:>10.1f}{query!r:>12}{linear * 1000:>11.2f}"
+                  f"{best_of(fresh) * 1000:>10.2f}{best_of(typed) * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [1000, 10000, 20000, 100000])
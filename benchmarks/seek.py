@@ -0,0 +1,96 @@
+# Seeking in mp3s with the seek index (metadata.SeekIndex) against walking
+# the frame headers from the top, and how far off the position is when the
+# byte offset is estimated from the average bitrate instead (what a seek
+# without an index amounts to).
+#
+#   python benchmarks/seek.py [minutes ...]      (default 3 60)
+#
+# Tracks are silent CBR (128 kbps) and VBR (random bitrate per frame) mp3s
+# made in a temp folder; only the frame headers matter for seeking.
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metadata  # noqa: E402
+
+SEEKS = 200
+
+
+def make_mp3(path, minutes, vbr, rate=44100):
+    # MPEG-1 layer III, 44.1 kHz, stereo: 1152 samples per frame
+    rng = random.Random(minutes)
+    frames = {}
+    for bitrate_index in range(1, 15):
+        header = bytes([0xFF, 0xFB, bitrate_index << 4, 0x00])
+        length = metadata.parse_mp3_header(header, 0).length
+        frames[bitrate_index] = header + bytes(length - 4)
+    count = int(minutes * 60 * rate / 1152)
+    with open(path, "wb") as f:
+        f.write(b"ID3\x03\x00\x00\x00\x00\x00\x00")
+        for _ in range(count):
+            f.write(frames[rng.randrange(1, 15) if vbr else 9])
+
+
+def scan_locate(path, seconds):
+    # No index: walk every header up to the frame
+    with open(path, "rb") as f:
+        data = f.read()
+    frame = None
+    for frame_number, frame in enumerate(metadata.iter_mp3_frames(data)):
+        if (frame_number + 1) * frame.samples / frame.sample_rate > seconds:
+            break
+    return frame.offset
+
+
+def timed(function, targets):
+    start = time.perf_counter()
+    results = [function(target) for target in targets]
+    return (time.perf_counter() - start) / len(targets), results
+
+
+def main(lengths):
+    # build: making the index once, seek: finding the frame for a time
+    print(f"{'track':>10}{'build ms':>10}{'index seek us':>15}{'scan seek us':>14}"
+          f"{'index err ms':>14}{'estimate err ms':>17}")
+    with tempfile.TemporaryDirectory() as folder:
+        for minutes in lengths:
+            for vbr in (False, True):
+                path = os.path.join(folder, f"{minutes}-{vbr}.mp3")
+                make_mp3(path, minutes, vbr)
+                with open(path, "rb") as f:
+                    data = f.read()
+                frames = list(metadata.iter_mp3_frames(data))
+                frame_time = frames[0].samples / frames[0].sample_rate
+                starts = {frame.offset: number * frame_time for number, frame in enumerate(frames)}
+
+                start = time.perf_counter()
+                index = metadata.read_seek_index(path)
+                build = time.perf_counter() - start
+                rng = random.Random(1)
+                targets = [rng.uniform(0, index.duration()) for _ in range(SEEKS)]
+
+                located, results = timed(lambda target: index.locate(path, target), targets)
+                # Where playback starts against where the index says it does
+                index_error = max(abs(starts[offset] - seconds) for offset, seconds in results)
+                scanned, _ = timed(lambda target: scan_locate(path, target), targets[:10])
+                # Average bitrate: right for CBR, off by however much the
+                # bitrate wanders before the target for VBR
+                audio_bytes = len(data) - frames[0].offset
+                estimate_error = 0
+                for target in targets:
+                    guess = frames[0].offset + target / index.duration() * audio_bytes
+                    frame = metadata.find_mp3_frame(data, int(guess))
+                    estimate_error = max(estimate_error, abs(starts[frame.offset] - target))
+
+                name = f"{minutes}m {'VBR' if vbr else 'CBR'}"
+                print(f"{name:>10}{build * 1000:>10.1f}{located * 1e6:>15.1f}{scanned * 1e6:>14.0f}"
+                      f"{index_error * 1000:>14.1f}"
+                      f"{estimate_error * 1000:>17.1f}")
+
+
+if __name__ == "__main__":
+    main([int(minutes) for minutes in sys.argv[1:]] or [3, 60])
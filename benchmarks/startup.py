@@ -0,0 +1,61 @@
+# Startup time: how long importing player.py takes and how long until the
+# window has been drawn for the first time, then until the library is loaded.
+#
+#   python benchmarks/startup.py [runs]
+#
+# Every run is a fresh interpreter, like double clicking the exe. Needs a
+# display, ttkthemes and pygame, same as the player itself.
+import os
+import sys
+import json
+import time
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_once():
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import player
+    imported = time.perf_counter()
+
+    from ttkthemes import ThemedTk
+    root = ThemedTk()
+    music_player = player.MusicPlayer(root)
+    # Spin the event loop by hand until the window is on screen
+    while not root.winfo_viewable():
+        root.update()
+    root.update_idletasks()
+    first_frame = time.perf_counter()
+    while not music_player.album_art:
+        root.update()
+    ready = time.perf_counter()
+    root.destroy()
+    print(json.dumps({"import": imported - start, "first_frame": first_frame - start,
+                      "ready": ready - start}))
+
+
+def main(runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--run"],
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print(f"{'run':>4}{'import ms':>12}{'first frame ms':>17}{'ready ms':>11}")
+    for number, result in enumerate(results, 1):
+        print(f"{number:>4}{result['import'] * 1000:>12.1f}{result['first_frame'] * 1000:>17.1f}"
+              f"{result['ready'] * 1000:>11.1f}")
+    # The first run fills the icon cache, the rest show a normal start
+    if len(results) > 1:
+        warm = results[1:]
+        print("warm median: " + ", ".join(
+            f"{key} {sorted(result[key] for result in warm)[len(warm) // 2] * 1000:.1f} ms"
+            for key in ("import", "first_frame", "ready")))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--run"]:
+        run_once()
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
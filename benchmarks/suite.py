@@ -0,0 +1,106 @@
+# Throughput of the headless core (core.py) on synthetic libraries, so
+# regressions show up as numbers. No display, sound card or music needed:
+# tracks are made up and playback goes to core.NullBackend.
+#
+#   python benchmarks/suite.py [size ...]      (default 1000 100000 1000000)
+#
+# load      Library filled from the index (what startup does)
+# merge     one scanner batch of 200 tracks merged into the library
+# search    fresh queries and a query typed one letter at a time
+# shuffle   turning shuffle on and stepping through the whole queue in shuffle order
+# skip      forward() through the queue, including queueing the next song
+# metadata  mp3 duration from the frame headers of an in-memory file
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core  # noqa: E402
+import metadata  # noqa: E402
+
+WORDS = ("love", "night", "summer", "dance", "heart", "fire", "dream", "rain",
+         "city", "blue", "moon", "road", "home", "light", "river", "gold")
+BATCH = 200
+SKIPS = 10000
+
+
+def make_tracks(size, seed=1):
+    rng = random.Random(seed)
+    now = time.time()
+    tracks = []
+    for i in range(size):
+        path = os.path.join("music", f"artist {rng.randrange(size // 10 + 1)}",
+                            f"{rng.randrange(99):02} {' '.join(rng.sample(WORDS, 3))} {i}.mp3")
+        tracks.append(metadata.TrackInfo(
+            path, 0, 0, duration=rng.uniform(120, 400), date_added=now - i * 60,
+            title=" ".join(rng.sample(WORDS, 2)), artist=f"artist {i % 1000}"))
+    return tracks
+
+
+def make_mp3(seconds=240):
+    # MPEG 1 layer III, 128 kbps, 44.1 kHz, no VBR header so every frame is walked
+    return (b"\xff\xfb\x90\x00" + b"\0" * 413) * int(seconds * 44100 / 1152)
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def report(size, name, seconds, count, unit):
+    rate = count / seconds if seconds else float("inf")
+    print(f"{size:>9} {name:<10}{seconds * 1000:>12.1f} ms{rate:>16,.0f} {unit}/s")
+
+
+def run(size):
+    tracks = make_tracks(size + BATCH)
+    library_tracks, batch = tracks[BATCH:], tracks[:BATCH]
+    player = core.Player(core.NullBackend(), rng=random.Random(2))
+
+    seconds, _ = timed(lambda: player.load_library(library_tracks))
+    report(size, "load", seconds, size, "tracks")
+
+    seconds, _ = timed(lambda: player.add_tracks(batch))
+    report(size, "merge", seconds, len(batch), "tracks")
+
+    queries = ("lov", "river", "zzz", "artist 12", "summer dr")
+    seconds, _ = timed(lambda: [player.library.search(query) for query in queries])
+    report(size, "search", seconds, len(queries), "queries")
+
+    typed = "summer dream"
+    seconds, _ = timed(lambda: [player.library.search(typed[:end]) for end in range(1, len(typed) + 1)])
+    report(size, "typing", seconds, len(typed), "keys")
+    player.search("")
+
+    player.play()
+    steps = len(player.queue) - 1
+    seconds, _ = timed(lambda: [player.set_shuffle(True)] + [player.queue.step(1) for _ in range(steps)])
+    report(size, "shuffle", seconds, steps, "steps")
+    player.set_shuffle(False)
+
+    player.play_index(0)
+    skips = min(SKIPS, len(player.queue) - 1)
+    seconds, _ = timed(lambda: [player.forward() for _ in range(skips)])
+    report(size, "skip", seconds, skips, "skips")
+    player.shutdown()
+
+
+def run_metadata():
+    data = make_mp3()
+    files = 20
+    seconds, _ = timed(lambda: [metadata.mp3_duration(data) for _ in range(files)])
+    report(files, "metadata", seconds, files, "tracks")
+
+
+def main(sizes):
+    print(f"{'tracks':>9} {'stage':<10}{'time':>15}{'throughput':>18}")
+    for size in sizes:
+        run(size)
+    run_metadata()
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [1000, 100000, 1000000])
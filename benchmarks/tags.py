@@ -0,0 +1,93 @@
+# Tag reading throughput of the folder scanner: reading every new file on the
+# scanner thread (what it used to do) against batches on the process pool.
+#
+#   python benchmarks/tags.py [count]      (default 2000 files)
+#
+# Files are small mp3s with an ID3v2.3 tag (title, artist, album, track) made
+# in a temp folder; every 50th one has a broken tag to check those still come
+# back as tracks. Needs eyed3.
+import os
+import sys
+import time
+import queue
+import struct
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scanner  # noqa: E402
+import library_db  # noqa: E402
+
+FRAME = b"\xff\xfb\x90\x00" + b"\0" * 413  # MPEG 1 layer III, 128 kbps, 44.1 kHz
+
+
+def text_frame(frame_id, text):
+    data = b"\x03" + text.encode("utf-8")  # utf-8 encoding byte
+    return frame_id + struct.pack(">I", len(data)) + b"\0\0" + data
+
+
+def synchsafe(size):
+    return bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+
+
+def id3_tag(title, artist, album, track):
+    frames = (text_frame(b"TIT2", title) + text_frame(b"TPE1", artist)
+              + text_frame(b"TALB", album) + text_frame(b"TRCK", str(track)))
+    return b"ID3\x03\x00\x00" + synchsafe(len(frames)) + frames
+
+
+def make_files(folder, count):
+    for i in range(count):
+        tag = id3_tag(f"song {i}", f"artist {i % 40}", f"album {i % 200}", i % 12 + 1)
+        if i % 50 == 0:
+            tag = tag[:20] + b"\xff" * 30  # frame headers that make no sense
+        with open(os.path.join(folder, f"{i:05}.mp3"), "wb") as f:
+            f.write(tag + FRAME * 40)
+
+
+def scan(folder, readers):
+    index = library_db.LibraryIndex(os.path.join(folder, f"library-{readers}.db"))
+    folder_scanner = scanner.FolderScanner(index, readers=readers)
+    if readers == 0:
+        # Old behaviour: no process pool at all
+        folder_scanner.run = threaded_run(folder_scanner)
+    start = time.perf_counter()
+    folder_scanner.start([folder])
+    folder_scanner.thread.join()
+    seconds = time.perf_counter() - start
+    tracks = 0
+    while True:
+        try:
+            kind, payload = folder_scanner.results.get_nowait()
+        except queue.Empty:
+            break
+        if kind == "tracks":
+            tracks += len(payload)
+    tagged = sum(1 for track in index.load() if track.artist)
+    index.close()
+    return seconds, tracks, tagged
+
+
+def threaded_run(folder_scanner):
+    def run(folders, cancelled, progress):
+        for folder in folders:
+            *_, changed, _ = folder_scanner.scan_directory(folder, cancelled)
+            tracks = folder_scanner.read_here(changed, cancelled)
+            folder_scanner.index.save(tracks)
+            folder_scanner.results.put(("tracks", tracks))
+        progress.done = True
+    return run
+
+
+def main(count):
+    with tempfile.TemporaryDirectory() as folder:
+        make_files(folder, count)
+        print(f"{'readers':<10}{'seconds':>9}{'tracks':>8}{'tagged':>8}{'tracks/s':>10}")
+        for readers in (0, 1, 2, os.cpu_count() or 1):
+            seconds, tracks, tagged = scan(folder, readers)
+            name = "thread" if readers == 0 else f"{readers} proc"
+            print(f"{name:<10}{seconds:>9.2f}{tracks:>8}{tagged:>8}{tracks / seconds:>10.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else 2000)
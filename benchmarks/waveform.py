@@ -0,0 +1,59 @@
+# Waveform overview cost against track length: making the envelope (done once
+# per track in a background process) and looking it up in the mmap cache (done
+# every time a track starts, and shouldn't depend on the length).
+#
+#   python benchmarks/waveform.py [minutes ...]      (default 1 10 60)
+#
+# Tracks are WAVs of a rising tone made in a temp folder. Needs NumPy.
+import os
+import sys
+import time
+import wave
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import waveform  # noqa: E402
+
+
+def make_wav(path, minutes, rate=44100):
+    import numpy as np
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        for start in range(0, minutes * 60, 10):
+            t = np.arange(start * rate, (start + 10) * rate) / rate
+            samples = np.sin(2 * np.pi * 440 * t) * (start / (minutes * 60))
+            samples = np.repeat((samples * 32767)[:, None], 2, axis=1)
+            wav.writeframes(samples.astype("<i2").tobytes())
+
+
+def best_of(function, repeat=200):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(lengths):
+    with tempfile.TemporaryDirectory() as folder:
+        cache = waveform.WaveformCache(os.path.join(folder, "waveforms.bin"))
+        print(f"{'minutes':>8}{'envelope ms':>13}{'lookup us':>11}{'bytes':>7}")
+        for minutes in lengths:
+            path = os.path.join(folder, f"{minutes}.wav")
+            make_wav(path, minutes)
+            start = time.perf_counter()
+            envelope = waveform.compute_envelope(path)
+            compute = time.perf_counter() - start
+            cache.put(waveform.WaveformCache.key(path), *envelope)
+            lookup = best_of(lambda: cache.get(path))
+            size = sum(len(values) for values in cache.get(path))
+            print(f"{minutes:>8}{compute * 1000:>13.1f}{lookup * 1e6:>11.1f}{size:>7}")
+        cache.close()
+
+
+if __name__ == "__main__":
+    main([int(minutes) for minutes in sys.argv[1:]] or [1, 10, 60])
@@ -0,0 +1,796 @@
+import time
+import queue
+import random
+import bisect
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import search
+import instruments
+from metadata import MetadataCache, read_seek_index
+from track_table import TrackTable
+from loudness import track_gain
+
+# The player without the window.
+# Library (every song we know, newest first), PlayQueue (what is listed and
+# played, in what order) and Player (playback on top of an audio backend) hold
+# all of the library, queue and playback logic. MusicPlayer in player.py is a
+# Tk client of these, and benchmarks/ drive them with NullBackend, so none of
+# it needs a display or a sound card to be measured.
+#
+# Songs are ids into one shared track_table.TrackTable; paths are only built
+# when talking to the backend or the disk.
+#
+# A backend is anything with the PlaybackEngine interface (engine.py): play,
+# queue_next, pause, unpause, stop, seek, set_volume, set_gain, shutdown,
+# get_pos, song_length and an `events` queue of ("started" | "ended" | "failed", path).
+# seek(seconds, offset) gets the byte offset of the mp3 frame to start from
+# when the track has a seek index (metadata.SeekIndex), and get_pos is the
+# position in the track, seeks included. The index is looked up (or built from
+# the frame headers) on a background thread when a song starts; a seek before
+# it is ready goes without an offset.
+
+
+class Library:
+    def __init__(self, tracks=None):
+        self.tracks = tracks if tracks is not None else TrackTable()
+        self.songs = array("I")  # track ids, newest first
+        self.members = bytearray()  # track id -> 1 if it is in the library
+        self.search_index = search.SearchIndex(self.tracks.dates)
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __contains__(self, track_id):
+        return track_id < len(self.members) and self.members[track_id] == 1
+
+    def add_member(self, track_id):
+        if track_id >= len(self.members):
+            self.members.extend(bytes(track_id + 1 - len(self.members)))
+        self.members[track_id] = 1
+
+    # Replace everything with tracks that are already sorted newest first
+    def load(self, tracks):
+        self.search_index.clear()
+        self.members = bytearray()
+        songs = array("I")
+        for track in tracks:
+            track_id = self.tracks.add_track(track)
+            self.search_index.add_track(track_id, track)
+            self.add_member(track_id)
+            songs.append(track_id)
+        self.songs = songs
+
+    # Insert tracks where they belong by date added, so the library stays sorted
+    # without re-sorting all of it. Returns (position, track id) for each one.
+    def merge(self, tracks):
+        # The same file once, as last read
+        tracks = list({track.path: track for track in tracks}.values())
+        self.remove({self.tracks.lookup(track.path) for track in tracks} - {None})
+        dates = self.tracks.dates
+        inserted = []
+        for track in tracks:
+            track_id = self.tracks.add_track(track)
+            self.search_index.add_track(track_id, track)
+            position = bisect.bisect_right(
+                self.songs, -dates[track_id], key=lambda song: -dates[song])
+            self.songs.insert(position, track_id)
+            self.add_member(track_id)
+            inserted.append((position, track_id))
+        return inserted
+
+    # Returns the ids that were actually in the library
+    def remove(self, track_ids):
+        track_ids = {track_id for track_id in track_ids if track_id in self}
+        if track_ids:
+            for track_id in track_ids:
+                self.members[track_id] = 0
+                self.search_index.remove(track_id)
+            self.songs = array("I", (song for song in self.songs if song not in track_ids))
+        return track_ids
+
+    def search(self, term):
+        return self.search_index.search(term)
+
+    # Library songs ordered by a tag, see TrackTable.sort_key
+    def sorted(self, by):
+        return array("I", sorted(self.songs, key=self.tracks.sort_key(by)))
+
+    # {artist or album: track ids in album order}, untagged songs under None
+    def grouped(self, by):
+        column = {"artist": self.tracks.artists, "album": self.tracks.albums}[by]
+        groups = {}
+        for track_id in self.sorted(by):
+            groups.setdefault(self.tracks.values[column[track_id]], array("I")).append(track_id)
+        return groups
+
+
+class ShuffleOrder:
+    # A random play order over a queue's songs, drawn one song at a time with a
+    # lazy Fisher-Yates shuffle, so stepping through it is O(1) and the queue
+    # itself is never reordered (turning shuffle off just keeps going in
+    # library order from the current song).
+    #
+    # Slots are the queue's positions when the shuffle started; songs added
+    # later get new slots at the end. Only the swapped part of the pool and the
+    # songs played so far are stored.
+    #
+    # The same order carries on while the queue is filtered, sorted or
+    # replaced: `listed` (a function of a track id) says which songs the queue
+    # shows now, the others are passed over when stepping and put back in the
+    # pool when they are drawn (see put_back).
+    def __init__(self, songs, rng, current=None):
+        self.songs = array("I", songs)  # slot -> track id, a copy so the queue can change
+        self.extra = array("I")  # slots past the end: songs added since
+        self.members = bytearray()  # track id -> 1 if it has a slot
+        self.set_aside = array("I")  # track ids drawn while they weren't listed
+        self.rng = rng
+        self.swaps = {}  # pool index -> slot, where it isn't the same number
+        self.where = {}  # slot -> pool index, the other way round
+        self.drawn = 0  # the pool up to here has been played
+        self.skip = set()  # track ids not to draw any more, removed from the queue
+        self.history = array("I")  # slots in play order
+        self.position = -1  # the current song in history
+        self.version = 0  # the queue's version when this started, see PlayQueue.slot_index
+        for track_id in self.songs:
+            self.add_member(track_id)
+        if current is not None:
+            self.select(current)
+
+    def add_member(self, track_id):
+        if track_id >= len(self.members):
+            self.members.extend(bytes(track_id + 1 - len(self.members)))
+        self.members[track_id] = 1
+
+    def __contains__(self, track_id):
+        return track_id < len(self.members) and self.members[track_id] == 1
+
+    def __len__(self):
+        return len(self.songs) + len(self.extra)
+
+    def track_id(self, slot):
+        if slot < len(self.songs):
+            return self.songs[slot]
+        return self.extra[slot - len(self.songs)]
+
+    # Swap pool[index] to the front of the undrawn part and return its slot
+    def draw_at(self, index):
+        front = self.drawn
+        slot = self.swaps.get(index, index)
+        if index != front:
+            other = self.swaps.get(front, front)
+            self.swaps[index] = other
+            self.where[other] = index
+        self.swaps[front] = slot
+        self.where[slot] = front
+        self.drawn += 1
+        return slot
+
+    def draw(self, listed):
+        while self.drawn < len(self):
+            slot = self.draw_at(self.rng.randrange(self.drawn, len(self)))
+            track_id = self.track_id(slot)
+            if track_id in self.skip:
+                continue
+            if listed(track_id):
+                return slot
+            self.set_aside.append(track_id)
+        return None
+
+    # Songs drawn while filtered out get a new slot in the pool, for when
+    # the queue shows them again
+    def put_back(self):
+        self.extra.extend(self.set_aside)
+        self.set_aside = array("I")
+
+    # Slot offset listed songs away in the play order, drawing new songs past
+    # the end. None when there is nothing there.
+    def step(self, offset, listed):
+        direction = 1 if offset > 0 else -1
+        position = self.position
+        while offset:
+            position += direction
+            if position < 0:
+                return None
+            if position >= len(self.history):
+                slot = self.draw(listed)
+                if slot is None:
+                    return None
+                self.history.append(slot)
+            if listed(self.track_id(self.history[position])):
+                offset -= direction
+            elif direction > 0:
+                # Drawn ahead (peeked at) and filtered out before it played
+                self.set_aside.append(self.track_id(self.history.pop(position)))
+                position -= 1
+        self.position = position
+        return self.history[position]
+
+    def peek(self, listed):
+        position = self.position
+        slot = self.step(1, listed)
+        self.position = position
+        return slot
+
+    # The user picked this slot, it plays now and won't be drawn again
+    def select(self, slot):
+        if self.where.get(slot, slot) >= self.drawn:
+            self.draw_at(self.where.get(slot, slot))
+        self.position += 1
+        self.history.insert(self.position, slot)
+
+    def add(self, track_id):
+        if track_id in self.skip:
+            # Taken out and put back (rescanned): it keeps its old slot
+            self.skip.discard(track_id)
+        else:
+            self.extra.append(track_id)
+            self.add_member(track_id)
+
+    def remove(self, track_ids):
+        self.skip.update(track_ids)
+        history = array("I")
+        position = self.position
+        for index, slot in enumerate(self.history):
+            if self.track_id(slot) in track_ids:
+                if index <= self.position:
+                    position -= 1
+            else:
+                history.append(slot)
+        self.history = history
+        self.position = max(-1, position)
+
+
+class PlayQueue:
+    def __init__(self, rng=None):
+        self.songs = array("I")  # track ids
+        self.index = 0  # the current song
+        self.repeat = False
+        self.filtered = False  # showing search results rather than the library
+        self.rng = rng if rng is not None else random.Random()
+        self.shuffle_order = None  # ShuffleOrder while shuffle is on
+        self.version = 0  # bumped whenever positions in songs move
+        self.positions = None  # track id -> index in songs, made by position() when needed
+        self.positions_version = None  # the version positions was made for
+
+    def __len__(self):
+        return len(self.songs)
+
+    # current: keep this track id current if it is among the new songs
+    def set_songs(self, songs, filtered=False, current=None):
+        self.songs = array("I", songs)
+        self.index = 0
+        if current is not None:
+            self.find(current)
+        self.filtered = filtered
+        self.version += 1
+        order = self.shuffle_order
+        if order is not None:
+            # The same play order goes on over the new songs, with its history
+            order.put_back()
+            for track_id in self.songs:
+                if track_id not in order:
+                    order.add(track_id)
+
+    def current(self):
+        return self.songs[self.index]
+
+    # Make track_id current again after songs moved, if it is still listed
+    def find(self, track_id):
+        try:
+            self.index = self.songs.index(track_id)
+        except ValueError:
+            pass
+
+    def set_shuffle(self, shuffle):
+        self.shuffle_order = None
+        if shuffle:
+            self.shuffle_order = ShuffleOrder(
+                self.songs, self.rng, self.index if self.songs else None)
+            self.shuffle_order.version = self.version
+
+    # Index of track_id in songs, None if it isn't there. The first call after
+    # songs moved maps them all, later ones are O(1).
+    def position(self, track_id):
+        if self.positions_version != self.version:
+            self.positions = {song: index for index, song in enumerate(self.songs)}
+            self.positions_version = self.version
+        return self.positions.get(track_id)
+
+    # Whether the shuffle may play track_id, i.e. it is in songs
+    def listed(self, track_id):
+        if self.shuffle_order.version == self.version:
+            return True  # songs haven't moved, every slot is in them
+        return self.position(track_id) is not None
+
+    # Where a shuffle slot is in songs now
+    def slot_index(self, slot):
+        order = self.shuffle_order
+        if slot < len(order.songs) and order.version == self.version:
+            return slot
+        # Songs were inserted, removed or replaced since the shuffle started
+        return self.position(order.track_id(slot))
+
+    # The song to play after the current one (the same one again on repeat)
+    def next_song(self):
+        if not self.songs:
+            return None
+        if self.repeat:
+            return self.songs[self.index]
+        if self.shuffle_order is not None:
+            slot = self.shuffle_order.peek(self.listed)
+            return None if slot is None else self.shuffle_order.track_id(slot)
+        if self.index < len(self.songs) - 1:
+            return self.songs[self.index + 1]
+        return None
+
+    # Move to the song offset places away (in shuffle order when shuffled)
+    def step(self, offset):
+        if self.shuffle_order is not None:
+            slot = self.shuffle_order.step(offset, self.listed)
+            if slot is None:
+                raise ValueError("No Song in Playlist")
+            self.index = self.slot_index(slot)
+            return self.songs[self.index]
+        index = self.index + offset
+        if not 0 <= index < len(self.songs):
+            raise ValueError("No Song in Playlist")
+        self.index = index
+        return self.songs[index]
+
+    # The user picked the song at index
+    def select(self, index):
+        self.songs[index]  # IndexError for no song
+        self.index = index
+        order = self.shuffle_order
+        if order is not None:
+            if order.version == self.version and index < len(order.songs):
+                order.select(index)
+            else:
+                # Not a slot we can find in O(1), give it a new one
+                track_id = self.songs[index]
+                order.skip.add(track_id)
+                order.extra.append(track_id)
+                order.select(len(order) - 1)
+
+    # keep_current: a song is playing, keep the index pointing at it
+    def insert(self, position, track_id, keep_current=False):
+        self.songs.insert(position, track_id)
+        if keep_current and position <= self.index:
+            self.index += 1
+        self.version += 1
+        if self.shuffle_order is not None:
+            self.shuffle_order.add(track_id)
+
+    def append(self, track_id):
+        self.songs.append(track_id)
+        if self.positions_version == self.version:
+            self.positions.setdefault(track_id, len(self.songs) - 1)
+        if self.shuffle_order is not None:
+            self.shuffle_order.add(track_id)
+
+    def remove(self, track_ids):
+        if not track_ids:
+            return
+        self.index -= sum(1 for song in self.songs[:self.index] if song in track_ids)
+        # In place, the playlist view holds on to this array
+        self.songs[:] = array("I", (song for song in self.songs if song not in track_ids))
+        # The current song was the last one and is gone: the one before it
+        self.index = max(0, min(self.index, len(self.songs) - 1))
+        self.version += 1
+        if self.shuffle_order is not None:
+            self.shuffle_order.remove(track_ids)
+
+    # The backend moved on to track_id by itself, find where that is
+    def follow(self, track_id):
+        order = self.shuffle_order
+        if order is not None and not self.repeat:
+            slot = order.peek(self.listed)
+            if slot is not None and order.track_id(slot) == track_id:
+                self.step(1)
+                return
+        index = self.index
+        if not (0 <= index < len(self.songs) and self.songs[index] == track_id):
+            if index + 1 < len(self.songs) and self.songs[index + 1] == track_id:
+                index += 1
+            elif track_id in self.songs:
+                index = self.songs.index(track_id)
+        self.index = index
+
+
+class Player:
+    def __init__(self, backend=None, metadata=None, rng=None, seek_index=None):
+        self.backend = backend if backend is not None else NullBackend()
+        self.metadata = metadata if metadata is not None else MetadataCache()
+        # path -> metadata.SeekIndex or None, e.g. LibraryIndex.seek_index
+        self.seek_index = seek_index if seek_index is not None else read_seek_index
+        self.seek_track = None  # (track id, its SeekIndex or None) of the song that is playing
+        self.seek_loader = None  # ThreadPoolExecutor for seek_index, made when first needed
+        self.resume_at = None  # (track id, seconds) to start from, see restore()
+        self.urls = {}  # path -> URL of songs downloaded from it, see playlist_entries()
+        self.tracks = TrackTable()
+        self.library = Library(self.tracks)
+        self.queue = PlayQueue(rng)
+        self.playing = False
+        self.paused = False
+        self.replay_gain = True  # even out loudness between tracks, see loudness.py
+
+    # A song is loaded, playing or paused
+    def active(self):
+        return self.playing or self.paused
+
+    # The current song while one is active, None otherwise (or with an empty queue)
+    def active_song(self):
+        return self.queue.current() if self.active() and len(self.queue) else None
+
+    def path(self, track_id):
+        return self.tracks.path(track_id)
+
+    # Library
+
+    def load_library(self, tracks):
+        self.library.load(tracks)
+        self.queue.set_songs(self.library.songs)
+
+    def add_tracks(self, tracks):
+        # The song that is playing, or that a restored session starts from, stays current
+        current = None
+        if len(self.queue) and (self.active() or self.resume_at is not None):
+            current = self.queue.current()
+        existing = {self.tracks.lookup(track.path) for track in tracks}
+        self.queue.remove(self.library.remove(existing - {None}))
+        inserted = self.library.merge(tracks)
+        if not self.queue.filtered:
+            for position, track_id in inserted:
+                self.queue.insert(position, track_id, current is not None)
+        if current in existing:
+            # The song that is playing was rescanned: taken out and put back
+            self.queue.find(current)
+        return inserted
+
+    def remove_tracks(self, paths):
+        track_ids = {self.tracks.lookup(path) for path in paths} - {None}
+        removed = self.library.remove(track_ids)
+        self.queue.remove(removed)
+        return removed
+
+    # A song that isn't part of the library (e.g. added by URL), returns its id
+    def add_to_queue(self, path, date_added=0):
+        track_id = self.tracks.lookup(path)
+        if track_id is None:
+            track_id = self.tracks.add(path, date_added)
+        if track_id not in self.queue.songs:
+            self.queue.append(track_id)
+        return track_id
+
+    # Songs from a playlist, (path, title, seconds) entries as read by
+    # playlists.read_playlist. replace: they become the queue (keeping the
+    # song that is playing current if it is among them), otherwise they are
+    # added to its end. Returns their ids.
+    def queue_entries(self, entries, replace=False):
+        track_ids = array("I")
+        for path, title, seconds in entries:
+            track_id = self.tracks.lookup(path)
+            if track_id is None:
+                # Not scanned, so nothing is known but the playlist's length
+                track_id = self.tracks.add(path, duration=seconds)
+            track_ids.append(track_id)
+        if replace:
+            current = self.active_song()
+            self.queue.set_songs(track_ids, filtered=True, current=current)
+        else:
+            for track_id in track_ids:
+                self.queue.append(track_id)
+        if self.active():
+            self.backend.queue_next(self.prepare_next())
+        return track_ids
+
+    # The queue as (path, title, seconds) entries, for playlists.write_playlist.
+    # Downloaded songs are written as their URL, not the file in the download
+    # cache, which the OS may clear.
+    def playlist_entries(self):
+        tracks, urls = self.tracks, self.urls
+        for track_id in self.queue.songs:
+            title, artist = tracks.title(track_id), tracks.artist(track_id)
+            if title and artist:
+                title = f"{artist} - {title}"
+            path = tracks.path(track_id)
+            yield urls.get(path, path), title, tracks.duration(track_id)
+
+    # Show the songs matching term, or the whole library for an empty term.
+    # Returns the matches; when there are none the queue is left alone.
+    def search(self, term):
+        # The song that is playing stays current if it is still listed
+        current = self.active_song()
+        if not term:
+            self.queue.set_songs(self.library.songs, current=current)
+            return self.queue.songs
+        with instruments.timed("search"):
+            matches = self.library.search(term)
+        if matches:
+            self.queue.set_songs(matches, filtered=True, current=current)
+        return matches
+
+    # List the queue by "artist", "album" or "title" tags, or "date" added
+    def sort(self, by):
+        current = self.active_song()
+        if by == "date" and not self.queue.filtered:
+            self.queue.set_songs(self.library.songs, current=current)
+            return
+        if by == "date":
+            dates = self.tracks.dates
+            key = lambda track_id: (-dates[track_id], track_id)  # noqa: E731
+        else:
+            key = self.tracks.sort_key(by)
+        # Not in library order any more, so scanned songs aren't inserted
+        self.queue.set_songs(sorted(self.queue.songs, key=key), filtered=True, current=current)
+
+    def set_shuffle(self, shuffle):
+        self.queue.set_shuffle(shuffle)
+        if self.active():
+            self.backend.queue_next(self.prepare_next())
+
+    # Playback
+
+    # final: False for a file that is still growing (a download), its length
+    # so far isn't kept
+    def song_length(self, track_id, final=True):
+        length = self.tracks.duration(track_id)
+        if length is None:
+            path = self.tracks.path(track_id)
+            with instruments.timed("duration_lookup"):
+                length = self.metadata.duration(path)
+                if length is None:
+                    # Headers we can't read, let the backend work it out
+                    length = self.backend.song_length(path)
+            if final:
+                self.tracks.set_duration(track_id, length)
+        return length or 0
+
+    # Volume factor that brings a track to the reference loudness
+    def volume_gain(self, track_id):
+        gain = self.tracks.gain(track_id)
+        if gain is None or not self.replay_gain:
+            return 1.0
+        return 10 ** (gain / 20)
+
+    # Path of a song for the backend, which gets its gain along with it
+    def send(self, track_id):
+        path = self.tracks.path(track_id)
+        self.backend.set_gain(path, self.volume_gain(track_id))
+        return path
+
+    # Path of the song to queue after the current one, None for none
+    def prepare_next(self):
+        next_song = self.queue.next_song()
+        return None if next_song is None else self.send(next_song)
+
+    # Start the current song from the top, returns its id
+    def play(self):
+        track_id = self.queue.current()
+        self.stop()
+        # The next song is queued in the backend so it follows without a gap
+        self.backend.play(self.send(track_id), self.prepare_next())
+        self.playing = True
+        self.load_seek_index(track_id)
+        resume_at, self.resume_at = self.resume_at, None
+        if resume_at is not None and resume_at[0] == track_id:
+            self.seek(resume_at[1])
+        return track_id
+
+    def play_index(self, index):
+        self.queue.select(index)
+        return self.play()
+
+    def resume(self):
+        self.backend.unpause()
+        self.paused = False
+        self.playing = True
+
+    def pause(self):
+        if self.playing:
+            self.backend.pause()
+            self.playing = False
+            self.paused = True
+
+    def stop(self):
+        self.backend.stop()
+        self.playing = False
+        self.paused = False
+
+    def forward(self):
+        self.stop()
+        self.queue.step(1)
+        return self.play()
+
+    def backward(self):
+        self.stop()
+        self.queue.step(-1)
+        return self.play()
+
+    # Returns where playback carries on from: for an mp3 with a seek index
+    # the start of the frame holding `seconds`, which the backend starts
+    # decoding at directly
+    def seek(self, seconds):
+        track_id = self.queue.current()
+        path = self.tracks.path(track_id)
+        self.load_seek_index(track_id)
+        offset = None
+        seek_index = self.seek_track[1]
+        if seek_index is not None:
+            try:
+                offset, seconds = seek_index.locate(path, seconds)
+            except OSError:
+                pass  # gone or unreadable, let the backend try
+        self.backend.seek(seconds, offset)
+        return seconds
+
+    # Have track_id's seek index looked up, in seek_track once it is known
+    def load_seek_index(self, track_id):
+        if self.seek_track is not None and self.seek_track[0] == track_id:
+            return
+        self.seek_track = (track_id, None)
+        if self.seek_loader is None:
+            self.seek_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="seek-index")
+        self.seek_loader.submit(self.find_seek_index, track_id, self.tracks.path(track_id))
+
+    # Runs on the seek_loader thread
+    def find_seek_index(self, track_id, path):
+        if self.seek_track[0] != track_id:
+            return  # skipped past it already
+        try:
+            with instruments.timed("seek_index"):
+                seek_index = self.seek_index(path)
+        except OSError:
+            return
+        if self.seek_track[0] == track_id:
+            self.seek_track = (track_id, seek_index)
+
+    # ms into the current song
+    def position(self):
+        return self.backend.get_pos()
+
+    def set_repeat(self, repeat):
+        self.queue.repeat = repeat
+        if self.active():
+            self.backend.queue_next(self.prepare_next())
+
+    def set_volume(self, volume):
+        self.backend.set_volume(volume)
+
+    # Results from loudness.LoudnessAnalyzer: (path, loudness, peak) rows
+    def set_loudness(self, rows):
+        playing = set()
+        if self.active() and len(self.queue):
+            playing.add(self.queue.current())
+            playing.add(self.queue.next_song())
+        for path, loudness, peak in rows:
+            track_id = self.tracks.lookup(path)
+            if track_id is not None:
+                self.tracks.set_gain(track_id, track_gain(loudness, peak))
+                if track_id in playing:
+                    self.send(track_id)
+
+    # Handle what the backend reported since the last call. Returns
+    # (kind, track id) pairs so the caller can update what it shows.
+    def poll(self):
+        events = []
+        while True:
+            try:
+                kind, path = self.backend.events.get_nowait()
+            except queue.Empty:
+                return events
+            track_id = self.tracks.lookup(path)
+            if kind == "started":
+                self.queue.follow(track_id)
+                self.backend.queue_next(self.prepare_next())
+                self.load_seek_index(track_id)
+            elif kind == "failed" and len(self.queue) and track_id != self.queue.current():
+                continue  # only the song queued after this one, which plays on
+            else:  # ended, or couldn't be played
+                self.playing = False
+                self.paused = False
+            events.append((kind, track_id))
+
+    # Where the queue and playback are, for session.SessionStore to save. The
+    # songs themselves are only saved when the queue isn't just the library.
+    def session(self):
+        queue = self.queue
+        current = queue.current() if len(queue) else None
+        position = self.position() / 1000 if self.active() else 0
+        return {"current": None if current is None else self.tracks.path(current),
+                "index": queue.index,
+                "position": max(0, position),
+                "shuffle": queue.shuffle_order is not None,
+                "repeat": queue.repeat,
+                "filtered": queue.filtered}
+
+    # Back to a saved session, after load_library. entries: the saved queue
+    # when it was filtered (see session()). Nothing is checked on disk, the
+    # first play of a song that has gone fails like any unplayable file.
+    # Playback starts from the saved position the next time play() is called.
+    def restore(self, state, entries=()):
+        if state.get("filtered"):
+            self.queue_entries(entries, replace=True)
+        songs = self.queue.songs
+        current = self.tracks.lookup(state["current"]) if state.get("current") else None
+        index = state.get("index", 0)
+        if not (0 <= index < len(songs) and songs[index] == current):
+            # The library changed since, find the song again
+            index = songs.index(current) if current is not None and current in songs else 0
+        self.queue.index = index
+        self.queue.repeat = bool(state.get("repeat"))
+        self.queue.set_shuffle(bool(state.get("shuffle")))
+        if current is not None and state.get("position"):
+            self.resume_at = (current, state["position"])
+
+    def shutdown(self):
+        self.stop()
+        self.backend.shutdown()
+        if self.seek_loader is not None:
+            self.seek_loader.shutdown(wait=False, cancel_futures=True)
+
+
+class NullBackend:
+    # Stands in for the pygame engine: takes the same commands, plays nothing.
+    # finish() pretends the current song ran out.
+    def __init__(self):
+        self.events = queue.Queue()
+        self.current = None
+        self.next_path = None
+        self.started = None
+        self.paused_at = None
+        self.volume = 1.0
+        self.gains = {}
+
+    def play(self, path, next_path=None):
+        self.current = path
+        self.next_path = next_path
+        self.started = time.monotonic()
+        self.paused_at = None
+
+    def queue_next(self, path):
+        self.next_path = path
+
+    def pause(self):
+        if self.paused_at is None:
+            self.paused_at = time.monotonic()
+
+    def unpause(self):
+        if self.paused_at is not None and self.started is not None:
+            self.started += time.monotonic() - self.paused_at
+        self.paused_at = None
+
+    def stop(self):
+        self.current = self.next_path = self.started = self.paused_at = None
+
+    def seek(self, seconds, offset=None):
+        if self.started is not None:
+            self.started = (self.paused_at or time.monotonic()) - seconds
+
+    def set_volume(self, volume):
+        self.volume = volume
+
+    def set_gain(self, path, gain):
+        self.gains[path] = gain
+
+    def shutdown(self):
+        self.stop()
+
+    def get_pos(self):
+        if self.started is None:
+            return -1
+        return int(((self.paused_at or time.monotonic()) - self.started) * 1000)
+
+    def song_length(self, path):
+        return None
+
+    def finish(self):
+        if self.current is None:
+            return
+        if self.next_path is not None:
+            self.current, self.next_path = self.next_path, None
+            self.started = time.monotonic()
+            self.events.put(("started", self.current))
+        else:
+            self.events.put(("ended", self.current))
+            self.stop()
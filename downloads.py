@@ -0,0 +1,145 @@
+import os
+import time
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import instruments
+
+# Background downloads for songs added by URL.
+# All downloads share one requests.Session (so connections are reused) and run
+# on a small pool, streaming straight to a file in the cache folder in large
+# chunks. Files are named after a hash of the URL, so two URLs that end in the
+# same file name don't overwrite each other and adding a URL again is free.
+# An interrupted download leaves a ".incomplete" marker next to the file and is
+# resumed with an HTTP Range request. The file is written in place (never
+# renamed) so it can be played while the rest is still coming in.
+
+CHUNK_SIZE = 256 * 1024
+# Enough of an mp3 to start playing while the rest downloads
+PLAYABLE_BYTES = 512 * 1024
+
+
+class Download:
+    __slots__ = ("url", "name", "path", "total", "received", "state", "error")
+
+    def __init__(self, url, name, path):
+        self.url = url
+        self.name = name  # file name from the URL, for showing in the playlist
+        self.path = path
+        self.total = None  # bytes, None when the server doesn't say
+        self.received = 0
+        self.state = "queued"  # queued, downloading, done or failed
+        self.error = None
+
+    def percent(self):
+        if self.state == "done":
+            return 100
+        if not self.total:
+            return 0
+        return int(self.received * 100 / self.total)
+
+    def playable(self):
+        return self.state == "done" or self.received >= PLAYABLE_BYTES
+
+
+class DownloadManager:
+    def __init__(self, cache_dir, max_downloads=3):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.pool = ThreadPoolExecutor(max_workers=max_downloads)
+        self.session = None
+        self.session_lock = threading.Lock()
+        # Messages for the UI: ("progress" | "playable" | "done" | "failed", Download)
+        self.events = queue.Queue()
+        self.downloads = {}  # path -> Download
+
+    def get_session(self):
+        with self.session_lock:
+            if self.session is None:
+                import requests
+                self.session = requests.Session()
+            return self.session
+
+    def cache_path(self, url):
+        extension = os.path.splitext(urlparse(url).path)[1].lower() or ".mp3"
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + extension)
+
+    def add(self, url):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.netloc:
+            raise ValueError(f"Not a http(s) URL: {url}")
+        path = self.cache_path(url)
+        download = self.downloads.get(path)
+        if download is not None and download.state != "failed":
+            return download
+        name = os.path.basename(parsed.path) or parsed.netloc
+        download = Download(url, name, path)
+        self.downloads[path] = download
+        if os.path.exists(path) and not os.path.exists(path + ".incomplete"):
+            # Already downloaded earlier
+            download.received = download.total = os.path.getsize(path)
+            download.state = "done"
+            self.events.put(("done", download))
+        else:
+            self.pool.submit(self.fetch, download)
+        return download
+
+    def active(self):
+        return any(download.state in ("queued", "downloading") for download in self.downloads.values())
+
+    def fetch(self, download):
+        marker = download.path + ".incomplete"
+        try:
+            download.state = "downloading"
+            started = time.monotonic()
+            open(marker, "a").close()
+            received = os.path.getsize(download.path) if os.path.exists(download.path) else 0
+            headers = {"Range": f"bytes={received}-"} if received else {}
+            with self.get_session().get(download.url, headers=headers, stream=True, timeout=30) as response:
+                if response.status_code == 416:
+                    # Asked to resume past the end: it was complete after all
+                    received = os.path.getsize(download.path)
+                    download.total = received
+                    chunks = ()
+                    mode = "ab"
+                else:
+                    response.raise_for_status()
+                    if response.status_code == 206:
+                        mode = "ab"
+                    else:
+                        mode = "wb"  # server ignored the Range header, start over
+                        received = 0
+                    length = response.headers.get("Content-Length")
+                    if length is not None:
+                        download.total = received + int(length)
+                    chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+                download.received = received
+                resumed_at = received
+                with open(download.path, mode) as file:
+                    for chunk in chunks:
+                        if not chunk:
+                            continue
+                        was_playable = download.playable()
+                        file.write(chunk)
+                        file.flush()
+                        download.received += len(chunk)
+                        instruments.count("download.bytes", len(chunk))
+                        if not was_playable and download.playable():
+                            self.events.put(("playable", download))
+                        self.events.put(("progress", download))
+            os.remove(marker)
+            seconds = time.monotonic() - started
+            if seconds > 0:
+                instruments.record("download.kb_per_second",
+                                   (download.received - resumed_at) / 1024 / seconds)
+            download.state = "done"
+            self.events.put(("done", download))
+        except Exception as e:
+            download.state = "failed"
+            download.error = e
+            self.events.put(("failed", download))
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
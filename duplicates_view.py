@@ -0,0 +1,66 @@
+import os
+from tkinter import Toplevel, ttk
+
+# Report of songs that are in the library more than once (see fingerprint.py).
+# Each group lists its copies, the one that stays first; merging a group
+# takes the other copies out of the library (the files are left alone) by
+# calling on_merge with [(path, path that stays)].
+
+
+def describe(size, duration):
+    length = "" if duration is None else f"{int(duration // 60)}:{int(duration % 60):02}"
+    return f"{(size or 0) / 2 ** 20:.1f} MB", length
+
+
+class DuplicatesView(Toplevel):
+    def __init__(self, master, groups, on_merge):
+        super().__init__(master)
+        self.title("Duplicate Songs")
+        self.on_merge = on_merge
+        self.groups = {}  # tree item -> group
+
+        self.tree = ttk.Treeview(self, columns=("size", "length"), height=20)
+        self.tree.heading("#0", text=f"{len(groups)} songs with copies")
+        self.tree.heading("size", text="Size")
+        self.tree.heading("length", text="Length")
+        self.tree.column("#0", width=520)
+        self.tree.column("size", width=80, anchor="e")
+        self.tree.column("length", width=60, anchor="e")
+        scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.grid(row=0, column=0, columnspan=3, sticky="nsew")
+        scrollbar.grid(row=0, column=3, sticky="ns")
+        for group in groups:
+            keep = group[0]
+            item = self.tree.insert("", "end", text=os.path.basename(keep[0]), open=True,
+                                    values=describe(keep[1], keep[2]))
+            self.groups[item] = group
+            for number, (path, size, duration, _) in enumerate(group):
+                label = f"{path}  (keep)" if number == 0 else path
+                self.tree.insert(item, "end", text=label, values=describe(size, duration))
+
+        ttk.Button(self, text="Merge Selected", command=self.merge_selected).grid(
+            row=1, column=0, padx=5, pady=5)
+        ttk.Button(self, text="Merge All", command=self.merge_all).grid(
+            row=1, column=1, padx=5, pady=5)
+        ttk.Button(self, text="Close", command=self.destroy).grid(row=1, column=2, padx=5, pady=5)
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+    def merge(self, items):
+        rows = []
+        for item in items:
+            group = self.groups.pop(item)
+            keep = group[0][0]
+            rows.extend((path, keep) for path, _, _, _ in group[1:])
+            self.tree.delete(item)
+        if rows:
+            self.on_merge(rows)
+
+    def merge_selected(self):
+        # A selected copy stands for its whole group
+        items = {self.tree.parent(item) or item for item in self.tree.selection()}
+        self.merge([item for item in items if item in self.groups])
+
+    def merge_all(self):
+        self.merge(list(self.groups))
@@ -0,0 +1,256 @@
+import os
+import queue
+import threading
+import instruments
+
+# Playback engine.
+# One thread owns pygame.mixer.music. The UI sends it commands through a queue
+# and reads what happened (a track started or ended) from another queue, which
+# the Tk thread drains with after(). The next track is handed to the mixer with
+# music.queue() so it starts as soon as the current one finishes, without a gap
+# or a round trip through Tk.
+#
+# pygame is imported on the engine thread, so the window doesn't wait for it.
+#
+# Seeking in an mp3 with a known frame offset (metadata.SeekIndex) loads the
+# file again from that frame, SDL's own mp3 seek decodes everything before
+# the target. music.get_pos() counts from the last play(), so the engine keeps
+# where in the track that play() started to give the position in the track.
+
+# How long the engine waits for a command before checking for the end of a track
+POLL_SECONDS = 0.05
+
+
+class FileSlice:
+    # A file from `start` on, for the mixer to decode as if the file began there
+    def __init__(self, path, start):
+        self.file = open(path, "rb")
+        self.start = start
+        self.file.seek(start)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            offset += self.start
+        return self.file.seek(offset, whence) - self.start
+
+    def tell(self):
+        return self.file.tell() - self.start
+
+    def close(self):
+        self.file.close()
+
+
+class PlaybackEngine:
+    def __init__(self):
+        self.commands = queue.Queue()
+        # ("started", path) when a queued track took over,
+        # ("ended", path) when playback ran out, ("failed", path) when it couldn't
+        # play (or, for the track queued next, couldn't be queued)
+        self.events = queue.Queue()
+        self.current = None
+        self.next_path = None
+        self.volume = 1.0  # the user's volume
+        self.gains = {}  # path -> loudness correction (a volume factor) for current and next
+        self.paused = False
+        # (ms into the track, music.get_pos()) when the mixer last started
+        # playing from somewhere that isn't the top of the track
+        self.position_base = (0, 0)
+        self.seek_target = None  # ms, while a seek is waiting for the engine thread
+        self.pygame = None  # set once the engine thread has imported it
+        self.music = None
+        self.end_event = None
+        self.thread = threading.Thread(target=self.run, name="playback-engine", daemon=True)
+        self.thread.start()
+
+    # Commands, safe to call from any thread
+
+    def play(self, path, next_path=None):
+        self.commands.put(("play", (path, next_path)))
+
+    def queue_next(self, path):
+        self.commands.put(("queue_next", (path,)))
+
+    def pause(self):
+        self.commands.put(("pause", ()))
+
+    def unpause(self):
+        self.commands.put(("unpause", ()))
+
+    def stop(self):
+        self.commands.put(("stop", ()))
+
+    # offset: byte offset of the mp3 frame that starts at `seconds`, if known
+    def seek(self, seconds, offset=None):
+        self.seek_target = int(seconds * 1000)
+        self.commands.put(("seek", (seconds, offset)))
+
+    def set_volume(self, volume):
+        self.commands.put(("set_volume", (volume,)))
+
+    # Volume factor for one track, applied on top of the user's volume while it plays
+    def set_gain(self, path, gain):
+        self.commands.put(("set_gain", (path, gain)))
+
+    def shutdown(self):
+        self.commands.put(("quit", ()))
+
+    def get_pos(self):
+        # Milliseconds into the current track (reading it is harmless)
+        if self.seek_target is not None:
+            return self.seek_target
+        if self.music is None:
+            return 0
+        track_ms, music_ms = self.position_base
+        return track_ms + self.music.get_pos() - music_ms
+
+    def song_length(self, path):
+        # Decodes the whole file, only for files whose headers metadata.py can't read
+        import pygame
+        return pygame.mixer.Sound(path).get_length()
+
+    # Everything below runs on the engine thread
+
+    def run(self):
+        import pygame
+        pygame.init()
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        self.end_event = pygame.USEREVENT
+        pygame.mixer.music.set_endevent(self.end_event)
+        self.pygame = pygame
+        self.music = pygame.mixer.music
+        while True:
+            try:
+                command, args = self.commands.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                command = None
+            if command == "quit":
+                pygame.mixer.music.stop()
+                pygame.quit()
+                return
+            if command is not None:
+                try:
+                    getattr(self, "do_" + command)(*args)
+                except Exception as e:
+                    # Nothing gets to end this thread
+                    instruments.error("engine." + command, e)
+                    if command == "play":
+                        # e.g. a file that is gone or can't be decoded (or
+                        # isn't fully downloaded yet)
+                        self.events.put(("failed", self.current or str(e)))
+                        self.current = self.next_path = None
+            self.check_track_end()
+
+    def check_track_end(self):
+        for _ in self.pygame.event.get(self.end_event):
+            if self.current is None:
+                continue
+            if self.next_path is not None:
+                # The mixer already switched to the queued track (its first
+                # moments play at the old track's volume, pygame can't switch
+                # volume exactly at the boundary)
+                self.current, self.next_path = self.next_path, None
+                self.position_base = (0, 0)
+                self.apply_volume()
+                self.events.put(("started", self.current))
+            else:
+                if self.music.get_busy():
+                    # A track queued earlier and taken back since (there's no
+                    # way to unqueue in pygame) started anyway
+                    self.music.stop()
+                    self.pygame.event.clear(self.end_event)
+                self.events.put(("ended", self.current))
+                self.current = None
+
+    def do_play(self, path, next_path):
+        self.current, self.next_path = path, next_path
+        self.paused = False
+        self.position_base = (0, 0)
+        with instruments.timed("engine.load"):
+            self.music.load(path)
+            self.apply_volume()
+            self.music.play()
+        # Stopping the old track posts an end event we don't want
+        self.pygame.event.clear(self.end_event)
+        self.do_queue_next(next_path)
+
+    def do_queue_next(self, path):
+        self.next_path = path
+        if path is not None and self.current is not None:
+            try:
+                self.music.queue(path)
+            except (self.pygame.error, OSError) as e:
+                # The current track plays on, with nothing to follow it
+                instruments.error("engine.queue_next", e)
+                self.next_path = None
+                self.events.put(("failed", path))
+
+    def do_pause(self):
+        self.paused = True
+        self.music.pause()
+
+    def do_unpause(self):
+        self.paused = False
+        self.music.unpause()
+
+    def do_stop(self):
+        self.music.stop()
+        self.pygame.event.clear(self.end_event)
+        self.current = None
+        self.next_path = None
+        self.paused = False
+        self.position_base = (0, 0)
+
+    def do_seek(self, seconds, offset):
+        target = int(seconds * 1000)
+        try:
+            with instruments.timed("engine.seek"):
+                if offset is None or self.current is None or not self.play_from(offset, target):
+                    self.music.set_pos(seconds)
+                    self.position_base = (target, self.music.get_pos())
+        except self.pygame.error as e:
+            # A format the mixer can't seek in, it plays on from where it was
+            instruments.error("engine.seek", e)
+        finally:
+            if self.seek_target == target:
+                self.seek_target = None
+
+    # Play the current mp3 from the frame at byte offset, which starts target
+    # ms in. False when that can't be done, the mixer still has the whole file.
+    def play_from(self, offset, target):
+        try:
+            stream = FileSlice(self.current, offset)
+        except OSError:
+            return False
+        try:
+            self.music.load(stream, "mp3")
+        except self.pygame.error as e:
+            # pygame only lets go of the old track once the new one loaded
+            instruments.error("engine.seek", e)
+            stream.close()
+            return False
+        self.music.play()
+        self.pygame.event.clear(self.end_event)
+        if self.paused:
+            self.music.pause()
+        self.do_queue_next(self.next_path)
+        self.position_base = (target, 0)
+        return True
+
+    def do_set_volume(self, volume):
+        self.volume = volume
+        self.apply_volume()
+
+    def do_set_gain(self, path, gain):
+        self.gains[path] = gain
+        if path == self.current:
+            self.apply_volume()
+
+    def apply_volume(self):
+        # pygame can't go over 1.0, so quiet tracks only get louder below full volume
+        self.gains = {path: gain for path, gain in self.gains.items()
+                      if path in (self.current, self.next_path)}
+        self.music.set_volume(min(1.0, self.volume * self.gains.get(self.current, 1.0)))
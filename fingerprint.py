@@ -0,0 +1,217 @@
+# Audio fingerprints for finding the same song more than once in the library
+# (copies under other names, other bitrates or formats).
+# A fingerprint is FINGERPRINT_BITS bits: the track is cut into BLOCKS equal
+# stretches of time and the energy of each in BANDS log-spaced bands (up to
+# 8 kHz, where lossy encoders leave the music alone) is measured with NumPy
+# FFTs while the track is decoded for the loudness analysis (loudness.py), so
+# it costs no extra decode. The log energies are centred on both their band's
+# and their block's mean and a bit is set where they're above it, which cancels
+# volume and overall EQ differences and gives about as many ones as zeros.
+# Silence at either end is left out and frames overlap by half, so copies
+# that start a little later still line up.
+# Copies of a song differ in a few bits, different songs in about half.
+#
+# FingerprintIndex finds the close ones without comparing every pair: the
+# bits are sampled into TABLES keys of KEY_BITS each (locality-sensitive
+# hashing for Hamming distance), songs sharing a key in any table are
+# candidates, and only candidates get their full distance and duration checked.
+#
+# NumPy is only imported where fingerprints are made or searched.
+
+BLOCKS = 32
+BANDS = 16
+FINGERPRINT_BITS = BLOCKS * BANDS
+FINGERPRINT_BYTES = FINGERPRINT_BITS // 8
+FRAME = 4096  # samples per FFT
+HOP = FRAME // 2
+LOW_HZ = 100
+HIGH_HZ = 8000
+SILENCE = 1e-7  # mean square per band below which a track counts as silent
+TRIM_LEVEL = 1e-3  # frames this far below the track's mean energy count as silence
+# Added to every band's energy (relative to the mean), so near-empty bands,
+# where an encoder's noise would decide the bit, all look alike
+FLOOR = 1e-3
+TABLES = 24
+KEY_BITS = 16
+MAX_DISTANCE = 100  # differing bits for two fingerprints to be the same song
+DURATION_TOLERANCE = 0.02  # and their lengths within 2% (or 2 s) of each other
+MAX_BUCKET = 64  # bigger buckets are near-silent tracks, not worth pairing up
+
+
+class Fingerprinter:
+    # Feed it float samples shaped (frames, channels), like loudness.LoudnessMeter
+    def __init__(self, sample_rate, channels):
+        import numpy as np
+        self.np = np
+        frequencies = np.fft.rfftfreq(FRAME, 1 / sample_rate)
+        edges = np.geomspace(LOW_HZ, min(HIGH_HZ, sample_rate / 2), BANDS + 1)
+        band = np.searchsorted(edges, frequencies, side="right") - 1
+        # FFT bin -> band as a matrix, so a frame's band energies are one product
+        self.bands = np.zeros((len(frequencies), BANDS), dtype=np.float32)
+        inside = (band >= 0) & (band < BANDS)
+        self.bands[np.nonzero(inside)[0], band[inside]] = 1
+        self.window = np.hanning(FRAME).astype(np.float32)
+        self.leftover = np.zeros(0, dtype=np.float32)
+        self.energies = []  # per chunk: (frames, BANDS)
+
+    def add(self, samples):
+        np = self.np
+        mono = np.concatenate((self.leftover, samples.mean(axis=1, dtype=np.float32)))
+        count = max(0, (len(mono) - FRAME) // HOP + 1)
+        self.leftover = mono[count * HOP:]
+        if count:
+            frames = np.lib.stride_tricks.sliding_window_view(mono, FRAME)[::HOP][:count]
+            spectrum = np.fft.rfft(frames * self.window, axis=1)
+            power = (spectrum.real ** 2 + spectrum.imag ** 2).astype(np.float32)
+            self.energies.append(power @ self.bands)
+
+    # FINGERPRINT_BYTES bytes, or b"" for a track too short or too quiet
+    def result(self):
+        np = self.np
+        if not self.energies:
+            return b""
+        energies = np.concatenate(self.energies)
+        # Without the silence at either end, which differs between encoders and rips
+        loud = np.flatnonzero(energies.sum(axis=1) > energies.sum(axis=1).mean() * TRIM_LEVEL)
+        if len(loud):
+            energies = energies[loud[0]:loud[-1] + 1]
+        if len(energies) < BLOCKS:
+            return b""
+        starts = np.arange(BLOCKS) * len(energies) // BLOCKS
+        blocks = np.add.reduceat(energies, starts, axis=0) / FRAME ** 2
+        if blocks.mean() < SILENCE * len(energies) / BLOCKS:
+            return b""
+        levels = np.log10(blocks + blocks.mean() * FLOOR)
+        levels -= levels.mean(axis=0)
+        levels -= levels.mean(axis=1)[:, None]
+        return np.packbits(levels > 0).tobytes()
+
+
+class FingerprintIndex:
+    # fingerprints: FINGERPRINT_BYTES bytes each, durations: seconds (nan if unknown)
+    def __init__(self, fingerprints, durations, seed=0):
+        import numpy as np
+        self.np = np
+        self.fingerprints = np.frombuffer(b"".join(fingerprints), dtype=np.uint8).reshape(
+            -1, FINGERPRINT_BYTES)
+        self.durations = np.asarray(durations, dtype=np.float64)
+        self.popcount = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+        rng = np.random.default_rng(seed)
+        # Which bits make up each table's key
+        self.positions = np.stack([rng.choice(FINGERPRINT_BITS, KEY_BITS, replace=False)
+                                   for _ in range(TABLES)])
+        self.weights = (1 << np.arange(KEY_BITS)).astype(np.float32)  # exact up to 2**24
+        self.tables = np.arange(TABLES, dtype=np.uint32) << KEY_BITS
+        keys = np.concatenate([self.hash(self.fingerprints[start:start + 8192])
+                               for start in range(0, len(self.fingerprints), 8192)]
+                              or [np.zeros((0, TABLES), dtype=np.uint32)])
+        # All tables' keys in one sorted array, the table number in the top
+        # bits, and which fingerprint each one is
+        keys = (keys.T | self.tables[:, None]).ravel()
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.rows = order % max(1, len(self.fingerprints))
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    # (len(fingerprints), TABLES) keys, without the table numbers
+    def hash(self, fingerprints):
+        np = self.np
+        bits = np.unpackbits(fingerprints, axis=1).take(self.positions.ravel(), axis=1)
+        bits = bits.reshape(len(fingerprints), TABLES, KEY_BITS).astype(np.float32)
+        return (bits @ self.weights).astype(np.uint32)
+
+    def distances(self, a, b):
+        # Differing bits between fingerprints a[i] and b[i]
+        return self.popcount[self.fingerprints[a] ^ self.fingerprints[b]].sum(axis=1)
+
+    # Whether songs a[i] and b[i] are about as long (or one isn't known)
+    def same_length(self, a, b):
+        np = self.np
+        durations_a, durations_b = self.durations[a], self.durations[b]
+        known = ~(np.isnan(durations_a) | np.isnan(durations_b))
+        longest = np.fmax(durations_a, durations_b)
+        alike = np.abs(durations_a - durations_b) <= np.maximum(2.0, DURATION_TOLERANCE * longest)
+        return alike | ~known
+
+    # [(row, distance)] of fingerprints close to row's, nearest first
+    def query(self, row):
+        np = self.np
+        point = self.hash(self.fingerprints[row:row + 1])[0] | self.tables
+        starts = np.searchsorted(self.keys, point)
+        ends = np.searchsorted(self.keys, point, side="right")
+        others = np.unique(np.concatenate(
+            [self.rows[start:end] for start, end in zip(starts.tolist(), ends.tolist())]))
+        others = others[others != row]
+        if not len(others):
+            return []
+        rows = np.full(len(others), row)
+        distances = self.distances(rows, others)
+        keep = (distances <= MAX_DISTANCE) & self.same_length(rows, others)
+        found = sorted(zip(distances[keep].tolist(), others[keep].tolist()))
+        return [(other, distance) for distance, other in found]
+
+    # (a, b, distance) arrays of every pair of close fingerprints, a < b
+    def pairs(self):
+        np = self.np
+        firsts, seconds = [], []
+        # Runs of equal keys are buckets
+        keys = self.keys
+        edges = np.flatnonzero(np.diff(keys)) + 1
+        starts = np.concatenate(([0], edges))
+        sizes = np.diff(np.concatenate((starts, [len(keys)])))
+        counts = np.bincount(sizes, minlength=2)
+        for size in np.flatnonzero(counts[2:MAX_BUCKET + 1]) + 2:
+            # All buckets of one size at once: every pair of positions in them
+            bucket_starts = starts[sizes == size]
+            i, j = np.triu_indices(size, 1)
+            firsts.append(self.rows[(bucket_starts[:, None] + i).ravel()])
+            seconds.append(self.rows[(bucket_starts[:, None] + j).ravel()])
+        if not firsts:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        a, b = np.concatenate(firsts), np.concatenate(seconds)
+        # The same pair turns up in several tables
+        pairs = np.minimum(a, b) * len(self) + np.maximum(a, b)
+        pairs.sort()
+        pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+        a, b = np.divmod(pairs, len(self))
+        # Lengths first, they're cheaper to compare and rule out most pairs
+        alike = self.same_length(a, b)
+        a, b = a[alike], b[alike]
+        distances = self.distances(a, b)
+        keep = distances <= MAX_DISTANCE
+        return a[keep], b[keep], distances[keep]
+
+    # Lists of rows that are the same song, each sorted, biggest groups first
+    def groups(self):
+        a, b, _ = self.pairs()
+        parent = {}
+
+        def root(row):
+            parent.setdefault(row, row)
+            while parent[row] != row:
+                parent[row] = parent[parent[row]]
+                row = parent[row]
+            return row
+        for first, second in zip(a.tolist(), b.tolist()):
+            first, second = root(first), root(second)
+            if first != second:
+                parent[max(first, second)] = min(first, second)
+        groups = {}
+        for row in parent:
+            groups.setdefault(root(row), []).append(row)
+        return sorted((sorted(group) for group in groups.values()), key=lambda group: (-len(group), group[0]))
+
+
+# The same song among (path, size, duration, fingerprint) rows: lists of
+# rows, biggest file (usually the best bitrate) first
+def find_duplicates(rows):
+    rows = [row for row in rows if row[3] is not None and len(row[3]) == FINGERPRINT_BYTES]
+    if len(rows) < 2:
+        return []
+    index = FingerprintIndex([row[3] for row in rows],
+                             [float("nan") if row[2] is None else row[2] for row in rows])
+    return [sorted((rows[row] for row in group), key=lambda row: -(row[1] or 0))
+            for group in index.groups()]
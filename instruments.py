@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import math
+import time
+import logging
+import threading
+
+# Opt-in timings and counters, for seeing where time goes.
+# Off unless the player is started with --profile[=file.json] or with
+# MUSICPLAYER_PROFILE set (to 1, or to the file to write). Off, timed()
+# hands back one shared do-nothing context manager and record()/count() return
+# straight away, so the calls can stay in the code everywhere. On, every
+# name gets a histogram (log2 buckets, so it stays small however long the
+# session runs); snapshot() adds thread and memory counters and is what the
+# player's live view shows and what dump() writes as JSON.
+#
+# Safe to call from any thread. Worker processes aren't covered, the scanner
+# and the loudness analyzer report their own rates.
+
+log = logging.getLogger("musicplayer")
+
+enabled = False
+dump_path = None
+lock = threading.Lock()
+histograms = {}  # name -> Histogram
+counters = {}  # name -> int
+errors = {}  # name -> (count, last message)
+gauges = {}  # name -> highest value seen by sample()
+sources = {}  # name -> function returning a dict for snapshot()
+started = time.monotonic()
+
+
+class Histogram:
+    __slots__ = ("count", "total", "low", "high", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.low = math.inf
+        self.high = -math.inf
+        self.buckets = {}  # e -> values in [2**(e-1), 2**e)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.low = min(self.low, value)
+        self.high = max(self.high, value)
+        exponent = math.frexp(value)[1] if value > 0 else -1074
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+    # Upper end of the bucket the fraction'th value falls in
+    def percentile(self, fraction):
+        wanted = fraction * self.count
+        seen = 0
+        for exponent in sorted(self.buckets):
+            seen += self.buckets[exponent]
+            if seen >= wanted:
+                return min(self.high, math.ldexp(1, exponent))
+        return self.high
+
+    def summary(self):
+        return {"count": self.count, "mean": self.total / self.count,
+                "min": self.low, "max": self.high, "p50": self.percentile(0.5),
+                "p90": self.percentile(0.9), "p99": self.percentile(0.99),
+                "buckets": {f"<{math.ldexp(1, exponent):g}": count
+                            for exponent, count in sorted(self.buckets.items())}}
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+# Turn it on from the command line or the environment, returns whether it is on
+def setup(argv=None, environ=None):
+    argv = sys.argv[1:] if argv is None else argv
+    environ = os.environ if environ is None else environ
+    setting = environ.get("MUSICPLAYER_PROFILE")
+    for arg in argv:
+        if arg == "--profile":
+            setting = setting or "1"
+        elif arg.startswith("--profile="):
+            setting = arg.split("=", 1)[1]
+    if setting and setting != "0":
+        enable(None if setting == "1" else setting)
+    return enabled
+
+
+def enable(path=None):
+    global enabled, dump_path
+    dump_path = path
+    enabled = True
+
+
+# ms spent in a block: `with instruments.timed("search"): ...`
+def timed(name):
+    if not enabled:
+        return NULL_TIMER
+    return Timer(name)
+
+
+# A value for name's histogram: ms for timings, anything else for the rest
+def record(name, value):
+    if not enabled:
+        return
+    with lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.add(value)
+
+
+def count(name, amount=1):
+    if not enabled:
+        return
+    with lock:
+        counters[name] = counters.get(name, 0) + amount
+
+
+# Something went wrong that the player carries on from. It is always logged,
+# and counted when instrumentation is on.
+def error(name, exception):
+    log.warning("%s: %s", name, exception)
+    if not enabled:
+        return
+    with lock:
+        errors[name] = (errors.get(name, (0, None))[0] + 1, repr(exception))
+
+
+# Add a dict of someone's own counters to every snapshot
+def add_source(name, function):
+    sources[name] = function
+
+
+def memory():
+    # (current, peak) resident set size in bytes, None where we can't tell
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None, None
+        return counters.WorkingSetSize, counters.PeakWorkingSetSize
+    current = None
+    try:
+        with open("/proc/self/statm") as statm:
+            current = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return current, None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return current, peak if sys.platform == "darwin" else peak * 1024
+
+
+# Current thread count and memory use, keeping the highest seen
+def sample():
+    current, peak = memory()
+    values = {"threads": threading.active_count(), "rss_bytes": current, "peak_rss_bytes": peak}
+    with lock:
+        for name, value in values.items():
+            if value is not None:
+                gauges[name] = max(gauges.get(name, value), value)
+    return values
+
+
+def snapshot():
+    now = sample()
+    with lock:
+        result = {
+            "enabled": enabled,
+            "uptime_seconds": time.monotonic() - started,
+            "timings": {name: histogram.summary() for name, histogram in sorted(histograms.items())},
+            "counters": dict(counters),
+            "errors": {name: {"count": n, "last": last} for name, (n, last) in errors.items()},
+            "now": now,
+            "highest": dict(gauges),
+            "threads": sorted(thread.name for thread in threading.enumerate()),
+        }
+    for name, function in sources.items():
+        try:
+            result[name] = function()
+        except Exception as e:
+            result[name] = {"error": repr(e)}
+    return result
+
+
+def dump(path=None):
+    path = path or dump_path
+    if path is None:
+        return None
+    with open(path, "w") as f:
+        json.dump(snapshot(), f, indent=2, default=str)
+    return path
+
+
+# The snapshot as lines of text, for the live view
+def report():
+    data = snapshot()
+    lines = [f"up {data['uptime_seconds']:.0f} s, {data['now']['threads']} threads"]
+    rss = data["now"]["rss_bytes"]
+    if rss is not None:
+        lines[0] += f", {rss / 2 ** 20:.0f} MB"
+    lines.append(f"{'':<24}{'count':>7}{'mean':>9}{'p50':>9}{'p99':>9}{'max':>9}")
+    for name, timing in data["timings"].items():
+        lines.append(f"{name:<24}{timing['count']:>7}{timing['mean']:>9.2f}{timing['p50']:>9.2f}"
+                     f"{timing['p99']:>9.2f}{timing['max']:>9.2f}")
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f"{name:<24}{value:>7}")
+    for name, entry in sorted(data["errors"].items()):
+        lines.append(f"{name:<24}{entry['count']:>7}  {entry['last']}")
+    for name in sources:
+        lines.append(f"{name}: {data[name]}")
+    return "\n".join(lines)
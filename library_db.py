@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import threading
+from metadata import TrackInfo, SeekIndex, read_seek_index
+
+# Persistent library index.
+# Every track we have seen is stored by path together with the mtime and size
+# it had when we read it, so a rescan (see scanner.py) only has to stat the
+# folders and read the files that are new or have changed. Everything else
+# loads straight from here.
+#
+# mp3 seek indexes (metadata.SeekIndex) are stored too but not loaded with the
+# library, they are only read for a track that is playing. So are
+# audio fingerprints (fingerprint.py), read when looking for duplicates.
+# Duplicates the user merged away keep their row, pointing at the copy that
+# stayed, so the scanner doesn't add them again; load() leaves them out.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    date_added REAL NOT NULL,
+    duration REAL,
+    title TEXT,
+    artist TEXT,
+    album TEXT,
+    track_number INTEGER,
+    loudness REAL,
+    peak REAL,
+    seek_index BLOB,
+    fingerprint BLOB,
+    duplicate_of TEXT
+);
+CREATE INDEX IF NOT EXISTS tracks_folder ON tracks (folder);
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY
+);
+"""
+
+
+def user_data_dir():
+    # Where the player keeps its own files (%APPDATA% on Windows)
+    base = os.environ.get("APPDATA") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    path = os.path.join(base, "MusicPlayer")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class LibraryIndex:
+    def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = os.path.join(user_data_dir(), "library.db")
+        self.db_path = db_path
+        # The connection is shared with the scanner threads, so guard it
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.upgrade()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+
+    def upgrade(self):
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(tracks)")}
+        if "track_number" not in columns:
+            # Indexes from before track numbers were read: forget the mtimes so
+            # the next scan reads every file's tags again
+            with self.db:
+                self.db.execute("ALTER TABLE tracks ADD COLUMN track_number INTEGER")
+                self.db.execute("UPDATE tracks SET mtime = 0")
+        if "peak" not in columns:
+            with self.db:
+                self.db.execute("ALTER TABLE tracks ADD COLUMN loudness REAL")
+                self.db.execute("ALTER TABLE tracks ADD COLUMN peak REAL")
+        if "seek_index" not in columns:
+            # Filled in as tracks are played, see seek_index()
+            with self.db:
+                self.db.execute("ALTER TABLE tracks ADD COLUMN seek_index BLOB")
+        if "fingerprint" not in columns:
+            # Every track is analysed once more to get one, see unanalysed()
+            with self.db:
+                self.db.execute("ALTER TABLE tracks ADD COLUMN fingerprint BLOB")
+                self.db.execute("ALTER TABLE tracks ADD COLUMN duplicate_of TEXT")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def folders(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT path FROM folders")]
+
+    def load(self):
+        # All known tracks, newest first, without touching the disk
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT path, mtime, size, duration, title, artist, album, date_added, "
+                "track_number, loudness, peak FROM tracks WHERE duplicate_of IS NULL "
+                "ORDER BY date_added DESC").fetchall()
+        return [TrackInfo(*row) for row in rows]
+
+    def known_files(self, folder):
+        # path -> (mtime, size) for everything we stored under folder
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT path, mtime, size FROM tracks WHERE folder = ?", (folder,)).fetchall()
+        return {path: (mtime, size) for path, mtime, size in rows}
+
+    def known_folders(self, root):
+        # Every folder under root (root included) that has tracks stored
+        prefix = root.rstrip(os.sep) + os.sep
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT DISTINCT folder FROM tracks WHERE folder = ? "
+                "OR substr(folder, 1, ?) = ?", (root, len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def save(self, tracks):
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO tracks "
+                "(path, folder, mtime, size, date_added, duration, title, artist, album, "
+                "track_number, loudness, peak, seek_index) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(info.path, os.path.dirname(info.path), info.mtime, info.size,
+                  info.date_added, info.duration, info.title, info.artist, info.album,
+                  info.track_number, info.loudness, info.peak, info.seek_index)
+                 for info in tracks])
+
+    def unanalysed(self):
+        # Paths without a loudness analysis or fingerprint yet, newest first
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT path FROM tracks WHERE (peak IS NULL OR fingerprint IS NULL) "
+                "AND duplicate_of IS NULL ORDER BY date_added DESC").fetchall()
+        return [row[0] for row in rows]
+
+    def save_loudness(self, rows):
+        # rows: (path, loudness, peak)
+        with self.lock, self.db:
+            self.db.executemany(
+                "UPDATE tracks SET loudness = ?, peak = ? WHERE path = ?",
+                [(loudness, peak, path) for path, loudness, peak in rows])
+
+    def seek_index(self, path):
+        # SeekIndex for an mp3, None for anything else. Tracks scanned before
+        # seek indexes existed get theirs built the first time they are played
+        # (core.Player asks from a background thread).
+        with self.lock:
+            row = self.db.execute(
+                "SELECT seek_index FROM tracks WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] is not None:
+            return SeekIndex.from_bytes(row[0])
+        seek_index = read_seek_index(path)
+        if seek_index is not None and row is not None:
+            with self.lock, self.db:
+                self.db.execute("UPDATE tracks SET seek_index = ? WHERE path = ?",
+                                (seek_index.to_bytes(), path))
+        return seek_index
+
+    def save_fingerprints(self, rows):
+        # rows: (path, fingerprint), b"" for tracks that couldn't be fingerprinted
+        with self.lock, self.db:
+            self.db.executemany(
+                "UPDATE tracks SET fingerprint = ? WHERE path = ?",
+                [(fingerprint, path) for path, fingerprint in rows])
+
+    def fingerprints(self):
+        # (path, size, duration, fingerprint) of every fingerprinted library track
+        with self.lock:
+            return self.db.execute(
+                "SELECT path, size, duration, fingerprint FROM tracks "
+                "WHERE length(fingerprint) > 0 AND duplicate_of IS NULL").fetchall()
+
+    def merge_duplicates(self, rows):
+        # rows: (path, path of the copy that stays)
+        with self.lock, self.db:
+            self.db.executemany(
+                "UPDATE tracks SET duplicate_of = ? WHERE path = ?",
+                [(keep, path) for path, keep in rows])
+
+    def remove(self, paths):
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM tracks WHERE path = ?", [(path,) for path in paths])
+
+    def add_folder(self, folder):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR IGNORE INTO folders (path) VALUES (?)", (folder,))
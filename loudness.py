@@ -0,0 +1,293 @@
+import os
+import math
+import time
+import queue
+import wave
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from fingerprint import Fingerprinter
+
+# Loudness analysis (EBU R128 / ITU BS.1770 integrated loudness, ReplayGain 2
+# style gain).
+# Each track is decoded once, in chunks, on a process pool. A chunk is cut into
+# 100 ms segments that are K-weighted together in the frequency domain with one
+# NumPy FFT, which gives each segment's mean square; the 400 ms gating blocks
+# (75% overlap) are then just sums of four neighbouring segments. The result
+# (loudness in LUFS and sample peak) goes into the library index, and the
+# player turns it into a per-track volume on top of the user's volume.
+# The same decoded chunks make the track's fingerprint (fingerprint.py), so
+# finding duplicates costs no decoding of its own.
+#
+# NumPy is only imported in the worker processes.
+
+REFERENCE_LUFS = -18.0  # ReplayGain 2 reference level
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+SEGMENT_SECONDS = 0.1
+CHUNK_SECONDS = 30  # decoded at a time, so long tracks don't need all their PCM in memory
+
+
+def biquad_response(b, a, frequencies, sample_rate):
+    # |H|^2 of a biquad at the given frequencies
+    import numpy as np
+    z = np.exp(-2j * np.pi * frequencies / sample_rate)
+    h = (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    return np.abs(h) ** 2
+
+
+def k_weighting(frequencies, sample_rate):
+    # The two BS.1770 pre-filters: a high shelf (+4 dB above ~1.5 kHz) and a
+    # high pass at 38 Hz, as power gains
+    w0 = 2 * math.pi * 1500 / sample_rate
+    gain = 10 ** (4 / 40)
+    alpha = math.sin(w0) / (2 / math.sqrt(2))
+    root = 2 * math.sqrt(gain) * alpha
+    cos = math.cos(w0)
+    shelf_b = (gain * ((gain + 1) + (gain - 1) * cos + root),
+               -2 * gain * ((gain - 1) + (gain + 1) * cos),
+               gain * ((gain + 1) + (gain - 1) * cos - root))
+    shelf_a = ((gain + 1) - (gain - 1) * cos + root,
+               2 * ((gain - 1) - (gain + 1) * cos),
+               (gain + 1) - (gain - 1) * cos - root)
+    w0 = 2 * math.pi * 38 / sample_rate
+    alpha = math.sin(w0) / (2 * 0.5)
+    cos = math.cos(w0)
+    high_pass_b = ((1 + cos) / 2, -(1 + cos), (1 + cos) / 2)
+    high_pass_a = (1 + alpha, -2 * cos, 1 - alpha)
+    return (biquad_response(shelf_b, shelf_a, frequencies, sample_rate)
+            * biquad_response(high_pass_b, high_pass_a, frequencies, sample_rate))
+
+
+class LoudnessMeter:
+    # Feed it float samples shaped (frames, channels) in -1..1, any chunk size
+    def __init__(self, sample_rate, channels):
+        import numpy as np
+        self.np = np
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.segment = int(sample_rate * SEGMENT_SECONDS)
+        frequencies = np.fft.rfftfreq(self.segment, 1 / sample_rate)
+        # Parseval: mean square of the filtered segment from the spectrum
+        self.weights = k_weighting(frequencies, sample_rate) * 2 / self.segment ** 2
+        self.weights[0] /= 2
+        if self.segment % 2 == 0:
+            self.weights[-1] /= 2
+        self.leftover = np.zeros((0, channels), dtype=np.float32)
+        self.energies = []  # per chunk: mean square of each segment, summed over channels
+        self.peak = 0.0
+        self.frames = 0
+
+    def add(self, samples):
+        np = self.np
+        self.frames += len(samples)
+        if len(samples):
+            self.peak = max(self.peak, float(np.abs(samples).max()))
+        samples = np.concatenate((self.leftover, samples))
+        count = len(samples) // self.segment
+        self.leftover = samples[count * self.segment:]
+        if count:
+            segments = samples[:count * self.segment].reshape(count, self.segment, self.channels)
+            spectrum = np.fft.rfft(segments, axis=1)
+            power = (spectrum.real ** 2 + spectrum.imag ** 2) * self.weights[:, None]
+            self.energies.append(power.sum(axis=(1, 2)))
+
+    # (integrated loudness in LUFS or None for silence, sample peak)
+    def result(self):
+        np = self.np
+        if not self.energies:
+            return None, self.peak
+        energies = np.concatenate(self.energies)
+        if len(energies) < 4:
+            blocks = energies[None].mean(axis=1)
+        else:
+            # 400 ms blocks every 100 ms
+            sums = np.cumsum(np.concatenate(([0.0], energies)))
+            blocks = (sums[4:] - sums[:-4]) / 4
+        with np.errstate(divide="ignore"):
+            loudness = -0.691 + 10 * np.log10(blocks)
+        gated = blocks[loudness > ABSOLUTE_GATE]
+        if not len(gated):
+            return None, self.peak
+        relative = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE
+        gated = blocks[loudness > max(relative, ABSOLUTE_GATE)]
+        return -0.691 + 10 * math.log10(gated.mean()), self.peak
+
+
+def read_wav(path):
+    # (sample rate, channels, chunks of float samples)
+    import numpy as np
+    wav = wave.open(path, "rb")
+    sample_rate, channels, width = wav.getframerate(), wav.getnchannels(), wav.getsampwidth()
+    if width not in (1, 2, 3, 4):
+        wav.close()
+        raise wave.Error(f"{width * 8} bit samples")
+
+    def chunks():
+        with wav:
+            while True:
+                data = wav.readframes(int(sample_rate * CHUNK_SECONDS))
+                if not data:
+                    return
+                if width == 1:
+                    samples = (np.frombuffer(data, np.uint8).astype(np.float32) - 128) / 128
+                elif width == 3:
+                    raw = np.frombuffer(data, np.uint8).reshape(-1, 3)
+                    samples = (raw[:, 0].astype(np.int32) << 8 | raw[:, 1].astype(np.int32) << 16
+                               | raw[:, 2].astype(np.int8).astype(np.int32) << 24)
+                    samples = samples.astype(np.float32) / 2 ** 31
+                else:
+                    dtype = np.int16 if width == 2 else np.int32
+                    samples = np.frombuffer(data, dtype).astype(np.float32) / 2 ** (8 * width - 1)
+                yield samples.reshape(-1, channels)
+    return sample_rate, channels, chunks()
+
+
+def read_with_pygame(path):
+    # Anything else is decoded by SDL, at the mixer's rate
+    import numpy as np
+    import pygame
+    if not pygame.mixer.get_init():
+        pygame.mixer.init()
+    sample_rate, size, channels = pygame.mixer.get_init()
+    pcm = pygame.sndarray.array(pygame.mixer.Sound(path)).reshape(-1, channels)
+    scale = float(2 ** (abs(size) - 1))
+
+    def chunks():
+        step = int(sample_rate * CHUNK_SECONDS)
+        for start in range(0, len(pcm), step):
+            yield pcm[start:start + step].astype(np.float32) / scale
+    return sample_rate, channels, chunks()
+
+
+def analyse(path):
+    # (path, loudness or None, peak, seconds of audio, fingerprint). A file
+    # that can't be decoded comes back like silence, with an empty
+    # fingerprint, so it isn't tried again every time.
+    try:
+        decoded = None
+        if path.lower().endswith(".wav"):
+            try:
+                decoded = read_wav(path)
+            except (wave.Error, EOFError):
+                pass  # compressed or unusual, SDL may still read it
+        sample_rate, channels, chunks = decoded or read_with_pygame(path)
+        meter = LoudnessMeter(sample_rate, channels)
+        fingerprinter = Fingerprinter(sample_rate, channels)
+        for samples in chunks:
+            meter.add(samples)
+            fingerprinter.add(samples)
+    except Exception:
+        return path, None, 0.0, 0, b""
+    loudness, peak = meter.result()
+    return path, loudness, peak, meter.frames / sample_rate, fingerprinter.result()
+
+
+def analyse_batch(paths):
+    return [analyse(path) for path in paths]
+
+
+def start_worker():
+    # Decoding needs the mixer, but not a sound card
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+
+
+def track_gain(loudness, peak):
+    # dB to bring a track to the reference level, without pushing its peak
+    # over full scale. None when there is nothing to go on.
+    if loudness is None:
+        return None
+    gain = REFERENCE_LUFS - loudness
+    if peak:
+        gain = min(gain, -20 * math.log10(peak))
+    return gain
+
+
+class AnalysisProgress:
+    __slots__ = ("tracks", "audio_seconds", "seconds", "done", "cancelled")
+
+    def __init__(self):
+        self.tracks = 0
+        self.audio_seconds = 0.0  # of audio analysed
+        self.seconds = 0.0  # wall clock
+        self.done = False
+        self.cancelled = False
+
+    # Seconds of audio analysed per second
+    def rate(self):
+        return self.audio_seconds / self.seconds if self.seconds else 0
+
+
+class LoudnessAnalyzer:
+    def __init__(self, index, workers=None, batch_size=4):
+        self.index = index
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        # Messages for the UI: ("loudness", [(path, loudness, peak)]),
+        # ("progress", AnalysisProgress)
+        self.results = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.thread = None
+        self.progress = AnalysisProgress()
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, paths):
+        # A run still going finishes on its own, its progress isn't self.progress
+        self.cancel(wait_for_thread=False)
+        self.cancel_event = threading.Event()
+        self.progress = AnalysisProgress()
+        self.thread = threading.Thread(
+            target=self.run, args=(list(paths), self.cancel_event, self.progress), daemon=True)
+        self.thread.start()
+
+    def cancel(self, wait_for_thread=True):
+        self.cancel_event.set()
+        if self.thread is not None and wait_for_thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self, paths, cancelled, progress):
+        start = time.monotonic()
+        batches = [paths[i:i + self.batch_size] for i in range(0, len(paths), self.batch_size)]
+        # spawn, not fork: the player process has pygame and Tk running
+        processes = ProcessPoolExecutor(
+            max_workers=min(self.workers, len(batches) or 1),
+            mp_context=multiprocessing.get_context("spawn"), initializer=start_worker)
+        try:
+            # Only a few batches in flight, so cancelling doesn't wait on many
+            batches.reverse()
+            pending = set()
+            while (batches or pending) and not cancelled.is_set():
+                while batches and len(pending) < 2 * self.workers:
+                    pending.add(processes.submit(analyse_batch, batches.pop()))
+                # With a timeout, so a cancel isn't kept waiting on a batch
+                done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                rows = []
+                fingerprints = []
+                for future in done:
+                    try:
+                        results = future.result()
+                    except BrokenProcessPool:
+                        # Give up on this run, the next one starts with fresh workers
+                        cancelled.set()
+                        break
+                    for path, loudness, peak, seconds, fingerprint in results:
+                        rows.append((path, loudness, peak))
+                        fingerprints.append((path, fingerprint))
+                        progress.tracks += 1
+                        progress.audio_seconds += seconds
+                if rows:
+                    self.index.save_loudness(rows)
+                    self.index.save_fingerprints(fingerprints)
+                    self.results.put(("loudness", rows))
+                progress.seconds = time.monotonic() - start
+                self.results.put(("progress", progress))
+        finally:
+            processes.shutdown(wait=not cancelled.is_set(), cancel_futures=True)
+        progress.cancelled = cancelled.is_set()
+        progress.done = True
+        self.results.put(("progress", progress))
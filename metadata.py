@@ -0,0 +1,364 @@
+import os
+import sys
+import mmap
+import struct
+import threading
+from array import array
+
+# Track metadata read straight from the file headers.
+# pygame.mixer.Sound(path).get_length() decodes the whole file into memory just
+# to find out how long it is, so durations are worked out here instead:
+#   - WAV: data chunk size / byte rate from the fmt chunk
+#   - MP3: frame count from the Xing/Info or VBRI header, or a scan of the
+#     frame headers when the file has neither (plain CBR files)
+#
+# The same header scan gives an mp3's seek index (SeekIndex): where its frames
+# start, so seeking can start decoding at the exact frame for a time.
+
+MP3_BITRATES = {
+    # (mpeg1, layer) -> kbps table indexed by the bitrate bits
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG 1
+    2: (22050, 24000, 16000),  # MPEG 2
+    0: (11025, 12000, 8000),   # MPEG 2.5
+}
+
+# How far to look for the next frame after garbage in the middle of a file
+MP3_RESYNC_WINDOW = 4096
+# The seek index keeps every SEEK_STEP-th frame's offset; a seek walks at most
+# SEEK_STEP - 1 headers on from there
+SEEK_STEP = 32
+MP3_MAX_FRAME = 2881  # bytes, layer I/III at the highest bitrate and lowest rate
+
+
+class TrackInfo:
+    # Per-track metadata record, filled in as we learn more about the file
+    __slots__ = ("path", "mtime", "size", "duration", "title", "artist", "album", "date_added",
+                 "track_number", "loudness", "peak", "seek_index")
+
+    def __init__(self, path, mtime=0, size=0, duration=None, title=None, artist=None,
+                 album=None, date_added=None, track_number=None, loudness=None, peak=None,
+                 seek_index=None):
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.duration = duration  # seconds, None when the headers were unreadable
+        self.title = title
+        self.artist = artist
+        self.album = album
+        self.date_added = date_added  # timestamp, used to sort the library
+        self.track_number = track_number
+        self.loudness = loudness  # LUFS, see loudness.py
+        self.peak = peak  # sample peak, None until analysed
+        self.seek_index = seek_index  # SeekIndex.to_bytes() for mp3s
+
+    def __repr__(self):
+        return f"TrackInfo({self.path!r}, duration={self.duration!r})"
+
+
+class Mp3Frame:
+    __slots__ = ("offset", "length", "samples", "sample_rate", "mpeg1", "mono")
+
+    def __init__(self, offset, length, samples, sample_rate, mpeg1, mono):
+        self.offset = offset
+        self.length = length
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.mpeg1 = mpeg1
+        self.mono = mono
+
+
+def parse_mp3_header(data, offset):
+    # Returns an Mp3Frame for a valid frame header at offset, otherwise None
+    if offset + 4 > len(data):
+        return None
+    b1, b2, b3, b4 = data[offset], data[offset + 1], data[offset + 2], data[offset + 3]
+    if b1 != 0xFF or (b2 & 0xE0) != 0xE0:
+        return None
+    version = (b2 >> 3) & 0x03
+    layer = 4 - ((b2 >> 1) & 0x03)
+    bitrate_index = b3 >> 4
+    sample_rate_index = (b3 >> 2) & 0x03
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None  # reserved values, or free format which we can't size
+    mpeg1 = version == 3
+    bitrate = MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    padding = (b3 >> 1) & 0x01
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or mpeg1) else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return Mp3Frame(offset, length, samples, sample_rate, mpeg1, (b4 >> 6) == 3)
+
+
+def skip_id3v2(data):
+    # Size of the ID3v2 tag at the start of the file (0 if there isn't one)
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)  # syncsafe integer
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def find_mp3_frame(data, start, limit=None):
+    # Find the next frame header that is followed by another valid header,
+    # so random 0xFF bytes inside album art or padding don't count as a sync
+    end = len(data) - 4 if limit is None else min(len(data) - 4, start + limit)
+    offset = start
+    while offset <= end:
+        offset = data.find(b"\xff", offset, end + 1)
+        if offset == -1:
+            return None
+        frame = parse_mp3_header(data, offset)
+        if frame is not None:
+            following = offset + frame.length
+            if following + 4 > len(data) or parse_mp3_header(data, following) is not None:
+                return frame
+        offset += 1
+    return None
+
+
+def find_vbr_header(data, frame):
+    # Offset of the Xing/Info or VBRI header in frame, None if it is audio
+    if frame.mpeg1:
+        side_info = 17 if frame.mono else 32
+    else:
+        side_info = 9 if frame.mono else 17
+    # Xing/Info sits after the side information of the first frame
+    xing = frame.offset + 4 + side_info
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        return xing
+    # VBRI always sits 32 bytes after the frame header
+    vbri = frame.offset + 4 + 32
+    if data[vbri:vbri + 4] == b"VBRI":
+        return vbri
+    return None
+
+
+def read_vbr_frame_count(data, frame):
+    header = find_vbr_header(data, frame)
+    if header is None:
+        return None
+    if data[header:header + 4] == b"VBRI":
+        return struct.unpack(">I", data[header + 14:header + 18])[0]
+    flags = struct.unpack(">I", data[header + 4:header + 8])[0]
+    if flags & 0x01:
+        return struct.unpack(">I", data[header + 8:header + 12])[0]
+    return None
+
+
+def iter_mp3_frames(data, start=None):
+    # Walk the frame headers of an mp3 without decoding any audio
+    if start is None:
+        start = skip_id3v2(data)
+    frame = find_mp3_frame(data, start)
+    while frame is not None:
+        yield frame
+        offset = frame.offset + frame.length
+        frame = parse_mp3_header(data, offset)
+        if frame is None and offset < len(data) - 4:
+            # Trailing ID3v1/APE tags end the stream, anything else is garbage
+            if data[offset:offset + 3] == b"TAG" or data[offset:offset + 8] == b"APETAGEX":
+                return
+            frame = find_mp3_frame(data, offset, MP3_RESYNC_WINDOW)
+
+
+def mp3_duration(data):
+    frames = iter_mp3_frames(data)
+    first = next(frames, None)
+    if first is None:
+        return None
+    frame_count = read_vbr_frame_count(data, first)
+    if frame_count:
+        return frame_count * first.samples / first.sample_rate
+    # No VBR header, count the frames ourselves
+    total = first.samples / first.sample_rate
+    for frame in frames:
+        total += frame.samples / frame.sample_rate
+    return total
+
+
+class SeekIndex:
+    # Where an mp3's audio frames start, from one scan of the headers. All
+    # frames of a stream hold the same number of samples, so frame n starts at
+    # n * samples / sample_rate seconds and only byte offsets need storing;
+    # every SEEK_STEP-th one is kept (about a second apart) and the frames in
+    # between are found by walking their headers.
+    __slots__ = ("offsets", "frame_count", "samples", "sample_rate")
+
+    def __init__(self, offsets, frame_count, samples, sample_rate):
+        self.offsets = offsets  # array("I") of every SEEK_STEP-th frame's offset
+        self.frame_count = frame_count
+        self.samples = samples
+        self.sample_rate = sample_rate
+
+    def duration(self):
+        return self.frame_count * self.samples / self.sample_rate
+
+    def frame_time(self, frame):
+        return frame * self.samples / self.sample_rate
+
+    # (byte offset, start in seconds) of the frame playing at seconds. Reads
+    # at most SEEK_STEP frames of the file, however long it is.
+    def locate(self, path, seconds):
+        frame = min(max(0, int(seconds * self.sample_rate / self.samples)), self.frame_count - 1)
+        base, walk = divmod(frame, SEEK_STEP)
+        start = self.offsets[base]
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(SEEK_STEP * MP3_MAX_FRAME + MP3_RESYNC_WINDOW)
+        offset = 0
+        for _ in range(walk):
+            header = parse_mp3_header(data, offset) or find_mp3_frame(data, offset, MP3_RESYNC_WINDOW)
+            if header is None:
+                break  # the file changed since it was indexed, stop where we are
+            offset = header.offset + header.length
+        return start + offset, self.frame_time(frame)
+
+    def to_bytes(self):
+        offsets = self.offsets
+        if sys.byteorder == "big":
+            offsets = array("I", offsets)
+            offsets.byteswap()
+        return struct.pack("<III", self.frame_count, self.samples, self.sample_rate) + offsets.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        frame_count, samples, sample_rate = struct.unpack("<III", data[:12])
+        offsets = array("I")
+        offsets.frombytes(data[12:])
+        if sys.byteorder == "big":
+            offsets.byteswap()
+        return cls(offsets, frame_count, samples, sample_rate)
+
+
+def build_seek_index(data):
+    frames = iter_mp3_frames(data)
+    first = next(frames, None)
+    if first is None:
+        return None
+    if find_vbr_header(data, first) is not None:
+        # Decoders don't play the frame holding the VBR header
+        first = next(frames, None)
+        if first is None:
+            return None
+    offsets = array("I", [first.offset])
+    count = 1
+    for frame in frames:
+        if count % SEEK_STEP == 0:
+            offsets.append(frame.offset)
+        count += 1
+    return SeekIndex(offsets, count, first.samples, first.sample_rate)
+
+
+def read_seek_index(path):
+    # SeekIndex for an mp3, None for anything else or an unreadable file
+    if not path.lower().endswith(".mp3"):
+        return None
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None  # empty file
+        try:
+            return build_seek_index(data)
+        finally:
+            data.close()
+
+
+def wav_duration(data):
+    if len(data) < 12 or data[:4] not in (b"RIFF", b"RF64") or data[8:12] != b"WAVE":
+        return None
+    byte_rate = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack("<I", data[offset + 4:offset + 8])[0]
+        if chunk_id == b"fmt ":
+            byte_rate = struct.unpack("<I", data[offset + 16:offset + 20])[0]
+        elif chunk_id == b"data":
+            if not byte_rate:
+                return None
+            # Streams that were cut short report more data than they contain
+            available = len(data) - offset - 8
+            return min(chunk_size, available) / byte_rate
+        offset += 8 + chunk_size + (chunk_size & 1)  # chunks are word aligned
+    return None
+
+
+def read_duration(path):
+    # Duration in seconds from the file headers, None if we couldn't tell
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None  # empty file
+        try:
+            if path.lower().endswith(".wav"):
+                return wav_duration(data)
+            return mp3_duration(data)
+        finally:
+            data.close()
+
+
+def read_tags(path):
+    # (title, artist, album, track number) from the ID3 tag, Nones for
+    # anything missing or unreadable
+    if not path.lower().endswith(".mp3"):
+        return None, None, None, None
+    try:
+        import eyed3
+        eyed3.log.setLevel("ERROR")  # broken tags are common, don't log every one
+        audio_file = eyed3.load(path)
+        tag = audio_file.tag if audio_file else None
+        if tag is None:
+            return None, None, None, None
+        return tag.title, tag.artist, tag.album, tag.track_num[0]
+    except Exception:
+        return None, None, None, None
+
+
+class MetadataCache:
+    # Per-track metadata records keyed by path, re-read when the file changes
+    def __init__(self):
+        self.tracks = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return TrackInfo(path)
+        with self.lock:
+            info = self.tracks.get(path)
+        if info is not None and info.mtime == stat.st_mtime_ns and info.size == stat.st_size:
+            return info
+        info = TrackInfo(path, stat.st_mtime_ns, stat.st_size)
+        try:
+            info.duration = read_duration(path)
+        except (OSError, struct.error):
+            info.duration = None
+        with self.lock:
+            self.tracks[path] = info
+        return info
+
+    def add(self, info):
+        # Seed the cache with a record we already have (e.g. from the library index)
+        with self.lock:
+            self.tracks[info.path] = info
+
+    def duration(self, path):
+        return self.get(path).duration
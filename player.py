@@ -1,17 +1,43 @@
 import os
 import sys
-import pygame
-from tkinter import Tk, Label, Button, Listbox, filedialog, PhotoImage, ttk, Entry, Scale, StringVar, messagebox
-from ttkthemes import ThemedTk
-import requests
-from io import BytesIO
-from PIL import Image, ImageTk
-import eyed3
-import datetime
+import time
+from tkinter import (Tk, Toplevel, Text, Menu, Label, Button, filedialog, PhotoImage, ttk, Entry,
+                     Scale, StringVar, messagebox, TclError)
 import threading
-from random import shuffle
-from urllib.parse import urlparse
 import tempfile
+import queue
+import core
+import metadata
+import library_db
+import scanner
+import playlist_view
+import album_art
+import engine
+import downloads
+import loudness
+import waveform
+import waveform_view
+import instruments
+import playlists
+import session
+import fingerprint
+import duplicates_view
+
+# Wait this long after the last key press before searching
+SEARCH_DELAY_MS = 150
+# How often the progress bar and clock are refreshed
+PROGRESS_INTERVAL_MS = 100
+PROGRESS_HIDDEN_INTERVAL_MS = 1000
+# How often the Tk thread checks for tracks starting or ending
+ENGINE_POLL_MS = 100
+# How often download progress is shown while downloads are running
+DOWNLOAD_POLL_MS = 250
+# How often the profile window (F12, with --profile) is refreshed
+PROFILE_VIEW_MS = 1000
+# How often the queue and position are saved for the next start
+SESSION_SAVE_MS = 30000
+# Playlist entries added to the playlist per Tk callback while importing
+PLAYLIST_BATCH = 2000
 
 # Create the music player
 
@@ -23,9 +49,25 @@ class MusicPlayer:
         master.geometry("800x600")
         master.option_add("*Font", "SegoeUI 16")
 
-        self.song_paused = False
         self.user_set_time = None
-        self.offset_time = 0
+        self.progress_after_id = None
+        self.progress_ticks = 0
+        self.progress_due = None  # perf_counter() the next tick is meant for
+        self.progress_value = 0
+        self.current_time_text = ""
+
+        # Library, queue and playback live in core.Player, this class only
+        # shows them. The engine owns the mixer.
+        self.metadata = metadata.MetadataCache()
+        self.library_index = library_db.LibraryIndex()
+        self.core = core.Player(engine.PlaybackEngine(), self.metadata,
+                                seek_index=self.library_index.seek_index)
+        self.library = self.core.library
+        self.play_queue = self.core.queue
+        # Songs added by URL download in the background into the temp folder
+        self.downloads = downloads.DownloadManager(
+            os.path.join(tempfile.gettempdir(), "MusicPlayer"))
+        self.download_after_id = None
 
         self.search_box = Entry(master, width=20)
         self.search_box.grid(row=1, column=1, padx=5, pady=5)
@@ -35,34 +77,54 @@ class MusicPlayer:
         self.placeholder = "Search Song"
         self.search_box.insert(0, self.placeholder)
 
+        # Sort the playlist by the tags the scanner read
+        self.sort_orders = {"Date added": "date", "Artist": "artist", "Album": "album",
+                            "Title": "title"}
+        self.sort_box = ttk.Combobox(
+            master, values=list(self.sort_orders), state="readonly", width=17)
+        self.sort_box.set("Date added")
+        self.sort_box.grid(row=0, column=1, padx=5, pady=5)
+        self.sort_box.bind("<<ComboboxSelected>>", self.sort_songs)
+
         # Set the default theme
         self.style = ttk.Style()
         self.style.theme_use('ubuntu')
 
-        # Load the default album art
-        img = Image.open(self.resource_path("default_album_art.png"))
-        img = img.resize((100, 100))
-        self.album_art = ImageTk.PhotoImage(img)
+        # The default album art is put in once the window is up
+        self.album_art_cache = album_art.AlbumArtCache(
+            self.resource_path("default_album_art.png"),
+            os.path.join(library_db.user_data_dir(), "cache"))
+        self.album_art = None
 
-        self.album_art_label = ttk.Label(master, image=self.album_art)
+        self.album_art_label = ttk.Label(master)
         self.album_art_label.grid(row=2, column=0, padx=0, pady=0)
 
         self.song_name_label = Label(master, wraplength=250, justify="center")
         self.song_name_label.grid(row=3, column=0, padx=10, pady=10)
         self.song_name_label.grid_remove()  # Hide the song name label by default
 
+        # Queue, position, shuffle and repeat are picked up again on the next start
+        self.session = session.SessionStore(library_db.user_data_dir())
+        self.playlist_import = None  # entries still to add while a playlist loads
+        self.playlist_import_count = 0
+        self.playlist_after_id = None
+        self.duplicate_results = None  # queue the duplicate search answers on
+
         # Library Configuration
-        self.song_library = []
-        self.original_song_library = []
-        self.song_details = []
+        self.scanner = scanner.FolderScanner(self.library_index)
+        self.scanner_after_id = None
+        # Loudness of every song is measured once, after scanning
+        self.analyzer = loudness.LoudnessAnalyzer(self.library_index)
+        self.analyzer_after_id = None
+        self.analysis_total = 0
+        self.search_after_id = None
         self.current_album_art = None
         self.playlist_listbox = None
-        self.current_song_index = 0
-        self.playing = False
-        self.repeat = False
 
         # Playlist Configuration
-        self.playlist_listbox = Listbox(master, selectmode="MULTIPLE")
+        # Only the visible rows are real widgets, the rest is read from the play queue
+        self.playlist_listbox = playlist_view.PlaylistView(
+            master, display_name=self.song_display_name)
         self.playlist_listbox.grid(row=2, column=1, padx=10, pady=10)
         self.playlist_listbox.bind(
             '<<ListboxSelect>>', self.play_selected_song)
@@ -80,6 +142,11 @@ class MusicPlayer:
         # Bind the Return key to the Entry widget
         self.url_entry.bind("<Return>", self.add_url_library)
 
+        # Shows how far a folder scan has got
+        self.scan_status_label = Label(master, font=("Segoe UI", 10))
+        self.scan_status_label.grid(row=6, column=1, padx=5, pady=5)
+        self.scan_status_label.grid_remove()
+
         # Add the songs to the library
         self.add_button = Button(
             master, text="Select Folder", command=self.add_to_library)
@@ -102,49 +169,36 @@ class MusicPlayer:
 
         # Resize factor for the icons
         resize_factor = 0.5
-        # Load the icons
+        # Load the icons (subsampled once, then read back from the icon cache)
 
-        self.shuffle_icon = PhotoImage(file=self.resource_path("shuffle.png"))
-        self.shuffle_icon = self.shuffle_icon.subsample(
-            int(resize_factor * 100))
+        self.shuffle_icon = self.load_icon("shuffle.png", int(resize_factor * 100))
         self.shuffle_button = ttk.Button(
             button_frame, image=self.shuffle_icon, command=self.shuffle_songs)
         self.shuffle_button.grid(row=0, column=0, padx=5)
 
-        self.repeat_icon = PhotoImage(file=self.resource_path("repeat.png"))
-        self.repeat_icon = self.repeat_icon.subsample(int(resize_factor * 60))
-        self.repeat_once_icon = PhotoImage(
-            file=self.resource_path("repeat_once.png"))
-        self.repeat_once_icon = self.repeat_once_icon.subsample(
-            int(resize_factor * 60))
+        self.repeat_icon = self.load_icon("repeat.png", int(resize_factor * 60))
+        self.repeat_once_icon = self.load_icon("repeat_once.png", int(resize_factor * 60))
         self.repeat_button = ttk.Button(
             button_frame, image=self.repeat_icon, command=self.toggle_repeat)
         self.repeat_button.grid(row=0, column=5, padx=5)
 
-        self.play_icon = PhotoImage(file=self.resource_path("play.png"))
-        self.play_icon = self.play_icon.subsample(int(resize_factor * 100))
+        self.play_icon = self.load_icon("play.png", int(resize_factor * 100))
         self.play_button = ttk.Button(
             button_frame, image=self.play_icon, command=self.play)
         self.play_button.grid(row=0, column=3, padx=5)
 
-        self.pause_icon = PhotoImage(file=self.resource_path("pause.png"))
-        self.pause_icon = self.pause_icon.subsample(int(resize_factor * 100))
+        self.pause_icon = self.load_icon("pause.png", int(resize_factor * 100))
         self.pause_button = ttk.Button(
             button_frame, image=self.pause_icon, command=self.pause)
         self.pause_button.grid(row=0, column=2, padx=5)
         self.pause_button.grid_remove()  # Hide the pause button by default
 
-        self.forward_icon = PhotoImage(file=self.resource_path("forward.png"))
-        self.forward_icon = self.forward_icon.subsample(
-            int(resize_factor * 100))
+        self.forward_icon = self.load_icon("forward.png", int(resize_factor * 100))
         self.forward_button = ttk.Button(
             button_frame, image=self.forward_icon, command=self.forward)
         self.forward_button.grid(row=0, column=4, padx=5)
 
-        self.backward_icon = PhotoImage(
-            file=self.resource_path("backward.png"))
-        self.backward_icon = self.backward_icon.subsample(
-            int(resize_factor * 100))
+        self.backward_icon = self.load_icon("backward.png", int(resize_factor * 100))
         self.backward_button = ttk.Button(
             button_frame, image=self.backward_icon, command=self.backward)
         self.backward_button.grid(row=0, column=1, padx=5)
@@ -159,24 +213,157 @@ class MusicPlayer:
         self.current_time_label = Label(button_frame2)
         self.current_time_label.grid(row=0, column=0, padx=(10, 0))
 
-        self.mute_icon = PhotoImage(file=self.resource_path("mute.png"))
-        self.mute_icon = self.mute_icon.subsample(int(resize_factor * 60))
-        self.unmute_icon = PhotoImage(file=self.resource_path("unmute.png"))
-        self.unmute_icon = self.unmute_icon.subsample(int(resize_factor * 60))
+        self.mute_icon = self.load_icon("mute.png", int(resize_factor * 60))
+        self.unmute_icon = self.load_icon("unmute.png", int(resize_factor * 60))
         self.mute_button = Button(
             button_frame, image=self.unmute_icon, command=self.toggle_mute)
         self.mute_button.grid(row=0, column=6, padx=5)
 
-        # Create the progress bar
-        self.progress_bar = ttk.Progressbar(
-            button_frame2, orient="horizontal", length=400, mode="determinate")
+        # Create the progress bar, it shows the song's waveform once that is ready
+        self.progress_bar = waveform_view.WaveformBar(button_frame2, length=400)
         self.progress_bar.grid(row=0, column=1, padx=10)
+        cache_dir = os.path.join(library_db.user_data_dir(), "cache")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.waveforms = waveform.WaveformCache(os.path.join(cache_dir, "waveforms.bin"))
+        self.waveform_path = None  # the song the bar is showing
+        self.waveform_after_id = None
         self.progress_bar.bind("<Button-1>", self.set_progress_start)
         # self.progress_bar.bind("<B1-Motion>", self.set_progress_update)
-        self.update_progress_bar()
+
+        # Playlist files
+        menu_bar = Menu(master)
+        playlist_menu = Menu(menu_bar, tearoff=False)
+        playlist_menu.add_command(label="Open Playlist...", command=self.open_playlist)
+        playlist_menu.add_command(label="Save Playlist...", command=self.save_playlist)
+        menu_bar.add_cascade(label="Playlist", menu=playlist_menu)
+        library_menu = Menu(menu_bar, tearoff=False)
+        library_menu.add_command(label="Find Duplicates...", command=self.find_duplicates)
+        menu_bar.add_cascade(label="Library", menu=library_menu)
+        master.configure(menu=menu_bar)
 
         master.protocol("WM_DELETE_WINDOW", self.on_closing)
 
+        # Timings and counters, see instruments.py
+        self.profile_view = None
+        if instruments.enabled:
+            instruments.add_source("player", self.loop_stats)
+            master.bind("<F12>", self.show_profile)
+
+        # Everything else waits until the window has been drawn
+        master.after_idle(lambda: master.after(0, self.finish_startup))
+        master.after(ENGINE_POLL_MS, self.poll_engine)
+
+    def finish_startup(self):
+        if self.album_art is None:
+            self.album_art = self.album_art_cache.get_default_photo()
+            self.album_art_label.configure(image=self.album_art)
+        # Show what we already know straight away, then look for changes on disk
+        self.refresh_library()
+        self.restore_session()
+        self.master.after(100, self.rescan_library)
+        self.master.after(SESSION_SAVE_MS, self.save_session)
+
+    def restore_session(self):
+        saved = self.session.load()
+        if saved is None:
+            return
+        state, entries = saved
+        try:
+            self.core.restore(state, self.playlist_paths(entries))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            instruments.error("session", e)
+            return
+        self.playlist_listbox.set_items(self.play_queue.songs)
+        if len(self.play_queue):
+            self.playlist_listbox.see(self.play_queue.index)
+        if self.play_queue.repeat:
+            self.repeat_button.configure(image=self.repeat_once_icon)
+        if self.play_queue.shuffle_order is not None:
+            self.shuffle_button.state(["pressed"])
+
+    def save_session(self):
+        # Next time's first, so one failed save doesn't end the saving
+        self.master.after(SESSION_SAVE_MS, self.save_session)
+        try:
+            self.session.save(self.core)
+        except OSError as e:
+            instruments.error("session", e)
+
+    # Playlist entries with URLs swapped for their download's path (the
+    # download starts if it hasn't been made before)
+    def playlist_paths(self, entries):
+        for path, title, seconds in entries:
+            if "://" in path:
+                try:
+                    download = self.downloads.add(path)
+                except ValueError as e:
+                    instruments.error("playlist", e)
+                    continue
+                path = download.path
+                self.core.urls[path] = download.url
+                if self.download_after_id is None:
+                    self.download_after_id = self.master.after(DOWNLOAD_POLL_MS, self.poll_downloads)
+            yield path, title, seconds
+
+    # Load a playlist file into the playlist, a batch at a time
+    def open_playlist(self):
+        path = filedialog.askopenfilename(
+            title="Open Playlist", filetypes=[("Playlists", "*.m3u *.m3u8 *.pls"), ("All files", "*")])
+        if not path:
+            return
+        if self.playlist_after_id is not None:
+            self.master.after_cancel(self.playlist_after_id)
+            self.playlist_after_id = None
+        self.playlist_import = self.playlist_paths(playlists.read_playlist(path))
+        self.playlist_import_count = 0
+        self.search_box.grid()
+        self.scan_status_label.configure(text="Loading playlist...")
+        self.scan_status_label.grid()
+        self.load_playlist_batch(replace=True)
+
+    def load_playlist_batch(self, replace=False):
+        self.playlist_after_id = None
+        if self.playlist_import is None:
+            return
+        batch = []
+        try:
+            for entry in self.playlist_import:
+                batch.append(entry)
+                if len(batch) == PLAYLIST_BATCH:
+                    break
+        except (OSError, ValueError) as e:
+            instruments.error("playlist", e)
+            messagebox.showerror("Playlist", f"Couldn't read the playlist: {e}")
+            self.playlist_import = None
+        if batch or replace:
+            self.core.queue_entries(batch, replace=replace)
+            self.playlist_import_count += len(batch)
+            if replace:
+                self.playlist_listbox.set_items(self.play_queue.songs)
+                self.show_current_song()
+            else:
+                self.playlist_listbox.refresh()
+        if self.playlist_import is not None and len(batch) == PLAYLIST_BATCH:
+            self.scan_status_label.configure(
+                text=f"Loading playlist... {self.playlist_import_count} songs")
+            self.playlist_after_id = self.master.after(1, self.load_playlist_batch)
+            return
+        self.playlist_import = None
+        self.scan_status_label.configure(text=f"Playlist: {self.playlist_import_count} songs")
+        self.scan_status_label.after(2000, self.scan_status_label.grid_remove)
+
+    def save_playlist(self):
+        path = filedialog.asksaveasfilename(
+            title="Save Playlist", defaultextension=".m3u8",
+            filetypes=[("M3U8 playlist", "*.m3u8"), ("M3U playlist", "*.m3u"),
+                       ("PLS playlist", "*.pls")])
+        if not path:
+            return
+        try:
+            playlists.write_playlist(path, self.core.playlist_entries())
+        except OSError as e:
+            messagebox.showerror("Playlist", f"Couldn't save the playlist: {e}")
+
     @staticmethod
     def resource_path(relative_path):
         """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -184,12 +371,31 @@ class MusicPlayer:
             os.path.abspath(__file__)))
         return os.path.join(base_path, relative_path)
 
+    # Load an icon at 1/factor of its size. Subsampling the big PNGs is slow,
+    # so the small version is saved once and read back on later starts.
+    def load_icon(self, file_name, factor):
+        source = self.resource_path(file_name)
+        cache_dir = os.path.join(library_db.user_data_dir(), "icons")
+        cached = None
+        try:
+            cached = os.path.join(cache_dir, album_art.cached_name(source, factor))
+            return PhotoImage(file=cached)
+        except (OSError, TclError):
+            pass
+        icon = PhotoImage(file=source).subsample(factor)
+        if cached is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                icon.write(cached, format="png")
+            except (OSError, TclError):
+                pass  # no cache this time, still got the icon
+        return icon
+
     # Volume slider working upon
 
     def set_volume(self, volume):
-        pygame.mixer.init()
         self.volume = int(volume)
-        pygame.mixer.music.set_volume(self.volume / 100)
+        self.core.set_volume(self.volume / 100)
         self.volume_var.set(f"{self.volume}%")
         self.volume_label.grid()  # Show the volume label
         if self.volume == 0:
@@ -203,83 +409,130 @@ class MusicPlayer:
 
     def toggle_mute(self):
         if self.muted:
-            pygame.mixer.music.set_volume(self.volume / 100)
+            self.core.set_volume(self.volume / 100)
             self.mute_button.configure(image=self.unmute_icon)
             self.muted = False
         else:
-            pygame.mixer.music.set_volume(0)
+            self.core.set_volume(0)
             self.mute_button.configure(image=self.mute_icon)
             self.muted = True
 
     def toggle_repeat(self):
-        if self.repeat:
-            self.repeat = False
+        if self.play_queue.repeat:
+            self.core.set_repeat(False)
             self.repeat_button.configure(image=self.repeat_icon)
         else:
-            self.repeat = True
+            self.core.set_repeat(True)
             self.repeat_button.configure(image=self.repeat_once_icon)
 
-    # Search the song
+    # Search the song, once the user stops typing for a moment
     def search_song(self, event):
+        if self.search_after_id is not None:
+            self.master.after_cancel(self.search_after_id)
+        self.search_after_id = self.master.after(SEARCH_DELAY_MS, self.run_search)
+
+    def run_search(self):
+        self.search_after_id = None
         search_term = self.search_box.get()
-        if search_term:
-            matching_songs = [song for song in self.original_song_library if search_term.lower(
-            ) in os.path.basename(song).lower()]
-            if not matching_songs:
-                # print(f"No songs found for search term '{search_term}'")
-                messagebox.showinfo(
-                    "No songs found", f"No songs found with the name '{search_term}'")
-            else:
-                self.song_library = matching_songs
-        else:
-            self.song_library = self.original_song_library.copy()
-        self.playlist_listbox.delete(0, "end")
-        for song in self.song_library:
-            self.playlist_listbox.insert("end", os.path.basename(song))
-        self.current_song_index = 0
+        matching_songs = self.core.search(search_term)
+        if self.sort_box.get() != "Date added":
+            self.core.sort(self.sort_orders[self.sort_box.get()])
+        if search_term and not matching_songs:
+            # print(f"No songs found for search term '{search_term}'")
+            messagebox.showinfo(
+                "No songs found", f"No songs found with the name '{search_term}'")
+        self.playlist_listbox.set_items(self.play_queue.songs)
+        self.show_current_song()
 
 # The Search is working here but after the search box is cleared the songs are not coming back to the original list
 
+    def sort_songs(self, event=None):
+        self.core.sort(self.sort_orders[self.sort_box.get()])
+        self.playlist_listbox.set_items(self.play_queue.songs)
+        self.show_current_song()
+
     # Change theme
 
     def change_theme(self, event):
         selected_theme = self.theme_var.get()
         self.master.set_theme(selected_theme)
 
-    # Add Songs from the URL
+    # Add Songs from the URL, they download in the background
     def add_url_library(self, event=None):
         try:
             url = self.url_entry.get()
             if url:
-                response = requests.get(url)
-                if response.status_code == 200:
-                    file_path = urlparse(url).path
-                    basename = os.path.basename(file_path)
-
-                    temp_dir = tempfile.gettempdir()
-                    temp_file_path = os.path.join(temp_dir, basename)
-
-                    # .NamedTemporaryFile(delete=False, suffix=basename) as temp_file:
-                    with open(temp_file_path, 'wb') as temp_file:
-
-                        for chunk in response.iter_content(chunk_size=1024):
-                            if chunk:
-                                temp_file.write(chunk)
-                        temp_file.close()
-                    # Append the path of the temporary file to the song library
-                    self.song_library.append(temp_file_path)
-                    self.url_entry.delete(0, "end")
-
-                    self.playlist_listbox.insert(
-                        "end", basename)
-                    self.search_box.grid_remove()
-        except Exception as e:
+                download = self.downloads.add(url)
+                # The song shows up in the playlist straight away with its progress
+                self.core.add_to_queue(download.path)
+                self.core.urls[download.path] = download.url
+                self.url_entry.delete(0, "end")
+
+                self.playlist_listbox.refresh()
+                self.search_box.grid_remove()
+                if self.download_after_id is None:
+                    self.poll_downloads()
+        except ValueError as e:
             messagebox.showerror("Invalid URL", "Please enter a valid URL")
-            print(e)
+            instruments.error("add_url", e)
+
+    def poll_downloads(self):
+        self.download_after_id = None
+        changed = False
+        while True:
+            try:
+                kind, download = self.downloads.events.get_nowait()
+            except queue.Empty:
+                break
+            changed = True
+            track_id = self.core.tracks.lookup(download.path)
+            if kind == "failed" and track_id in self.play_queue.songs:
+                self.play_queue.remove({track_id})
+                self.playlist_listbox.set_items(self.play_queue.songs)
+                messagebox.showerror("Download failed", f"Couldn't download {download.url}")
+                instruments.error("download", download.error)
+            elif kind == "done" and track_id is not None:
+                # The whole song is there now, so is its real length
+                self.core.tracks.set_duration(track_id, None)
+                if self.core.active() and self.play_queue.current() == track_id:
+                    self.show_song_info(track_id)
+                    self.update_progress_bar()
+        if changed:
+            self.playlist_listbox.refresh()
+        if self.downloads.active() or not self.downloads.events.empty():
+            self.download_after_id = self.master.after(DOWNLOAD_POLL_MS, self.poll_downloads)
+
+    # Seconds, of what has arrived so far while the song is downloading
+    def song_length(self, song_data):
+        download = None
+        if self.downloads.downloads:
+            download = self.downloads.downloads.get(self.core.path(song_data))
+        return self.core.song_length(song_data, final=download is None or download.state == "done")
+
+    # Name of a song as shown to the user
+    def song_title(self, song_data):
+        if self.downloads.downloads:
+            download = self.downloads.downloads.get(self.core.path(song_data))
+            if download is not None:
+                return download.name
+        return self.core.tracks.name(song_data)
+
+    # Name of a song in the playlist, with progress for unfinished downloads
+    def song_display_name(self, song_data):
+        if self.downloads.downloads:
+            download = self.downloads.downloads.get(self.core.path(song_data))
+            if download is not None and download.state != "done":
+                return f"{download.name} ({download.percent()}%)"
+        return self.song_title(song_data)
 
     # Add songs to the library
 
     def add_to_library(self):
+        # The button cancels the scan while one is running
+        if self.scanner.running():
+            # poll_scanner sees it stop
+            self.scanner.cancel(wait_for_thread=False)
+            return
         try:
             # from local directory
             Tk().withdraw()
@@ -288,57 +541,186 @@ class MusicPlayer:
                 title="Select Music Folder")
             if directory_path == "":
                 raise ValueError("No folder selected")
-            for file_name in os.listdir(directory_path):
-                if file_name.endswith('.mp3') or file_name.endswith('.wav'):
-                    file_path = os.path.join(directory_path, file_name)
-
-                    # created to sort the songs by date added
-                    date_added = datetime.datetime.fromtimestamp(
-                        os.path.getctime(file_path))
-                    self.song_details.append((file_path, date_added))
-
-            # Sorting the songs by date added
-            self.song_details.sort(key=lambda x: x[1], reverse=True)
-
-            # Removing the date added from the list and populating the song_library list
-            self.song_library = [song[0] for song in self.song_details]
-            # Store the original song library for search box
-            self.original_song_library = self.song_library.copy()
-            for song in self.song_library:
-                self.playlist_listbox.insert("end", os.path.basename(song))
+            # Only files that are new or changed since the last scan get read
+            self.start_scan([directory_path])
         except ValueError as e:
             messagebox.showerror("No folder selected",
                                  "Please select a folder to add songs")
 
+    # Rescan the folders we already know about for new, changed or deleted songs
+    def rescan_library(self):
+        folders = self.library_index.folders()
+        if folders:
+            self.start_scan(folders)
+
+    # Scan folders in the background, the results come in through poll_scanner
+    def start_scan(self, folders):
+        # Analysis goes on once the scan is done, with whatever it found
+        self.analyzer.cancel(wait_for_thread=False)
+        self.scanner.start(folders)
+        self.add_button.configure(text="Cancel Scan")
+        self.scan_status_label.configure(text="Scanning...")
+        self.scan_status_label.grid()
+        if self.scanner_after_id is not None:
+            self.master.after_cancel(self.scanner_after_id)
+        self.scanner_after_id = self.master.after(50, self.poll_scanner)
+
+    def poll_scanner(self):
+        self.scanner_after_id = None
+        progress = None
+        while True:
+            try:
+                kind, payload = self.scanner.results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "tracks":
+                self.merge_tracks(payload)
+            elif kind == "removed":
+                self.remove_tracks(payload)
+            elif payload is self.scanner.progress:
+                progress = payload  # not a cancelled scan's last word
+        if progress is not None:
+            if progress.done:
+                state = "cancelled" if progress.cancelled else "done"
+                read = ""
+                if progress.read:
+                    read = f", read {progress.read} ({progress.read_rate():.0f}/s)"
+                self.scan_status_label.configure(
+                    text=f"Scan {state}: {progress.files} songs in {progress.folders} folders{read}")
+                self.add_button.configure(text="Select Folder")
+                if progress.cancelled or not self.start_analysis():
+                    self.scan_status_label.after(2000, self.scan_status_label.grid_remove)
+                return
+            self.scan_status_label.configure(
+                text=f"Scanning... {progress.files} songs in {progress.folders} folders")
+        self.scanner_after_id = self.master.after(50, self.poll_scanner)
+
+    # Measure the loudness of songs that haven't been yet, returns whether it started
+    def start_analysis(self):
+        paths = self.library_index.unanalysed()
+        if not paths:
+            return False
+        self.analysis_total = len(paths)
+        self.analyzer.start(paths)
+        if self.analyzer_after_id is not None:
+            self.master.after_cancel(self.analyzer_after_id)
+        self.analyzer_after_id = self.master.after(500, self.poll_analyzer)
+        return True
+
+    def poll_analyzer(self):
+        self.analyzer_after_id = None
+        progress = None
+        while True:
+            try:
+                kind, payload = self.analyzer.results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "loudness":
+                self.core.set_loudness(payload)
+            elif payload is self.analyzer.progress:
+                progress = payload  # not a cancelled run's last word
+        if progress is not None:
+            status = f"{progress.tracks}/{self.analysis_total} songs ({progress.rate():.0f}x realtime)"
+            if progress.done:
+                if not progress.cancelled:
+                    self.scan_status_label.configure(text=f"Analysis done: {status}")
+                    self.scan_status_label.after(2000, self.scan_status_label.grid_remove)
+                return
+            self.scan_status_label.configure(text=f"Analysing songs... {status}")
+            self.scan_status_label.grid()
+        self.analyzer_after_id = self.master.after(500, self.poll_analyzer)
+
+    # Songs the scanner found (new or changed since the last scan)
+    def merge_tracks(self, tracks):
+        if tracks:
+            self.search_box.grid()  # Show the search box
+        self.core.add_tracks(tracks)
+        self.playlist_listbox.refresh()
+        self.show_current_song()
+
+    def remove_tracks(self, paths):
+        if self.core.remove_tracks(paths):
+            self.playlist_listbox.set_items(self.play_queue.songs)
+            self.show_current_song()
+
+    # Look for songs that are in the library more than once, by their
+    # fingerprints (made along with the loudness analysis)
+    def find_duplicates(self):
+        if self.duplicate_results is not None:
+            return  # already looking
+        self.duplicate_results = queue.Queue()
+        rows = self.library_index.fingerprints()
+
+        def search(results=self.duplicate_results):
+            try:
+                with instruments.timed("duplicates"):
+                    results.put(fingerprint.find_duplicates(rows))
+            except Exception as e:
+                instruments.error("duplicates", e)
+                results.put(None)
+        threading.Thread(target=search, name="duplicates", daemon=True).start()
+        self.scan_status_label.configure(text=f"Looking for duplicates among {len(rows)} songs...")
+        self.scan_status_label.grid()
+        self.master.after(100, self.poll_duplicates)
+
+    def poll_duplicates(self):
+        try:
+            groups = self.duplicate_results.get_nowait()
+        except queue.Empty:
+            self.master.after(100, self.poll_duplicates)
+            return
+        self.duplicate_results = None
+        self.scan_status_label.grid_remove()
+        if groups is None:
+            messagebox.showerror("Duplicates", "Couldn't look for duplicates")
+        elif not groups:
+            message = "No song is in the library twice"
+            if self.analyzer.running():
+                message += " (songs still being analysed aren't checked yet)"
+            messagebox.showinfo("Duplicates", message)
+        else:
+            duplicates_view.DuplicatesView(self.master, groups, self.merge_duplicates)
+
+    # rows: (path, path of the copy that stays). The files stay where they are.
+    def merge_duplicates(self, rows):
+        self.library_index.merge_duplicates(rows)
+        self.remove_tracks([path for path, _ in rows])
+
+    # Highlight the song that is playing in the playlist
+    def show_current_song(self):
+        if self.core.active():
+            self.playlist_listbox.set_current(self.play_queue.index)
+        else:
+            self.playlist_listbox.set_current(None)
+
+    # Fill the playlist from the library index
+    def refresh_library(self):
+        tracks = self.library_index.load()
+        if tracks:
+            self.search_box.grid()  # Show the search box
+        # The index returns them sorted by date added, newest first
+        self.core.load_library(tracks)
+        self.playlist_listbox.set_items(self.play_queue.songs)
+
     # Get the album art from the song
     # Need to call this function before playing the songs with current index of that song
 
-    def get_album_art(self, file_path):
-        audio_file = eyed3.load(file_path)
-        if audio_file.tag:
-            if audio_file.tag.images:
-                image_data = audio_file.tag.images[0].image_data
-                img = Image.open(BytesIO(image_data))
-                img = img.resize((350, 250))
-                self.album_art = ImageTk.PhotoImage(img)
-                self.album_art_label.configure(image=self.album_art)
-            else:
-                img = Image.open("default_album_art.png")
-                img = img.resize((100, 100))
-                self.album_art = ImageTk.PhotoImage(img)
-                self.album_art_label.configure(image=self.album_art)
-        else:
-            img = Image.open("default_album_art.png")
-            img = img.resize((100, 100))
-            self.album_art = ImageTk.PhotoImage(img)
-            self.album_art_label.configure(image=self.album_art)
+    def get_album_art(self, song_data):
+        self.album_art = self.album_art_cache.get_photo(self.core.path(song_data))
+        self.album_art_label.configure(image=self.album_art)
+        # Have the next and previous songs' art ready before they're needed
+        queue = self.play_queue
+        neighbours = [queue.next_song()]
+        if queue.index > 0:
+            neighbours.append(queue.songs[queue.index - 1])
+        self.album_art_cache.prefetch(
+            [self.core.path(song) for song in neighbours if song is not None])
 
     # Playing Selected Song from the List
     def play_selected_song(self, event):
         try:
-            self.current_song_index = self.playlist_listbox.curselection()[0]
-            song_data = self.song_library[self.current_song_index]
-            self.offset_time = 0
+            self.play_queue.select(self.playlist_listbox.curselection()[0])
+            song_data = self.play_queue.current()
             self.play(song_data)
             self.get_album_art(song_data)
         except IndexError:
@@ -349,152 +731,254 @@ class MusicPlayer:
 # Stop the music
 
     def stop(self):
-        pygame.mixer.music.stop()
-        self.playing = False
+        self.core.stop()
         self.progress_bar.stop()
         self.song_name_label.grid_remove()  # Hide the song name label
+        self.show_current_song()
 
     # Play the music
 
     def play(self, song_data=None):  # The play function is playing from the start of the list and we cant play from the list due to this as the play function is not taking any index value from where tho play from the list I think we need to add the index value or pass it in function
         try:
-            if self.song_paused:
-                pygame.mixer.music.unpause()
-                self.song_paused = False
+            if self.core.paused:
+                self.core.resume()
                 # self.update_progress_bar()
                 self.play_button.grid_remove()  # Hide the play button when playing the song
                 self.pause_button.grid()  # Show the pause button when playing the song
-                self.playing = True
                 self.update_progress_bar()
 
             else:
-                self.stop()
-                song_data = self.song_library[self.current_song_index]
-                pygame.mixer.music.load(song_data)
-                song_name = os.path.basename(song_data)
-                self.song_name_label.configure(text=song_name)
-                self.song_name_label.grid()
-                song = pygame.mixer.Sound(song_data)
-                length = song.get_length()
-                minutes = int(length // 60)
-                seconds = int(length % 60)
-                self.total_time_label.configure(text=f"{minutes}:{seconds:02}")
-                pygame.mixer.music.play()
-                self.play_button.grid_remove()  # Hide the play button when playing the song
-                self.pause_button.grid()  # Show the pause button when playing the song
-                self.playing = True
-                self.update_progress_bar()
-                pygame.mixer.music.set_endevent(pygame.USEREVENT)
-                threading.Thread(target=self.wait_for_song_end,
-                                 args=(song_data,)).start()
+                song_data = self.play_queue.current()
+                path = self.core.path(song_data)
+                download = self.downloads.downloads.get(path)
+                if download is not None and not download.playable():
+                    messagebox.showinfo(
+                        "Still downloading", f"{download.name} will be playable in a moment")
+                    return
+                # Playlists and saved sessions aren't checked when they load
+                if download is None and not os.path.exists(path):
+                    messagebox.showerror("Song not found", f"{path} doesn't exist any more")
+                    return
+                with instruments.timed("play"):
+                    self.core.play()
+                    self.show_playing(song_data)
         except IndexError:
             messagebox.showerror("No song selected",
                                  "Please select a song to play")
 
-    def wait_for_song_end(self, song_data):
-        self.offset_time = 0
-        while pygame.event.wait().type != pygame.USEREVENT:
-            pass
-        if self.repeat:
-            self.play(song_data)
+    # Update everything that shows the song that is playing
+    def show_playing(self, song_data):
+        self.user_set_time = None
+        self.show_song_info(song_data)
+        self.play_button.grid_remove()  # Hide the play button when playing the song
+        self.pause_button.grid()  # Show the pause button when playing the song
+        self.show_current_song()
+        self.playlist_listbox.see(self.play_queue.index)
+        self.update_progress_bar()
+        self.show_waveform(song_data)
+
+    # Draw the song's waveform in the seek bar, or have it made if it isn't cached
+    def show_waveform(self, song_data):
+        self.waveform_path = self.core.path(song_data)
+        self.progress_bar.set_envelope(self.waveforms.get(self.waveform_path))
+        next_song = self.play_queue.next_song()
+        for track_id in (song_data, next_song):
+            if track_id is None:
+                continue
+            path = self.core.path(track_id)
+            download = self.downloads.downloads.get(path)
+            if download is None or download.state == "done":
+                self.waveforms.request(path)
+        if self.waveforms.pending and self.waveform_after_id is None:
+            self.waveform_after_id = self.master.after(200, self.poll_waveforms)
+
+    def poll_waveforms(self):
+        self.waveform_after_id = None
+        while True:
+            try:
+                path, found = self.waveforms.results.get_nowait()
+            except queue.Empty:
+                break
+            if found and path == self.waveform_path:
+                self.progress_bar.set_envelope(self.waveforms.get(path))
+        if self.waveforms.pending or not self.waveforms.results.empty():
+            self.waveform_after_id = self.master.after(200, self.poll_waveforms)
+
+    def show_song_info(self, song_data):
+        song_name = self.song_title(song_data)
+        self.song_name_label.configure(text=song_name)
+        self.song_name_label.grid()
+        length = self.song_length(song_data)
+        minutes = int(length // 60)
+        seconds = int(length % 60)
+        self.total_time_label.configure(text=f"{minutes}:{seconds:02}")
+
+    # Pick up tracks starting and ending in the playback engine
+    def poll_engine(self):
+        for kind, song_data in self.core.poll():
+            if kind == "started":
+                # The engine moved on to the queued song by itself
+                self.show_playing(song_data)
+                self.get_album_art(song_data)
+            else:  # ended, or couldn't be played
+                self.play_button.grid()  # Show the play button
+                self.pause_button.grid_remove()
+                self.show_current_song()
+        self.master.after(ENGINE_POLL_MS, self.poll_engine)
 
 # Pause the music
     def pause(self):
-        if self.playing:
-            pygame.mixer.music.pause()
-            self.playing = False
-            self.song_paused = True
+        if self.core.playing:
+            self.core.pause()
             self.play_button.grid()  # Show the play button
             self.pause_button.grid_remove()
 
     # Go to the next song
     def forward(self):
-        try:
-            self.stop()
-            self.offset_time = 0
-            if self.current_song_index < len(self.song_library) - 1:
-                self.current_song_index += 1
-                song_data = self.song_library[self.current_song_index]
-                self.play(song_data)
-                self.get_album_art(song_data)
-            else:
-                raise ValueError("No Song in Playlist")
-        except ValueError:
-            messagebox.showerror("No song selected", "No Song in Playlist")
-    # Go back to the previous song
+        self.skip(self.core.forward)
 
+    # Go back to the previous song
     def backward(self):
+        self.skip(self.core.backward)
+
+    def skip(self, step):
         try:
-            self.stop()
-            self.offset_time = 0
-            if self.current_song_index > 0:
-                self.current_song_index -= 1
-                song_data = self.song_library[self.current_song_index]
-                self.play(song_data)
-                self.get_album_art(song_data)
-            else:
-                raise ValueError("No Song in Playlist")
+            song_data = step()
+            self.show_playing(song_data)
+            self.get_album_art(song_data)
         except ValueError:
+            self.stop()
             messagebox.showerror("No song selected", "No Song in Playlist")
 
-    # Update the progress bar as the song plays
+    # Update the progress bar as the song plays.
+    # There is only ever one loop, run by Tk's after() on the main thread;
+    # calling this again just refreshes the song length.
     def update_progress_bar(self):
-        if 0 <= self.current_song_index < len(self.song_library):
-            total_time = pygame.mixer.Sound(
-                self.song_library[self.current_song_index]).get_length() * 1000
-            self.progress_bar["maximum"] = total_time
-
-            def update():
-                if self.playing:
-                    if self.user_set_time is not None:
-                        current_time = self.user_set_time
-                        self.user_set_time = None  # Reset the user_set_time
-                    else:
-                        current_time = (pygame.mixer.music.get_pos(
-                        ) + self.offset_time)  # + self.offset_time
-                    current_time_for_label = current_time / 1000
-                    minutes = int(current_time_for_label // 60)
-                    seconds = int(current_time_for_label % 60)
-                    self.current_time_label.configure(
-                        text=f"{minutes}:{seconds:02}")
-                    self.progress_bar["value"] = current_time
-                    threading.Timer(0.1, update).start()
-
-            update()
+        if 0 <= self.play_queue.index < len(self.play_queue):
+            total_time = self.song_length(self.play_queue.current()) * 1000
+            self.progress_bar.set_maximum(total_time)
+            if self.progress_after_id is None and self.core.playing:
+                self.progress_tick()
+
+    def progress_tick(self):
+        self.progress_after_id = None
+        due, self.progress_due = self.progress_due, None
+        if not self.core.playing:
+            return  # play() starts the loop again
+        self.progress_ticks += 1
+        if due is not None:
+            # How late Tk ran this tick, a sign of the Tk thread being busy
+            instruments.record("progress.jitter", (time.perf_counter() - due) * 1000)
+        if self.user_set_time is not None:
+            current_time = self.user_set_time
+            self.user_set_time = None  # Reset the user_set_time
+        else:
+            current_time = self.core.position()
+        current_time_for_label = current_time / 1000
+        minutes = int(current_time_for_label // 60)
+        seconds = int(current_time_for_label % 60)
+        label = f"{minutes}:{seconds:02}"
+        # Only touch the widgets when what they show actually changes
+        if label != self.current_time_text:
+            self.current_time_text = label
+            self.current_time_label.configure(text=label)
+        if int(current_time) != int(self.progress_value):
+            self.progress_value = current_time
+            self.progress_bar.set_value(current_time)
+        # Nobody is looking while the window is minimised, so slow down
+        if self.master.state() == "iconic":
+            interval = PROGRESS_HIDDEN_INTERVAL_MS
+        else:
+            interval = PROGRESS_INTERVAL_MS
+        self.progress_after_id = self.master.after(interval, self.progress_tick)
+        if instruments.enabled:
+            self.progress_due = time.perf_counter() + interval / 1000
+
+    # Counters for keeping an eye on CPU and thread use in long sessions
+    def loop_stats(self):
+        return {"progress_ticks": self.progress_ticks,
+                "threads": threading.active_count()}
 
     # Set the progress bar to the clicked position
     def set_progress_start(self, event):
-        if self.playing:
+        if self.core.playing:
             clicked_x = event.x
             total_width = self.progress_bar.winfo_width()
-            total_time = pygame.mixer.Sound(
-                self.song_library[self.current_song_index]).get_length() * 1000
+            total_time = self.song_length(self.play_queue.current()) * 1000
             new_time = (clicked_x / total_width) * \
                 total_time  # Set new position in seconds
-            # Dividing by 1000 to convert it into seconds
-            pygame.mixer.music.set_pos(new_time / 1000)
-            self.user_set_time = new_time  # Dividing by 1000 to convert it into seconds
-            self.offset_time = new_time
-            self.progress_bar["value"] = self.user_set_time
-            print("this is new time: " + str(new_time / 1000))
-
+            # Seeking lands on the start of an mp3 frame, show where exactly
+            with instruments.timed("seek"):
+                new_time = self.core.seek(new_time / 1000) * 1000
+            self.user_set_time = new_time
+            self.progress_bar.set_value(self.user_set_time)
+            self.progress_value = self.user_set_time
+
+    # Shuffle only changes the play order, the playlist stays as it is
     def shuffle_songs(self):
-        shuffle(self.song_library)
-        self.playlist_listbox.delete(0, "end")
-        for song in self.song_library:
-            self.playlist_listbox.insert("end", os.path.basename(song))
-        self.current_song_index = 0
+        if self.play_queue.shuffle_order is not None:
+            self.core.set_shuffle(False)
+            self.shuffle_button.state(["!pressed"])
+        else:
+            self.core.set_shuffle(True)
+            self.shuffle_button.state(["pressed"])
+
+    # Live view of the instrumentation, refreshed while it is open
+    def show_profile(self, event=None):
+        if self.profile_view is not None:
+            self.profile_view.lift()
+            return
+        self.profile_view = Toplevel(self.master)
+        self.profile_view.title("Profile")
+        text = Text(self.profile_view, width=80, height=30, font=("Courier", 10))
+        text.pack(fill="both", expand=True)
+
+        def refresh():
+            if self.profile_view is None:
+                return
+            text.delete("1.0", "end")
+            text.insert("1.0", instruments.report())
+            self.profile_view.after(PROFILE_VIEW_MS, refresh)
+
+        def close():
+            self.profile_view.destroy()
+            self.profile_view = None
+        self.profile_view.protocol("WM_DELETE_WINDOW", close)
+        refresh()
 
     def on_closing(self):
+        # Before stopping, so the position is still there to save
+        try:
+            self.session.save(self.core)
+        except OSError as e:
+            instruments.error("session", e)
+        if instruments.enabled:
+            try:
+                instruments.dump(instruments.dump_path
+                                 or os.path.join(library_db.user_data_dir(), "profile.json"))
+            except OSError as e:
+                instruments.error("profile", e)
         self.stop()
+        self.core.shutdown()
+        self.downloads.close()
+        self.scanner.cancel(wait_for_thread=False)
+        self.analyzer.cancel(wait_for_thread=False)
+        self.waveforms.close()
+        self.album_art_cache.close()
+        self.library_index.close()
         self.master.destroy()
         os._exit(0)
 
 
 # Run the program
 if __name__ == "__main__":
-    pygame.init()
+    import multiprocessing
+    # Tags and loudness are read in worker processes, which need this when frozen
+    multiprocessing.freeze_support()
+    # --profile[=file.json] or MUSICPLAYER_PROFILE: timings, dumped on exit
+    instruments.setup()
+    from ttkthemes import ThemedTk
+    # pygame is imported and started by the playback engine's thread
     root = ThemedTk()
     player = MusicPlayer(root)
     root.mainloop()
-    pygame.quit()
@@ -0,0 +1,125 @@
+from tkinter import Frame, Label, Scrollbar
+import instruments
+
+# Virtualized playlist.
+# A Listbox holds a Tcl string for every song and needs a Tcl call per insert,
+# so big libraries get slow to fill, filter and shuffle. This view is backed by
+# the player's own song list and only has a Label for each visible row; scrolling
+# just changes which songs those labels show. Replacing or reordering the list
+# costs one redraw of the visible rows.
+#
+# It keeps the bits of the Listbox interface the player uses: curselection(),
+# see() and the <<ListboxSelect>> event.
+
+
+class PlaylistView(Frame):
+    def __init__(self, master, display_name=str, height=10, width=20, **kwargs):
+        super().__init__(master, **kwargs)
+        self.display_name = display_name
+        self.items = []
+        self.top = 0  # index of the song in the first row
+        self.selected = None
+        self.current = None  # song that is playing
+
+        self.background = "white"
+        self.select_background = "#3399ff"
+        self.current_foreground = "#0078d7"
+
+        self.rows = []
+        for row in range(height):
+            label = Label(self, width=width, anchor="w", bg=self.background)
+            label.grid(row=row, column=0, sticky="ew")
+            label.bind("<Button-1>", lambda event, row=row: self.click(row))
+            self.bind_scroll(label)
+            self.rows.append(label)
+        self.scrollbar = Scrollbar(self, orient="vertical", command=self.yview)
+        self.scrollbar.grid(row=0, column=1, rowspan=height, sticky="ns")
+        self.bind_scroll(self)
+
+    def bind_scroll(self, widget):
+        widget.bind("<MouseWheel>", lambda event: self.scroll(-1 if event.delta > 0 else 1))
+        widget.bind("<Button-4>", lambda event: self.scroll(-1))
+        widget.bind("<Button-5>", lambda event: self.scroll(1))
+
+    def size(self):
+        return len(self.items)
+
+    # Show a new list of songs (the view keeps a reference, not a copy)
+    def set_items(self, items):
+        self.items = items
+        self.top = 0
+        self.selected = None
+        self.refresh()
+
+    def set_current(self, index):
+        self.current = index
+        self.refresh()
+
+    def curselection(self):
+        return () if self.selected is None else (self.selected,)
+
+    def selection_set(self, index):
+        self.selected = index
+        self.refresh()
+
+    def see(self, index):
+        if index < self.top:
+            self.top = index
+        elif index >= self.top + len(self.rows):
+            self.top = index - len(self.rows) + 1
+        self.refresh()
+
+    def click(self, row):
+        index = self.top + row
+        if index < len(self.items):
+            self.selected = index
+            self.refresh()
+            self.event_generate("<<ListboxSelect>>")
+
+    def scroll(self, rows):
+        self.scroll_to(self.top + rows)
+
+    def scroll_to(self, top):
+        last_top = max(0, len(self.items) - len(self.rows))
+        top = max(0, min(int(top), last_top))
+        if top != self.top:
+            self.top = top
+            self.refresh()
+
+    # Scrollbar callback, same arguments as Listbox.yview
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(float(args[1]) * len(self.items))
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            if args[2] == "pages":
+                amount *= len(self.rows)
+            self.scroll(amount)
+
+    # Redraw the visible rows from the song list
+    def refresh(self):
+        with instruments.timed("playlist.refresh"):
+            self.redraw()
+
+    def redraw(self):
+        if self.top > max(0, len(self.items) - len(self.rows)):
+            self.top = max(0, len(self.items) - len(self.rows))
+        for row, label in enumerate(self.rows):
+            index = self.top + row
+            if index < len(self.items):
+                text = self.display_name(self.items[index])
+            else:
+                text = ""
+            if index == self.selected:
+                bg, fg = self.select_background, "white"
+            elif index == self.current:
+                bg, fg = self.background, self.current_foreground
+            else:
+                bg, fg = self.background, "black"
+            label.configure(text=text, bg=bg, fg=fg)
+        if self.items:
+            first = self.top / len(self.items)
+            last = min(1.0, (self.top + len(self.rows)) / len(self.items))
+        else:
+            first, last = 0.0, 1.0
+        self.scrollbar.set(first, last)
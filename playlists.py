@@ -0,0 +1,138 @@
+import os
+from urllib.parse import urlparse
+
+# Playlist files: M3U/M3U8 and PLS.
+# read_playlist() is a generator that reads the file a line at a time and
+# yields entries as it goes, so the player can fill the playlist in batches
+# from a Tk after() loop however long the file is. Entries are
+# (path or URL, title or None, seconds or None); relative paths are taken
+# from the playlist's folder. Nothing is checked against the disk here, a
+# missing file is only noticed when it is played.
+#
+# Lines are decoded as UTF-8, falling back to Latin-1 line by line for old
+# .m3u files written in a legacy code page.
+
+PLAYLIST_EXTENSIONS = (".m3u", ".m3u8", ".pls")
+
+
+def is_playlist_file(file_name):
+    return file_name.lower().endswith(PLAYLIST_EXTENSIONS)
+
+
+def decode_line(line):
+    try:
+        text = line.decode("utf-8")
+    except UnicodeDecodeError:
+        text = line.decode("latin-1")
+    return text.lstrip("\ufeff").strip()
+
+
+def resolve(entry, folder):
+    if entry.lower().startswith("file://"):
+        # urllib.request pulls in http.client, only wanted once it is used
+        from urllib.request import url2pathname
+        return url2pathname(urlparse(entry).path)  # which unquotes it too
+    if "://" in entry:
+        return entry  # a URL, the player decides what to do with it
+    if os.sep == "/" and "\\" in entry:
+        entry = entry.replace("\\", "/")  # written on Windows
+    if entry.startswith("~"):
+        entry = os.path.expanduser(entry)
+    if os.path.isabs(entry):
+        return entry
+    return os.path.normpath(os.path.join(folder, entry))
+
+
+def parse_seconds(text):
+    try:
+        seconds = float(text)
+    except ValueError:
+        return None
+    return seconds if seconds >= 0 else None  # -1 means unknown (streams)
+
+
+def read_m3u(lines, folder):
+    title = seconds = None
+    for line in lines:
+        text = decode_line(line)
+        if not text:
+            continue
+        if text.startswith("#"):
+            if text.upper().startswith("#EXTINF:"):
+                # #EXTINF:<seconds>[ attributes],<title>
+                info, _, title = text[8:].partition(",")
+                seconds = parse_seconds(info.split()[0]) if info.split() else None
+                title = title.strip() or None
+            continue
+        yield resolve(text, folder), title, seconds
+        title = seconds = None
+
+
+def read_pls(lines, folder):
+    # FileN=, TitleN= and LengthN= keys, an entry is done when the number changes
+    number = None
+    entry = [None, None, None]
+    for line in lines:
+        key, separator, value = decode_line(line).partition("=")
+        if not separator:
+            continue
+        key = key.strip().lower()
+        for field, prefix in enumerate(("file", "title", "length")):
+            if key.startswith(prefix) and key[len(prefix):].isdigit():
+                break
+        else:
+            continue
+        if key[len(prefix):] != number:
+            if entry[0] is not None:
+                yield tuple(entry)
+            number = key[len(prefix):]
+            entry = [None, None, None]
+        value = value.strip()
+        if field == 0:
+            entry[0] = resolve(value, folder)
+        elif field == 1:
+            entry[1] = value or None
+        else:
+            entry[2] = parse_seconds(value)
+    if entry[0] is not None:
+        yield tuple(entry)
+
+
+def read_playlist(path):
+    # Yields (path or URL, title, seconds) for each entry in the file
+    folder = os.path.dirname(os.path.abspath(path))
+    with open(path, "rb") as f:
+        if path.lower().endswith(".pls"):
+            yield from read_pls(f, folder)
+        else:
+            yield from read_m3u(f, folder)
+
+
+def write_playlist(path, entries):
+    # entries: (path, title or None, seconds or None). Written to a temporary
+    # file first, so a failed write leaves the old playlist alone.
+    # Songs under the playlist's folder are written relative to it, so a
+    # folder of songs and its playlist can be moved together
+    prefix = os.path.join(os.path.dirname(os.path.abspath(path)), "")
+    pls = path.lower().endswith(".pls")
+    temporary = path + ".tmp"
+    count = 0
+    with open(temporary, "w", encoding="utf-8", newline="\n") as f:
+        f.write("[playlist]\n" if pls else "#EXTM3U\n")
+        for count, (song, title, seconds) in enumerate(entries, 1):
+            if song.startswith(prefix):
+                song = song[len(prefix):]
+            length = -1 if seconds is None else int(round(seconds))
+            if pls:
+                f.write(f"File{count}={song}\n")
+                if title:
+                    f.write(f"Title{count}={title}\n")
+                f.write(f"Length{count}={length}\n")
+            else:
+                if title or seconds is not None:
+                    f.write(f"#EXTINF:{length},{title or ''}\n")
+                f.write(song + "\n")
+        if pls:
+            f.write(f"NumberOfEntries={count}\nVersion=2\n")
+    os.replace(temporary, path)
+    return count
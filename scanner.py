@@ -0,0 +1,268 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from metadata import TrackInfo, read_duration, read_seek_index, read_tags
+import instruments
+
+# Recursive folder scanner.
+# Directories are listed with os.scandir on a small thread pool (most of the
+# time goes into waiting on the disk, so threads are enough). Each directory is
+# checked against the library index and only new or changed files are read.
+# Reading them (ID3 tags and durations) is mostly Python work, so it is done
+# in batches on a process pool instead. An mp3's seek index comes out of the
+# same pass over its frame headers that gives the duration. Results are put on a queue in batches
+# for the Tk thread to pick up with after(), so the window never waits on the
+# disk. Cancelling only signals the scan thread, which stops within
+# PROGRESS_INTERVAL and reports itself done (cancelled) like any other scan.
+
+AUDIO_EXTENSIONS = (".mp3", ".wav")
+# Fewer new files than this are read on the scanner thread, starting worker
+# processes would take longer than reading them
+MIN_PROCESS_BATCH = 50
+PROGRESS_INTERVAL = 0.1  # seconds between progress messages
+
+
+def is_audio_file(file_name):
+    return file_name.lower().endswith(AUDIO_EXTENSIONS)
+
+
+def inside_any(folder, folders):
+    # Whether folder is one of folders or somewhere under one of them
+    while folder not in folders:
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return False
+        folder = parent
+    return True
+
+
+def read_track(path, mtime, size, ctime):
+    # Build a full record for a file we haven't seen before (or that changed).
+    # A file that fails to parse still gets a record, just without the details;
+    # this never raises.
+    info = TrackInfo(path, mtime, size, date_added=ctime)
+    try:
+        seek_index = read_seek_index(path)
+        if seek_index is not None:
+            info.duration = seek_index.duration()
+            info.seek_index = seek_index.to_bytes()
+        else:
+            info.duration = read_duration(path)
+    except Exception:
+        info.duration = None
+    try:
+        info.title, info.artist, info.album, info.track_number = read_tags(path)
+    except Exception:
+        pass
+    return info
+
+
+def read_tracks(files):
+    # Runs in a worker process: files are (path, mtime, size, ctime) tuples
+    return [read_track(*file) for file in files]
+
+
+class ScanProgress:
+    __slots__ = ("folders", "files", "read", "done", "cancelled", "read_started", "read_seconds")
+
+    def __init__(self):
+        self.folders = 0  # directories listed
+        self.files = 0  # audio files seen
+        self.read = 0  # new or changed files that had to be read
+        self.done = False
+        self.cancelled = False
+        self.read_started = None  # time.monotonic() when the first batch went out
+        self.read_seconds = 0  # from then until the last batch came back
+
+    # New or changed files read per second
+    def read_rate(self):
+        return self.read / self.read_seconds if self.read_seconds else 0
+
+
+class FolderScanner:
+    def __init__(self, index, workers=4, batch_size=200, readers=None):
+        self.index = index
+        self.workers = workers
+        self.batch_size = batch_size
+        self.readers = readers or os.cpu_count() or 1  # tag reading processes
+        # Messages for the UI: ("tracks", [TrackInfo]), ("removed", [path]),
+        # ("progress", ScanProgress)
+        self.results = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.thread = None
+        self.progress = ScanProgress()
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, folders):
+        # A scan still running finishes on its own, its progress isn't self.progress
+        self.cancel(wait_for_thread=False)
+        self.cancel_event = threading.Event()
+        self.progress = ScanProgress()
+        self.thread = threading.Thread(
+            target=self.run, args=(list(folders), self.cancel_event, self.progress), daemon=True)
+        self.thread.start()
+
+    def cancel(self, wait_for_thread=True):
+        self.cancel_event.set()
+        if self.thread is not None and wait_for_thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self, folders, cancelled, progress):
+        try:
+            self.scan(folders, cancelled, progress)
+        except Exception as e:
+            # Whatever went wrong, the UI hears that the scan is over
+            instruments.error("scan", e)
+            progress.cancelled = True
+        progress.done = True
+        self.results.put(("progress", progress))
+
+    def scan(self, folders, cancelled, progress):
+        unread = []  # (path, mtime, size, ctime) of new or changed files
+        reading = {}  # future -> the files it is reading
+        visited = set()
+        unlisted = set()  # folders that couldn't be listed (e.g. a share that is offline)
+        processes = None
+        last_report = 0
+        # Every directory listed once, also where library folders overlap
+        submitted = {os.path.normpath(folder) for folder in folders}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {pool.submit(self.scan_directory, folder, cancelled) for folder in submitted}
+            while (pending or reading) and not cancelled.is_set():
+                # Not waiting on a whole batch being read, to notice a cancel
+                done, _ = wait(pending | reading.keys(), timeout=PROGRESS_INTERVAL,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in reading:
+                        files = reading.pop(future)
+                        try:
+                            tracks = future.result()
+                        except BrokenProcessPool:
+                            # A worker died, read its batch here instead and
+                            # start new workers for the next one
+                            tracks = self.read_here(files, cancelled)
+                            processes = None
+                        except Exception as e:
+                            # Read it here a file at a time, read_track can't fail
+                            instruments.error("scan.batch", e)
+                            tracks = self.read_here(files, cancelled)
+                        self.add_read(tracks, progress)
+                        continue
+                    pending.discard(future)
+                    directory, subdirectories, files, changed, removed = future.result()
+                    if removed is None:
+                        unlisted.add(directory)
+                        continue
+                    visited.add(directory)
+                    subdirectories = [subdirectory for subdirectory in subdirectories
+                                      if subdirectory not in submitted]
+                    submitted.update(subdirectories)
+                    pending |= {pool.submit(self.scan_directory, subdirectory, cancelled)
+                                for subdirectory in subdirectories}
+                    progress.folders += 1
+                    progress.files += files
+                    unread.extend(changed)
+                    if removed:
+                        self.results.put(("removed", removed))
+                # Hand out full batches as they fill up, and whatever is left
+                # once every folder has been listed
+                while unread and (len(unread) >= self.batch_size or not pending):
+                    batch, unread = unread[:self.batch_size], unread[self.batch_size:]
+                    if progress.read_started is None:
+                        progress.read_started = time.monotonic()
+                    if processes is None and not (pending or reading) and len(batch) < MIN_PROCESS_BATCH:
+                        self.add_read(self.read_here(batch, cancelled), progress)
+                        continue
+                    try:
+                        if processes is None:
+                            # spawn, not fork: the player process has pygame and Tk running
+                            processes = ProcessPoolExecutor(
+                                max_workers=self.readers, mp_context=multiprocessing.get_context("spawn"))
+                        reading[processes.submit(read_tracks, batch)] = batch
+                    except Exception as e:
+                        # Broken or can't be started at all
+                        if not isinstance(e, BrokenProcessPool):
+                            instruments.error("scan.processes", e)
+                        processes = None
+                        self.add_read(self.read_here(batch, cancelled), progress)
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL or not (pending or reading):
+                    last_report = time.monotonic()
+                    self.results.put(("progress", progress))
+            for future in pending | reading.keys():
+                future.cancel()
+        if processes is not None:
+            processes.shutdown(wait=not cancelled.is_set(), cancel_futures=True)
+        if cancelled.is_set():
+            progress.cancelled = True
+        else:
+            # Whole folders that disappeared since the last scan. Not the ones
+            # under a folder we couldn't list, they may well still be there.
+            gone = set()
+            for folder in folders:
+                gone.update(known for known in self.index.known_folders(os.path.normpath(folder))
+                            if known not in visited and not inside_any(known, unlisted))
+                self.index.add_folder(os.path.normpath(folder))
+            removed = [path for known in sorted(gone) for path in self.index.known_files(known)]
+            if removed:
+                self.index.remove(removed)
+                self.results.put(("removed", removed))
+
+    # A batch of files has been read
+    def add_read(self, tracks, progress):
+        if tracks:
+            self.index.save(tracks)
+            self.results.put(("tracks", tracks))
+        progress.read += len(tracks)
+        progress.read_seconds = time.monotonic() - progress.read_started
+
+    def read_here(self, files, cancelled):
+        tracks = []
+        for file in files:
+            if cancelled.is_set():
+                break
+            tracks.append(read_track(*file))
+        return tracks
+
+    def scan_directory(self, directory, cancelled):
+        subdirectories = []
+        changed = []
+        files = 0
+        if cancelled.is_set():
+            return directory, subdirectories, files, changed, []
+        known = self.index.known_files(directory)
+        seen = set()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            # Nothing is known to be removed from a folder we can't see into
+            return directory, subdirectories, files, changed, None
+        for entry in entries:
+            if cancelled.is_set():
+                # Don't report anything as removed from a half scanned folder
+                return directory, subdirectories, files, changed, []
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(os.path.normpath(entry.path))
+                    continue
+                if not is_audio_file(entry.name) or not entry.is_file():
+                    continue
+                path = os.path.normpath(entry.path)
+                stat = entry.stat()
+            except OSError:
+                continue
+            files += 1
+            seen.add(path)
+            if known.get(path) != (stat.st_mtime_ns, stat.st_size):
+                # Read later in a batch, see run()
+                changed.append((path, stat.st_mtime_ns, stat.st_size, stat.st_ctime))
+        removed = [path for path in known if path not in seen]
+        if removed:
+            self.index.remove(removed)
+        return directory, subdirectories, files, changed, removed
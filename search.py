@@ -0,0 +1,87 @@
+import os
+from array import array
+
+# Search index for the playlist search box.
+# Every track gets one lowercase search string (file name plus ID3 title,
+# artist and album) built once when it is added. A trigram index over those
+# strings narrows a query down to a few candidates, which are then checked with
+# a plain substring test so the results are the same as the old linear search.
+# Typing more letters only filters the previous results.
+#
+# Tracks are the integer ids from track_table.TrackTable; results come back
+# newest first using the table's date column.
+
+
+def search_text(path, title=None, artist=None, album=None):
+    parts = [os.path.basename(path)]
+    parts.extend(part for part in (title, artist, album) if part)
+    return "\n".join(parts).lower()
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    def __init__(self, dates):
+        self.dates = dates  # track id -> date added, shared with the track table
+        self.texts = []  # track id -> search string, None if not searchable
+        self.count = 0
+        self.postings = {}  # trigram -> array of track ids
+        self.last_query = None
+        self.last_results = None
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.__init__(self.dates)
+
+    def add(self, track_id, text):
+        if track_id < len(self.texts) and self.texts[track_id] is not None:
+            self.remove(track_id)
+        if track_id >= len(self.texts):
+            self.texts.extend([None] * (track_id + 1 - len(self.texts)))
+        self.texts[track_id] = text
+        self.count += 1
+        for gram in trigrams(text):
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array("I")
+            posting.append(track_id)
+        self.last_query = None
+
+    def add_track(self, track_id, track):
+        self.add(track_id, search_text(track.path, track.title, track.artist, track.album))
+
+    def remove(self, track_id):
+        if track_id < len(self.texts) and self.texts[track_id] is not None:
+            # Postings keep the id, it just never matches again
+            self.texts[track_id] = None
+            self.count -= 1
+            self.last_query = None
+
+    def search(self, query):
+        # Ids of the tracks matching query, newest first
+        query = query.lower()
+        if not query:
+            return []
+        texts = self.texts
+        if self.last_query is not None and self.last_query in query:
+            # Refining the previous query, only its results can still match
+            matches = [track_id for track_id in self.last_results if query in texts[track_id]]
+        else:
+            if len(query) >= 3:
+                # Every match contains all of the query's trigrams, so the
+                # rarest one gives the smallest set of candidates to check
+                postings = [self.postings.get(gram, ()) for gram in trigrams(query)]
+                candidates = min(postings, key=len)
+            else:
+                candidates = range(len(texts))
+            matches = [track_id for track_id in set(candidates)
+                       if texts[track_id] is not None and query in texts[track_id]]
+            dates = self.dates
+            matches.sort(key=lambda track_id: (-dates[track_id], track_id))
+        self.last_query = query
+        self.last_results = matches
+        return matches
@@ -0,0 +1,50 @@
+import os
+import json
+import playlists
+
+# Saved sessions: what was queued and playing when the player was last used.
+# The small state (current song, position, shuffle, repeat) goes to a JSON
+# file and is rewritten every time; the queue itself is only written when it
+# isn't just the library (a search, a sort or a playlist), as an M3U8
+# playlist, and only when it changed since it was last written. Restoring
+# streams that playlist straight into the queue without looking at the files.
+
+STATE_FILE = "session.json"
+QUEUE_FILE = "session.m3u8"
+
+
+class SessionStore:
+    def __init__(self, folder):
+        self.state_path = os.path.join(folder, STATE_FILE)
+        self.queue_path = os.path.join(folder, QUEUE_FILE)
+        self.saved_queue = None  # (version, length) of the queue last written
+
+    def save(self, player):
+        state = player.session()
+        queue = player.queue
+        if state["filtered"]:
+            stamp = (queue.version, len(queue))
+            if stamp != self.saved_queue:
+                playlists.write_playlist(self.queue_path, player.playlist_entries())
+                self.saved_queue = stamp
+        temporary = self.state_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temporary, self.state_path)
+
+    # (state, queue entries) as saved, None when there is nothing to restore
+    def load(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(state, dict):
+            return None
+        entries = ()
+        if state.get("filtered"):
+            if not os.path.exists(self.queue_path):
+                state["filtered"] = False
+            else:
+                entries = playlists.read_playlist(self.queue_path)
+        return state, entries
@@ -0,0 +1,217 @@
+import os
+import math
+from array import array
+from loudness import track_gain
+
+# Columnar track table.
+# Every track the player knows gets a small integer id. Folders are stored
+# once and tracks only keep the folder's id and their file name (which is also
+# what the playlist shows), and dates and durations live in flat arrays. The
+# library, the play queue and search results are arrays of these ids instead of
+# lists of full path strings.
+#
+# File names and titles aren't Python strings either: they are UTF-8 in one
+# bytearray each, with offsets into it, and decoded when asked for. Finding a
+# path's id goes through an open addressing hash table of ids (an array too)
+# rather than a dict of names, so a track costs its name's bytes and a few
+# array slots.
+#
+# Tags from the scanner are kept here too: artists and albums are interned
+# once (an album's tracks share one string), so sorting and grouping by them
+# needs no file access.
+#
+# Ids are never reused: a path that comes back (rescanned, re-added) gets its
+# old id and its columns are updated in place.
+
+EMPTY = -1  # a free slot in the hash table
+
+
+def encode(text):
+    # surrogatepass: file names that aren't valid UTF-8 come back as they were
+    return text.encode("utf-8", "surrogatepass")
+
+
+def decode(data):
+    return data.decode("utf-8", "surrogatepass")
+
+
+class TrackTable:
+    def __init__(self):
+        self.folders = []  # folder id -> directory
+        self.folder_ids = {}  # directory -> folder id
+        self.folder = array("I")  # track id -> folder id
+        self.name_data = bytearray()  # every file name, shown in the playlist
+        self.name_ends = array("I")  # track id -> where its name ends in name_data
+        self.hashes = array("q")  # track id -> hash of (folder id, name)
+        self.slots = array("i", [EMPTY]) * 1024  # hash table: hash -> track id
+        self.dates = array("d")  # track id -> date added (timestamp)
+        self.durations = array("d")  # track id -> seconds, nan when unknown
+        self.title_data = bytearray()  # ID3 titles, a changed title is appended again
+        self.title_starts = array("I")  # track id -> its title in title_data,
+        self.title_ends = array("I")  # empty for none
+        self.artists = array("I")  # track id -> index into values
+        self.albums = array("I")  # track id -> index into values
+        self.track_numbers = array("H")  # track id -> number on the album, 0 when unknown
+        self.gains = array("d")  # track id -> loudness correction in dB, nan when unknown
+        self.values = [None]  # interned artist and album names
+        self.value_ids = {None: 0}
+
+    def __len__(self):
+        return len(self.folder)
+
+    def intern_folder(self, directory):
+        folder_id = self.folder_ids.get(directory)
+        if folder_id is None:
+            folder_id = len(self.folders)
+            self.folders.append(directory)
+            self.folder_ids[directory] = folder_id
+        return folder_id
+
+    def intern(self, value):
+        value_id = self.value_ids.get(value)
+        if value_id is None:
+            value_id = len(self.values)
+            self.values.append(value)
+            self.value_ids[value] = value_id
+        return value_id
+
+    def name_bytes(self, track_id):
+        return self.name_data[self.name_ends[track_id - 1] if track_id else 0:self.name_ends[track_id]]
+
+    # (slot, track id) for a name in a folder, track id None and slot free
+    # when it isn't in the table
+    def find(self, folder_id, name, key):
+        slots, mask = self.slots, len(self.slots) - 1
+        slot = key & mask
+        while True:
+            track_id = slots[slot]
+            if track_id == EMPTY:
+                return slot, None
+            if (self.hashes[track_id] == key and self.folder[track_id] == folder_id
+                    and self.name_bytes(track_id) == name):
+                return slot, track_id
+            slot = (slot + 1) & mask
+
+    # Twice the slots, at most half of them in use
+    def grow(self):
+        slots = array("i", [EMPTY]) * (2 * len(self.slots))
+        mask = len(slots) - 1
+        for track_id, key in enumerate(self.hashes):
+            slot = key & mask
+            while slots[slot] != EMPTY:
+                slot = (slot + 1) & mask
+            slots[slot] = track_id
+        self.slots = slots
+
+    # Id of path, or None if the table has never seen it
+    def lookup(self, path):
+        directory, name = os.path.split(path)
+        folder_id = self.folder_ids.get(directory)
+        if folder_id is None:
+            return None
+        name = encode(name)
+        return self.find(folder_id, name, hash((folder_id, name)))[1]
+
+    def set_title(self, track_id, title):
+        title = encode(title) if title else b""
+        start, end = self.title_starts[track_id], self.title_ends[track_id]
+        if self.title_data[start:end] != title:
+            self.title_starts[track_id] = len(self.title_data)
+            self.title_data += title
+            self.title_ends[track_id] = len(self.title_data)
+
+    def add(self, path, date_added=0, duration=None, title=None, artist=None, album=None,
+            track_number=None, gain=None):
+        directory, name = os.path.split(path)
+        folder_id = self.intern_folder(directory)
+        name = encode(name)
+        key = hash((folder_id, name))
+        duration = math.nan if duration is None else duration
+        artist, album = self.intern(artist), self.intern(album)
+        track_number = min(track_number or 0, 0xFFFF)
+        gain = math.nan if gain is None else gain
+        slot, track_id = self.find(folder_id, name, key)
+        if track_id is None:
+            track_id = len(self.folder)
+            self.slots[slot] = track_id
+            self.folder.append(folder_id)
+            self.name_data += name
+            self.name_ends.append(len(self.name_data))
+            self.hashes.append(key)
+            self.dates.append(date_added or 0)
+            self.durations.append(duration)
+            self.title_starts.append(0)
+            self.title_ends.append(0)
+            self.artists.append(artist)
+            self.albums.append(album)
+            self.track_numbers.append(track_number)
+            self.gains.append(gain)
+            if 2 * len(self.folder) > len(self.slots):
+                self.grow()
+        else:
+            self.dates[track_id] = date_added or 0
+            self.durations[track_id] = duration
+            self.artists[track_id] = artist
+            self.albums[track_id] = album
+            self.track_numbers[track_id] = track_number
+            self.gains[track_id] = gain
+        self.set_title(track_id, title)
+        return track_id
+
+    def add_track(self, track):
+        return self.add(track.path, track.date_added, track.duration, track.title,
+                        track.artist, track.album, track.track_number,
+                        track_gain(track.loudness, track.peak))
+
+    def path(self, track_id):
+        return os.path.join(self.folders[self.folder[track_id]], self.name(track_id))
+
+    def name(self, track_id):
+        return decode(self.name_bytes(track_id))
+
+    def title(self, track_id):
+        start, end = self.title_starts[track_id], self.title_ends[track_id]
+        return decode(self.title_data[start:end]) if end > start else None
+
+    def artist(self, track_id):
+        return self.values[self.artists[track_id]]
+
+    def album(self, track_id):
+        return self.values[self.albums[track_id]]
+
+    def track_number(self, track_id):
+        return self.track_numbers[track_id] or None
+
+    # Sort key for track ids: "artist" (then album and track number), "album"
+    # (then track number) or "title". Untagged tracks go by file name.
+    def sort_key(self, by):
+        values, name = self.values, self.name
+        if by == "title":
+            title = self.title
+            return lambda track_id: (title(track_id) or name(track_id)).lower()
+        albums, numbers = self.albums, self.track_numbers
+        if by == "album":
+            return lambda track_id: ((values[albums[track_id]] or "").lower(),
+                                     numbers[track_id], name(track_id).lower())
+        if by == "artist":
+            artists = self.artists
+            return lambda track_id: ((values[artists[track_id]] or "").lower(),
+                                     (values[albums[track_id]] or "").lower(),
+                                     numbers[track_id], name(track_id).lower())
+        raise ValueError(f"Can't sort by {by!r}")
+
+    def duration(self, track_id):
+        # None when we don't know it yet
+        duration = self.durations[track_id]
+        return None if math.isnan(duration) else duration
+
+    def set_duration(self, track_id, duration):
+        self.durations[track_id] = math.nan if duration is None else duration
+
+    def gain(self, track_id):
+        # dB, None when the track hasn't been analysed
+        gain = self.gains[track_id]
+        return None if math.isnan(gain) else gain
+
+    def set_gain(self, track_id, gain):
+        self.gains[track_id] = math.nan if gain is None else gain
@@ -0,0 +1,161 @@
+import os
+import mmap
+import queue
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Waveform overviews for the seek bar.
+# Every track's overview is the same size (BINS min/max pairs of int8), so
+# they live in one fixed-size file used as an open-addressing hash table and
+# read through mmap: looking one up is a hash and a slice, whatever the track's
+# length. Keys include the file's mtime and size, so a changed file just misses.
+#
+# Envelopes are made in a worker process with NumPy (decoding is done the same
+# way as loudness.py does it), so neither Tk nor the playback engine waits for
+# them.
+
+BINS = 400  # points across the seek bar
+KEY_SIZE = 16
+RECORD_SIZE = KEY_SIZE + 2 * BINS
+MAX_PROBES = 8
+EMPTY_KEY = bytes(KEY_SIZE)
+
+
+def compute_envelope(path):
+    # (mins, maxs) as BINS int8 values each, None if the file can't be decoded
+    import numpy as np
+    import loudness
+    try:
+        decoded = None
+        if path.lower().endswith(".wav"):
+            try:
+                decoded = loudness.read_wav(path)
+            except Exception:
+                pass
+        _, _, chunks = decoded or loudness.read_with_pygame(path)
+        # Min/max of small fixed blocks while decoding, then of the blocks per bin
+        block = 1024
+        mins, maxs = [], []
+        for samples in chunks:
+            mono = samples.mean(axis=1)
+            count = -(-len(mono) // block)
+            mono = np.pad(mono, (0, count * block - len(mono)), mode="edge").reshape(count, block)
+            mins.append(mono.min(axis=1))
+            maxs.append(mono.max(axis=1))
+    except Exception:
+        return None
+    if not mins:
+        return None
+    mins, maxs = np.concatenate(mins), np.concatenate(maxs)
+    edges = np.linspace(0, len(mins), BINS + 1).astype(np.int64)[:-1]
+    edges = np.minimum(edges, len(mins) - 1)
+    mins = np.minimum.reduceat(mins, edges)
+    maxs = np.maximum.reduceat(maxs, edges)
+    return (np.clip(mins * 127, -127, 127).astype(np.int8).tobytes(),
+            np.clip(maxs * 127, -127, 127).astype(np.int8).tobytes())
+
+
+class WaveformCache:
+    def __init__(self, cache_path, capacity=16384):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        size = capacity * RECORD_SIZE
+        if not os.path.exists(cache_path):
+            open(cache_path, "wb").close()
+        self.file = open(cache_path, "r+b")
+        if os.path.getsize(cache_path) != size:
+            # New, or made with another capacity: start over (sparse on most systems)
+            self.file.truncate(0)
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.results = queue.Queue()  # (path, found) as envelopes are made
+        self.workers = None
+        self.pending = set()
+
+    @staticmethod
+    def key(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        text = f"{path}\0{stat.st_mtime_ns}\0{stat.st_size}"
+        return hashlib.blake2b(text.encode("utf-8", "surrogateescape"), digest_size=KEY_SIZE).digest()
+
+    def slots(self, key):
+        start = int.from_bytes(key[:8], "little") % self.capacity
+        return ((start + probe) % self.capacity for probe in range(MAX_PROBES))
+
+    # (mins, maxs) bytes for path, None if it isn't cached
+    def get(self, path, key=None):
+        key = key or self.key(path)
+        if key is None:
+            return None
+        with self.lock:
+            for slot in self.slots(key):
+                offset = slot * RECORD_SIZE
+                stored = self.map[offset:offset + KEY_SIZE]
+                if stored == key:
+                    offset += KEY_SIZE
+                    return self.map[offset:offset + BINS], self.map[offset + BINS:offset + 2 * BINS]
+                if stored == EMPTY_KEY:
+                    return None
+        return None
+
+    def put(self, key, mins, maxs):
+        with self.lock:
+            if self.map.closed:
+                return
+            slots = list(self.slots(key))
+            # An empty slot or our own old one, otherwise push out the first
+            target = slots[0]
+            for slot in slots:
+                stored = self.map[slot * RECORD_SIZE:slot * RECORD_SIZE + KEY_SIZE]
+                if stored in (key, EMPTY_KEY):
+                    target = slot
+                    break
+            offset = target * RECORD_SIZE
+            self.map[offset:offset + KEY_SIZE] = EMPTY_KEY
+            self.map[offset + KEY_SIZE:offset + RECORD_SIZE] = mins + maxs
+            self.map[offset:offset + KEY_SIZE] = key
+
+    # Make the envelope for path in the background unless it is cached; the
+    # path comes out of `results` when it is ready
+    def request(self, path):
+        key = self.key(path)
+        if key is None or path in self.pending or self.get(path, key) is not None:
+            return
+        if self.workers is None:
+            import loudness
+            self.workers = ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                initializer=loudness.start_worker)
+        self.pending.add(path)
+        try:
+            future = self.workers.submit(compute_envelope, path)
+        except RuntimeError:  # shut down, or the worker died
+            self.pending.discard(path)
+            self.workers = None
+            return
+        future.add_done_callback(lambda future: self.finished(path, key, future))
+
+    def finished(self, path, key, future):
+        # Runs on the pool's thread. The path leaves pending last, so whoever
+        # polls `results` while anything is pending doesn't miss it.
+        try:
+            envelope = future.result()
+        except Exception:
+            envelope = None
+        if envelope is not None:
+            self.put(key, *envelope)
+        self.results.put((path, envelope is not None))
+        self.pending.discard(path)
+
+    def close(self):
+        if self.workers is not None:
+            self.workers.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
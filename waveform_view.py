@@ -0,0 +1,67 @@
+from tkinter import Canvas
+from waveform import BINS
+
+# Seek bar that shows the track's waveform.
+# One vertical line per envelope bin is created up front and only ever
+# recoloured or resized, so a progress update touches just the bins the
+# playhead crossed since the last one and drawing a new track touches BINS
+# items, however long the track is. Without an envelope (not made yet, or
+# undecodable) it is a plain flat bar.
+#
+# Has the bits of the ttk.Progressbar interface the player uses: set_maximum,
+# set_value, stop and clicks bound with bind().
+
+
+class WaveformBar(Canvas):
+    def __init__(self, master, length=400, height=40, **kwargs):
+        super().__init__(master, width=length, height=height, highlightthickness=0, **kwargs)
+        self.length = length
+        self.bar_height = height
+        self.played_colour = "#0078d7"
+        self.unplayed_colour = "#b8b8b8"
+        self.maximum = 0
+        self.value = 0
+        self.played = 0  # bins drawn in the played colour
+        step = length / BINS
+        self.lines = [self.create_line(int(i * step), height // 2, int(i * step), height // 2 + 1,
+                                       fill=self.unplayed_colour, width=max(1, int(step)))
+                      for i in range(BINS)]
+        self.set_envelope(None)
+
+    # mins/maxs: BINS signed bytes each (waveform.WaveformCache.get), or None
+    def set_envelope(self, envelope):
+        middle = self.bar_height / 2
+        scale = (self.bar_height / 2 - 1) / 127
+        step = self.length / BINS
+        if envelope is not None:
+            mins, maxs = (memoryview(values).cast("b") for values in envelope)
+        for i, line in enumerate(self.lines):
+            if envelope is None:
+                low, high = -2, 2
+            else:
+                low, high = mins[i] * scale, max(maxs[i] * scale, mins[i] * scale + 1)
+            x = int(i * step)
+            self.coords(line, x, middle - high, x, middle - low)
+
+    def set_maximum(self, maximum):
+        self.maximum = maximum
+        self.redraw_progress()
+
+    def set_value(self, value):
+        self.value = value
+        self.redraw_progress()
+
+    def stop(self):
+        self.set_value(0)
+
+    def redraw_progress(self):
+        played = 0
+        if self.maximum > 0:
+            played = min(BINS, max(0, int(self.value / self.maximum * BINS)))
+        if played > self.played:
+            for line in self.lines[self.played:played]:
+                self.itemconfigure(line, fill=self.played_colour)
+        elif played < self.played:
+            for line in self.lines[played:self.played]:
+                self.itemconfigure(line, fill=self.unplayed_colour)
+        self.played = played